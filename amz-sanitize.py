@@ -5,9 +5,16 @@ some fixed number of lines per CSV file.
 """
 import os
 import sys
-import json
 import time
+import zlib
+import shutil
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import amz_io
+import amz_json
+import amz_shard
+import amz_columnar
 
 
 # Determines whether the resultant CSV file should be split
@@ -21,6 +28,23 @@ split_train_test = True
 # ratio of 0.8 is 8 training samples to 2 testing samples (8:2)
 split_train_to_test_ratio = 0.8
 
+# Determines whether the dataset is converted in a single streaming
+# pass instead of first counting its lines.
+#
+# In streaming mode, the training/testing membership of each review
+# is decided on the fly by a deterministic hash of `split_hash_key`
+# (see below) against `split_train_to_test_ratio`, and progress is
+# reported from the byte offset into the dataset file. The split ratio
+# then only holds approximately, and reviews are no longer split by
+# their position in the file.
+streaming_split = False
+
+# The JSON key whose value is hashed to decide the training/testing
+# membership of a review in streaming mode. Hashing the `asin` keeps all
+# reviews of an item on the same side of the split. A value of `None`
+# hashes the whole raw line instead.
+split_hash_key = "asin"
+
 # The datasets will be processed in `line_block_size`
 # chunks, i.e. every `line_block_size` lines of a
 # corpus file.
@@ -37,6 +61,20 @@ line_block_size = 2 ** 18
 # CSV.
 max_dataset_portion = 1
 
+# The number of worker processes used to convert the dataset.
+#
+# A value of 1 converts the dataset serially in this process. Any
+# other value splits `raw/json` into newline-aligned byte ranges and
+# converts each range in its own worker process, where a value < 1
+# means one worker per available core. The resulting CSV files are
+# identical to those of a serial run.
+worker_processes = 1
+
+# The number of byte ranges assigned to each worker process when
+# converting in parallel. Several smaller ranges per worker keep all
+# cores busy when some ranges happen to convert faster than others.
+ranges_per_worker = 4
+
 # The number of bytes to use as the read buffer for
 # the input files.
 #
@@ -62,6 +100,16 @@ write_table_header = False
 # Defines the specific keys to extract from the JSON data.
 extract_targets = [ "reviewText", "overall", 'asin' ]
 
+# The format of the sanitized output files, either "csv" or "columnar".
+#
+# The "columnar" format is the binary format described in
+# `amz_columnar`, written to `col-train`/`col-test` (or `col`) in place
+# of the CSV files. It always holds the review text, the `overall`
+# rating and the `asin` regardless of `extract_targets`, keeps the
+# texts unmodified, and is read by the downstream scripts without any
+# CSV parsing.
+output_format = "csv"
+
 
 def _format_csv_cell(obj):
     return '"' + str(obj).replace('\"', '\'') + '"'
@@ -74,31 +122,262 @@ def _join_csv_row(*objs):
 
 _extract_targets_header = _join_csv_row(*extract_targets)
 
+# The keys written to each row of the output, in order.
+_output_targets = [ "reviewText", "overall", "asin" ] if output_format == "columnar" else extract_targets
+
+_extract_targets_projector = amz_json.projector(_output_targets)
+
+
+class _CsvOutput:
+	def __init__(self, csv_f, header):
+		self.csv_h = csv_f.open(mode="w", buffering=max_write_buffer)
+		if header and write_table_header:
+			self.csv_h.write(f"{_extract_targets_header}\n")
+
+	def write_row(self, *values):
+		parsed_str = _join_csv_row(*values)
+		self.csv_h.write(f"{parsed_str}\n")
+
+	def close(self):
+		self.csv_h.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def _output_path(csv_f):
+	"""
+	Returns the path the output destined for `csv_f` is written to in the
+	configured `output_format`.
+	"""
+	if output_format == "columnar":
+		return amz_columnar.col_path(csv_f)
+	return csv_f
+
+
+def _open_output(csv_f, header=True):
+	"""
+	Opens the output for `csv_f` in the configured `output_format`. The
+	returned writer takes the values of `_output_targets` in `write_row`.
+	"""
+	out_f = _output_path(csv_f)
+	if output_format == "columnar":
+		return amz_columnar.ColumnarWriter(out_f, buffering=max_write_buffer)
+	return _CsvOutput(out_f, header)
+
+
+def _partition_lines(ds_lines):
+	"""
+	Computes the number of lines to convert in total, into the training
+	set, and into the testing set given the number of lines in the dataset.
+	"""
+	ds_max_lines = int(ds_lines * max_dataset_portion)
+	ds_train_lines = int(ds_max_lines * split_train_to_test_ratio)
+	ds_test_lines = int(ds_max_lines * (1 - split_train_to_test_ratio))
+	return ds_max_lines, ds_train_lines, ds_test_lines
+
+
+def _convert_range(json_f, start, end, lnum, line_limits, part_fs):
+	"""
+	Converts the byte range `[start, end)` of `json_f`, whose first line is
+	the `lnum`-th line of the dataset, into the part files `part_fs`.
+
+	`line_limits` holds the cumulative line number at which each part file
+	ends, i.e. a line goes to the first part file whose limit exceeds its
+	line number. Lines past the last limit are not converted.
+	"""
+	part_hs = [ _open_output(part_f, header=False) for part_f in part_fs ]
+	try:
+		part = 0
+		for raw_str in amz_shard.f_range_lines(json_f, start, end, buffering=max_read_buffer):
+			while part < len(line_limits) and lnum >= line_limits[part]:
+				part += 1
+			if part == len(line_limits):
+				break
+
+			part_hs[part].write_row(*_extract_targets_projector(raw_str))
+			lnum += 1
+	finally:
+		for part_h in part_hs:
+			part_h.close()
+
+
+def raw_to_csv_parallel(ds_amz):
+	raw = ds_amz.joinpath("raw")
+	json_f = amz_io.raw_json_path(raw)
+	workers = amz_shard.worker_count(worker_processes)
+
+	# Compressed dumps cannot be split into byte ranges.
+	if amz_io.is_compressed(json_f):
+		print(f"{json_f} is compressed and will be converted serially")
+		return raw_to_csv(ds_amz)
+
+	tm_whole_start = time.monotonic_ns()
+
+	# Split the dataset into byte ranges and count the lines of each range
+	# in parallel, so that every line can be assigned to the same output
+	# file as in a serial run.
+	print(f"Gathering {ds_amz} size information with {workers} workers...")
+	ranges = amz_shard.f_byte_ranges(json_f, workers * ranges_per_worker)
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		range_lines = list(executor.map(
+			amz_shard.f_range_line_count,
+			[ json_f ] * len(ranges),
+			[ start for start, _ in ranges ],
+			[ end for _, end in ranges ]))
+
+		ds_max_lines, ds_train_lines, ds_test_lines = _partition_lines(sum(range_lines))
+		if split_train_test:
+			print("Splitting dataset into training/testing with ratio %.1f%%" % (100 * split_train_to_test_ratio))
+			csv_fs = [ raw.joinpath("csv-train"), raw.joinpath("csv-test") ]
+			line_limits = [ ds_train_lines, ds_train_lines + ds_test_lines ]
+		else:
+			print("Dataset will NOT be split into training/testing partitions!")
+			csv_fs = [ raw.joinpath("csv") ]
+			line_limits = [ ds_max_lines ]
+
+		# Convert every range that contains at least one line to keep into
+		# its own set of part files.
+		print(f"Processing {ds_amz} as %.1f%% dataset in {len(ranges)} ranges..." % (100 * max_dataset_portion))
+		futures = []
+		range_parts = []
+		lnum = 0
+		for i, (start, end) in enumerate(ranges):
+			if lnum >= line_limits[-1]:
+				break
+			part_fs = [ csv_f.with_name(f"{csv_f.name}.part{i}") for csv_f in csv_fs ]
+			futures.append(executor.submit(_convert_range, json_f, start, end, lnum, line_limits, part_fs))
+			range_parts.append(part_fs)
+			lnum += range_lines[i]
+
+		for i, future in enumerate(futures):
+			future.result()
+			print(f"[%5.1f%%] Processed range {i + 1}/{len(futures)}" % (100 * (i + 1) / len(futures)))
+
+	# Concatenate the part files in dataset order.
+	for j, csv_f in enumerate(csv_fs):
+		part_outs = [ _output_path(part_fs[j]) for part_fs in range_parts ]
+		if output_format == "columnar":
+			amz_columnar.concat(_output_path(csv_f), part_outs)
+		else:
+			with csv_f.open(mode="w", buffering=max_write_buffer) as csv_h:
+				if write_table_header:
+					csv_h.write(f"{_extract_targets_header}\n")
+				for part_out in part_outs:
+					with part_out.open(mode="r", buffering=max_read_buffer) as part_h:
+						shutil.copyfileobj(part_h, csv_h, max_write_buffer)
+		for part_out in part_outs:
+			part_out.unlink()
+
+	tm_whole_end = time.monotonic_ns()
+	elapsed = 1e-9 * (tm_whole_end - tm_whole_start)
+
+	print(f"Converted dataset {ds_amz} in %.2fs" % (elapsed))
+
+
+def _hash_fraction(key):
+	"""
+	Maps `key` deterministically, independent of the interpreter's hash
+	seed, to a fraction in the range [0, 1).
+	"""
+	if not isinstance(key, bytes):
+		key = str(key).encode("utf-8")
+	return zlib.crc32(key) / 2 ** 32
+
+
+def raw_to_csv_streaming(ds_amz):
+	raw = ds_amz.joinpath("raw")
+	json_f = amz_io.raw_json_path(raw)
+
+	ds_bytes = json_f.stat().st_size
+	ds_max_bytes = int(ds_bytes * max_dataset_portion)
+	ds_offset = 0
+
+	project = _extract_targets_projector
+	if split_train_test and split_hash_key is not None:
+		project = amz_json.projector(_output_targets + [ split_hash_key ])
+	lnum = 0
+	train_lines = 0
+	test_lines = 0
+
+	if split_train_test:
+		print("Splitting dataset into training/testing with ratio %.1f%% by hash of %s" % (100 * split_train_to_test_ratio, split_hash_key or "line"))
+		csv_fs = [ raw.joinpath("csv-train"), raw.joinpath("csv-test") ]
+	else:
+		print("Dataset will NOT be split into training/testing partitions!")
+		csv_fs = [ raw.joinpath("csv") ]
+
+	print(f"Processing {ds_amz} as %.1f%% dataset in a single pass..." % (100 * max_dataset_portion))
+	csv_hs = [ _open_output(csv_f) for csv_f in csv_fs ]
+	try:
+		tm_whole_start = time.monotonic_ns()
+		tm_block_start = time.monotonic_ns()
+		with amz_io.open_raw_json(json_f, mode="rb", buffering=max_read_buffer) as json_h:
+			for raw_str in json_h:
+				offset = amz_io.compressed_offset(json_h)
+				ds_offset = ds_offset + len(raw_str) if offset is None else offset
+
+				values = project(raw_str)
+
+				is_training = True
+				if split_train_test:
+					key = raw_str if split_hash_key is None else values[-1]
+					is_training = _hash_fraction(key) < split_train_to_test_ratio
+
+				values = values[:len(_output_targets)]
+				if is_training:
+					csv_hs[0].write_row(*values)
+					train_lines += 1
+				else:
+					csv_hs[1].write_row(*values)
+					test_lines += 1
+
+				lnum += 1
+				if lnum % line_block_size == 0:
+					tm_block_end = time.monotonic_ns()
+					percentage = 100 * min(ds_offset, ds_max_bytes) / ds_max_bytes
+					elapsed = 1e-9 * (tm_block_end - tm_block_start)
+					print(f"[%5.1f%%] Processed {lnum} lines ({ds_offset} bytes) in %.2fs" % (percentage, elapsed))
+					tm_block_start = time.monotonic_ns()
+
+				if max_dataset_portion < 1 and ds_offset >= ds_max_bytes:
+					break
+	finally:
+		for csv_h in csv_hs:
+			csv_h.close()
+
+	tm_whole_end = time.monotonic_ns()
+	elapsed = 1e-9 * (tm_whole_end - tm_whole_start)
+
+	if split_train_test:
+		print(f"Wrote {train_lines} training and {test_lines} testing lines")
+	print(f"Converted dataset {ds_amz} in %.2fs" % (elapsed))
+
 
 def raw_to_csv(ds_amz):
 	from math import ceil
 
 	# Setup information
 	raw = ds_amz.joinpath("raw")
-	json_f = raw.joinpath("json")
+	json_f = amz_io.raw_json_path(raw)
 
 	tm_block_start = tm_block_end = None
 	tm_whole_start = tm_whole_end = None
 
 	# Gather dataset size information
 	print(f"Gathering {ds_amz} size information...")
-	ds_lines = 1
-	with json_f.open(mode="r", buffering=max_read_buffer) as json_h:
+	ds_lines = 0
+	with amz_io.open_raw_json(json_f, mode="r", buffering=max_read_buffer) as json_h:
 		for i, _ in enumerate(json_h):
 			ds_lines += 1
-	ds_max_lines = int(ds_lines * max_dataset_portion)
-	ds_train_lines = int(ds_max_lines * split_train_to_test_ratio)
-	ds_test_lines = int(ds_max_lines * (1 - split_train_to_test_ratio))
+	ds_max_lines, ds_train_lines, ds_test_lines = _partition_lines(ds_lines)
 	ds_max_blocks = (int(ceil(ds_max_lines / line_block_size)))
 
 	# Define common helper functions and state
 	ds_cur_block = 0 
-	target_values = [ None ] * len(extract_targets)
 	lnum = 0
 
 	def _print_feedback_if_ready(final):
@@ -120,22 +399,16 @@ def raw_to_csv(ds_amz):
 		tm_block_start = time.monotonic_ns()
 
 	def _parse_line_write_to_csv(raw_str, csv_h):
-		nonlocal target_values 
 		nonlocal lnum
 
-		parsed_obj = json.loads(raw_str)
-		for i, field in enumerate(extract_targets):
-			target_values[i] = parsed_obj[field]
-
-		parsed_str = _join_csv_row(*target_values)
-		csv_h.write(f"{parsed_str}\n")
+		csv_h.write_row(*_extract_targets_projector(raw_str))
 
 		_print_feedback_if_ready(False)
 		lnum += 1
 
 	# Begin the actual processing
 	print(f"Processing {ds_amz} as %.1f%% dataset..." % (100 * max_dataset_portion))
-	with json_f.open(mode="r", buffering=max_read_buffer) as json_h:
+	with amz_io.open_raw_json(json_f, mode="r", buffering=max_read_buffer) as json_h:
 		tm_whole_start = time.monotonic_ns()
 		tm_block_start = time.monotonic_ns() # one-time startup thing for user feedback purposes
 
@@ -143,20 +416,14 @@ def raw_to_csv(ds_amz):
 			print("Splitting dataset into training/testing with ratio %.1f%%" % (100 * split_train_to_test_ratio))
 			csv_f_train = raw.joinpath("csv-train")
 			csv_f_test = raw.joinpath("csv-test")
-			csv_h = csv_f_train.open(mode="w", buffering=max_write_buffer)
-
-			if write_table_header:
-				csv_h.write(f"{_extract_targets_header}\n")
+			csv_h = _open_output(csv_f_train)
 
 			print("Processing training set...")
 			for i in range(ds_train_lines):
 				_parse_line_write_to_csv(json_h.readline(), csv_h)
 			
 			csv_h.close()
-			csv_h = csv_f_test.open(mode="w", buffering=max_write_buffer)
-
-			if write_table_header:
-				csv_h.write(f"{_extract_targets_header}\n")
+			csv_h = _open_output(csv_f_test)
 
 			print("Processing testing set...")
 			for i in range(ds_test_lines):
@@ -166,9 +433,7 @@ def raw_to_csv(ds_amz):
 		else:
 			print("Dataset will NOT be split into training/testing partitions!")
 			csv_f = raw.joinpath("csv")
-			with csv_f.open(mode="w", buffer=max_write_buffer) as csv_h:
-				if write_table_header:
-					csv_h.write(f"{_extract_targets_header}\n")
+			with _open_output(csv_f) as csv_h:
 				for i in range(ds_max_lines):
 					_parse_line_write_to_csv(json_h.readline(), csv_h)
 
@@ -194,10 +459,19 @@ if __name__ == "__main__":
 		print("extract_targets must be defined with at least one field (column name)")
 		sys.exit(3)
 
+	if output_format not in ("csv", "columnar"):
+		print("output_format must be either \"csv\" or \"columnar\"")
+		sys.exit(4)
+
 	# begin data processing
 	data = Path("data")
 	for dataset in data.iterdir():
 		is_amazon = dataset.name.startswith("amz")
 		if is_amazon:
 			print(f"Converting dataset {dataset}")
-			raw_to_csv(dataset)
+			if streaming_split:
+				raw_to_csv_streaming(dataset)
+			elif worker_processes == 1:
+				raw_to_csv(dataset)
+			else:
+				raw_to_csv_parallel(dataset)
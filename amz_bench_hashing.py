@@ -0,0 +1,102 @@
+"""
+Benchmarks the hash mode of `amz_gen_vector_tables` against the
+vocabulary-based `CountVectorizer` of `nltk_sentiment_analysis.py` on a
+reduced dataset, by default the one written by `amz_uday_reduce.py`.
+
+The reviews of `csv-train` and `csv-test` are vectorized into unigrams
+and bigrams, once by `CountVectorizer`, which fits a vocabulary on the
+training set first, and once per bucket count of `bench_buckets` by
+hashing, which needs no fit. Each is timed, then run again under
+`tracemalloc` for its peak memory, and a `LinearSVC` fit on its
+training vectors is scored on the test vectors, a review being positive
+if its rating is > 3.
+
+The bigrams of `CountVectorizer` overlap while those of the hash mode
+do not, as in the rest of the scripts, so accuracies differ by more
+than the collisions.
+"""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+import amz_columnar
+import amz_gen_vector_tables
+
+
+# The reduced dataset to benchmark with.
+bench_ds = Path("data/amz-electronics")
+
+# The bucket counts of the hash mode to benchmark.
+bench_buckets = ( 2 ** 14, 2 ** 16, 2 ** 18, 2 ** 20 )
+
+# The regularization of the SVM, as in `nltk_sentiment_analysis.py`.
+svm_c = 0.5
+
+
+def _vocabulary_vectors(train, test):
+	from sklearn.feature_extraction.text import CountVectorizer
+	vectorizer = CountVectorizer(binary=True, ngram_range=(1, 2), stop_words=['in','of','at','a','the'])
+	vectorizer.fit([ text for text, _ in train ])
+	x = vectorizer.transform([ text for text, _ in train ])
+	x_test = vectorizer.transform([ text for text, _ in test ])
+	return x, x_test, f"{len(vectorizer.vocabulary_)} n-grams in the vocabulary"
+
+
+def _hash_vectors(buckets):
+	def vectors(train, test):
+		from scipy.sparse import hstack
+		columns = amz_gen_vector_tables.HashColumns(buckets)
+		features = [ ("all_uni", 1, columns), ("all_bi", 2, columns) ]
+		matrices = []
+		for rows in (train, test):
+			builders, _ = amz_gen_vector_tables.vectorize(((row, None) for row in rows), features, buckets)
+			matrices.append(hstack([ builders[name].tocsr() for name, _, _ in features ], format="csr"))
+		return matrices[0], matrices[1], f"{buckets} buckets"
+	return vectors
+
+
+def _accuracy(x, x_test, train, test):
+	from sklearn.svm import LinearSVC
+	y = np.array([ int(rating) > 3 for _, rating in train ])
+	y_test = np.array([ int(rating) > 3 for _, rating in test ])
+	svm = LinearSVC(C=svm_c)
+	svm.fit(x, y)
+	return (svm.predict(x_test) == y_test).mean()
+
+
+def _bench(name, vectorize, train, test):
+	start = time.perf_counter()
+	x, x_test, info = vectorize(train, test)
+	seconds = time.perf_counter() - start
+
+	tracemalloc.start()
+	vectorize(train, test)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	accuracy = _accuracy(x, x_test, train, test)
+	print(f"{name}: {info}")
+	print("  %8.3fs %10.0f reviews/s" % (seconds, (len(train) + len(test)) / seconds))
+	print("  peak memory %.1f MB, %d non-zero entries" % (peak / 2 ** 20, x.nnz + x_test.nnz))
+	print("  svm accuracy %.2f%%" % (100 * accuracy))
+
+
+def bench(amz_ds):
+	raw = amz_ds.joinpath("raw")
+	print(f"Loading {raw}...")
+	train = list(amz_columnar.read_rows(raw.joinpath("csv-train")))
+	test = list(amz_columnar.read_rows(raw.joinpath("csv-test")))
+	print(f"Benchmarking {len(train)} training and {len(test)} testing reviews...")
+
+	_bench("vocabulary", _vocabulary_vectors, train, test)
+	for buckets in bench_buckets:
+		_bench("hash", _hash_vectors(buckets), train, test)
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		bench_ds = Path(sys.argv[1])
+	bench(bench_ds)
@@ -0,0 +1,125 @@
+"""
+Benchmarks the cold start of the scripts, i.e. how long importing each
+entry point takes in a fresh interpreter before it has done any work.
+
+Each module of `import_budgets` is imported `bench_runs` times in a new
+interpreter with `-X importtime`, and the fastest run is compared with
+its budget. For modules over budget, the slowest imports they pull in
+are listed. Exits with a non-zero status if any module is over budget,
+so it can guard against a heavy import creeping back in at the top of a
+module. Models and libraries that only some runs need are loaded on
+first use through `amz_models` instead.
+
+The scripts of `script_budgets` run their analysis at import, so each
+is run instead, from an empty directory where its dataset is missing.
+It fails on reading the dataset before any model or library that only
+its later steps need is loaded, and the imports of the script itself,
+i.e. those a bare interpreter does not make, are compared with its
+budget.
+"""
+import sys
+import tempfile
+import subprocess
+from pathlib import Path
+
+
+# The modules to import and the seconds each may take to import.
+import_budgets = {
+	"amz_gen_feature_index_table": 1.0,
+	"amz_gen_vector_tables": 1.0,
+	"amz_nb": 1.0,
+	"amz_pos": 1.0,
+	"amz_reduce": 1.0,
+	"amz_uday_reduce": 1.0,
+	"amz_index": 1.0,
+	"amz_stat": 1.0,
+}
+
+# The scripts to run against a missing dataset and the seconds their
+# imports may take.
+script_budgets = {
+	"nltk_sentiment_analysis.py": 1.0,
+}
+
+# The number of fresh interpreters each module is imported in.
+bench_runs = 3
+
+# The number of slowest imports listed for a module over budget.
+report_imports = 8
+
+
+def _run_importtime(args, cwd=None):
+	"""
+	Runs `args` in a fresh interpreter with `-X importtime` and returns its
+	result, the cumulative import time of every module it imported, in
+	seconds, by name, the names of those imported at the top level, i.e.
+	not by another module, and the other lines of its stderr.
+	"""
+	result = subprocess.run(
+		[ sys.executable, "-X", "importtime", *args ],
+		capture_output=True, text=True, cwd=cwd)
+	times = {}
+	top_level = []
+	errors = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "|" not in line:
+			errors.append(line)
+			continue
+		_, cumulative, name = line[len("import time:"):].split("|")
+		if cumulative.strip().isdigit():
+			times[name.strip()] = int(cumulative) / 1e6
+			# nested imports are indented past the one space of the separator
+			if not name.startswith("  "):
+				top_level.append(name.strip())
+	return result, times, top_level, errors
+
+
+def _import_times(module):
+	"""
+	Imports `module` in a fresh interpreter and returns the cumulative
+	import time of every module it imported, in seconds, by name.
+	"""
+	result, times, _, errors = _run_importtime([ "-c", f"import {module}" ])
+	if result.returncode != 0:
+		raise RuntimeError(f"importing {module} failed:\n" + "\n".join(errors))
+	return times
+
+
+def _script_import_times(script):
+	"""
+	Runs `script` in a fresh interpreter from an empty directory and
+	returns the cumulative import time of every module it imported, in
+	seconds, by name, along with their total under the name of `script`.
+	"""
+	_, _, startup, _ = _run_importtime([ "-c", "pass" ])
+	script_f = Path(__file__).resolve().with_name(script)
+	with tempfile.TemporaryDirectory() as empty_d:
+		_, times, top_level, errors = _run_importtime([ str(script_f) ], cwd=empty_d)
+	if not errors or not errors[-1].startswith("FileNotFoundError"):
+		raise RuntimeError(f"running {script} did not stop at its missing dataset:\n" + "\n".join(errors))
+	times[script] = sum(times[name] for name in top_level if name not in startup)
+	return times
+
+
+def bench():
+	over_budget = []
+	budgets = [ (module, budget, _import_times) for module, budget in import_budgets.items() ]
+	budgets += [ (script, budget, _script_import_times) for script, budget in script_budgets.items() ]
+	for module, budget, import_times in budgets:
+		runs = [ import_times(module) for _ in range(bench_runs) ]
+		times = min(runs, key=lambda times: times[module])
+		seconds = times[module]
+		print("%-32s %8.3fs  budget %6.3fs  %s" % (module, seconds, budget, "ok" if seconds <= budget else "OVER"))
+		if seconds > budget:
+			over_budget.append(module)
+			slowest = sorted((name for name in times if name != module), key=times.get, reverse=True)
+			for name in slowest[:report_imports]:
+				print("    %-28s %8.3fs" % (name, times[name]))
+	return over_budget
+
+
+if __name__ == "__main__":
+	over_budget = bench()
+	if over_budget:
+		print(f"Over budget: {', '.join(over_budget)}")
+		sys.exit(1)
@@ -0,0 +1,70 @@
+"""
+Benchmarks the field projector in `amz_json` against full decoding
+with `json.loads` on the electronics dataset.
+
+Both readers extract the same keys from the first `bench_lines`
+lines of `data/amz-electronics/raw/json`, the results are checked
+for equality, and the throughput of each is printed.
+"""
+import sys
+import json
+import time
+from pathlib import Path
+
+import amz_json
+
+
+# The dataset file to benchmark against.
+bench_json_f = Path("data/amz-electronics/raw/json")
+
+# The number of lines to benchmark with. A value of `None` reads
+# the whole file.
+bench_lines = 2 ** 18
+
+# The keys to extract from every line.
+bench_keys = [ "reviewText", "overall", "asin" ]
+
+
+def _load_lines(json_f):
+	lines = []
+	with json_f.open(mode="r", buffering=2 ** 21) as json_h:
+		for line in json_h:
+			lines.append(line)
+			if len(lines) == bench_lines:
+				break
+	return lines
+
+
+def _time(fn, lines):
+	start = time.perf_counter()
+	results = [ fn(line) for line in lines ]
+	return time.perf_counter() - start, results
+
+
+def bench(json_f):
+	print(f"Loading {json_f}...")
+	lines = _load_lines(json_f)
+	size = sum(len(line) for line in lines)
+	print(f"Benchmarking {len(lines)} lines ({size / 2 ** 20:.1f} MB)...")
+
+	def _loads(line):
+		obj = json.loads(line)
+		return tuple(obj[key] for key in bench_keys)
+
+	loads_s, expected = _time(_loads, lines)
+	project_s, actual = _time(amz_json.projector(bench_keys), lines)
+
+	if actual != expected:
+		mismatches = sum(1 for a, e in zip(actual, expected) if a != e)
+		print(f"Projector disagrees with json.loads on {mismatches} lines!")
+		sys.exit(1)
+
+	print("json.loads: %8.3fs %10.0f lines/s" % (loads_s, len(lines) / loads_s))
+	print("projector:  %8.3fs %10.0f lines/s" % (project_s, len(lines) / project_s))
+	print("speedup:    %8.2fx" % (loads_s / project_s))
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		bench_json_f = Path(sys.argv[1])
+	bench(bench_json_f)
@@ -0,0 +1,102 @@
+"""
+Benchmarks the shared normalizer in `amz_norm` against the per-row
+normalization the scripts used before it on the electronics dataset.
+
+The review texts of the first `bench_reviews` lines of
+`data/amz-electronics/raw/json` are normalized per row with
+`pandas.Series.apply`, once the way the reducers do (`udax.s_norm`
+then a stopword filter) and once the way `nltk_sentiment_analysis.py`
+does (punctuation stripping then WordNet lemmatization per word),
+each with the original code and with `amz_norm`. The results are
+checked for equality, and the throughput of each is printed.
+"""
+import sys
+import time
+import string
+from pathlib import Path
+
+import pandas as pd
+import udax as dx
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+import amz_io
+import amz_json
+import amz_norm
+
+
+# The dataset file to benchmark against.
+bench_json_f = Path("data/amz-electronics/raw/json")
+
+# The number of reviews to benchmark with.
+bench_reviews = 2 ** 14
+
+
+def _load_texts(json_f):
+	project = amz_json.projector([ "reviewText" ])
+	texts = []
+	with amz_io.open_raw_json(json_f) as json_h:
+		for line in json_h:
+			texts.append(project(line)[0])
+			if len(texts) == bench_reviews:
+				break
+	return pd.Series(texts)
+
+
+def _time(texts, fn):
+	start = time.perf_counter()
+	result = texts.apply(fn)
+	return time.perf_counter() - start, result
+
+
+def _bench(name, texts, original, shared):
+	original_s, expected = _time(texts, original)
+	shared_s, actual = _time(texts, shared)
+
+	print(f"{name}:")
+	print("  original: %8.3fs %10.0f reviews/s" % (original_s, len(texts) / original_s))
+	print("  amz_norm: %8.3fs %10.0f reviews/s" % (shared_s, len(texts) / shared_s))
+	print("  speedup:  %8.2fx" % (original_s / shared_s))
+
+	mismatches = int((actual != expected).sum())
+	if mismatches:
+		print(f"  amz_norm disagrees with the original on {mismatches} reviews!")
+	return mismatches
+
+
+def bench(json_f):
+	print(f"Loading {json_f}...")
+	texts = _load_texts(json_f)
+	print(f"Benchmarking {len(texts)} reviews...")
+
+	useless_words = set(stopwords.words("english"))
+	lemmatizer = WordNetLemmatizer()
+
+	def _reduce_original(text):
+		words = dx.s_norm(text).split()
+		return ' '.join(filter(lambda x: x not in useless_words, words))
+
+	def _reduce_shared(text):
+		return ' '.join(amz_norm.drop_stopwords(amz_norm.words(text)))
+
+	def _lemmatize_original(text):
+		text = text.lower().translate(str.maketrans('', '', string.punctuation))
+		return ' '.join([lemmatizer.lemmatize(word) for word in text.split(' ')])
+
+	def _lemmatize_shared(text):
+		return amz_norm.lemmatize(amz_norm.strip_punct(text.lower()))
+
+	# load the WordNet corpus up front so neither side pays for it
+	lemmatizer.lemmatize("reviews")
+	amz_norm.lemma("reviews")
+
+	mismatches = _bench("reducer normalization", texts, _reduce_original, _reduce_shared)
+	mismatches += _bench("lemmatized normalization", texts, _lemmatize_original, _lemmatize_shared)
+	if mismatches:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		bench_json_f = Path(sys.argv[1])
+	bench(bench_json_f)
@@ -0,0 +1,99 @@
+"""
+Benchmarks the POS tagger backends of `amz_pos` against stanza on the
+electronics dataset.
+
+The normalized review texts of the first `bench_reviews` rows of
+`data/amz-electronics/raw/csv-train` are tagged with stanza. The first
+`lexicon_share` of them train the lexicon of the "lexicon" backend,
+which is also saved to `amz_pos.lexicon_path` unless one exists, and
+every backend then tags the remaining reviews. For each backend the
+throughput is printed, along with the share of tags that agree with
+stanza and the precision and recall of its Turney bigrams, as counted
+by `amz_gen_feature_index_table.py`, against those of stanza.
+"""
+import sys
+import time
+import itertools
+from pathlib import Path
+
+import amz_pos
+import amz_counts
+import amz_columnar
+
+
+# The training set to benchmark against.
+bench_csv_f = Path("data/amz-electronics/raw/csv-train")
+
+# The number of reviews to benchmark with.
+bench_reviews = 2 ** 12
+
+# The share of the reviews whose stanza tags train the lexicon.
+lexicon_share = 0.5
+
+
+def _load_texts(csv_f):
+	rows = amz_columnar.read_rows(csv_f)
+	return [ text for text, _ in itertools.islice(rows, bench_reviews) ]
+
+
+def _tag(tagger, texts):
+	start = time.perf_counter()
+	tags = []
+	for i in range(0, len(texts), amz_pos.tag_batch_size):
+		tags.extend(tagger.tag(texts[i:i + amz_pos.tag_batch_size]))
+	return time.perf_counter() - start, tags
+
+
+def _turney_bigrams(tags):
+	return { (i, start) for i, text_tags in enumerate(tags) for start in amz_counts.turney_bigram_starts(text_tags).tolist() }
+
+
+def _report(name, seconds, tags, expected_tags, reviews):
+	agree = sum(a == e for text_tags, text_expected in zip(tags, expected_tags) for a, e in zip(text_tags, text_expected))
+	total = sum(len(text_tags) for text_tags in expected_tags)
+	found = _turney_bigrams(tags)
+	expected = _turney_bigrams(expected_tags)
+	common = len(found & expected)
+	precision = common / len(found) if found else 1.0
+	recall = common / len(expected) if expected else 1.0
+
+	print(f"{name}:")
+	print("  %8.3fs %10.0f reviews/s" % (seconds, reviews / seconds))
+	print("  tags agreeing with stanza: %.2f%%" % (100 * agree / max(total, 1)))
+	print("  turney bigrams: precision %.2f%%, recall %.2f%%" % (100 * precision, 100 * recall))
+
+
+def bench(csv_f):
+	print(f"Loading {csv_f}...")
+	texts = _load_texts(csv_f)
+	split = int(len(texts) * lexicon_share)
+	train, held_out = texts[:split], texts[split:]
+	print(f"Benchmarking {len(held_out)} reviews, with a lexicon of {len(train)} reviews...")
+
+	stanza_tagger = amz_pos.StanzaTagger()
+	_, train_tags = _tag(stanza_tagger, train)
+	stanza_s, expected_tags = _tag(stanza_tagger, held_out)
+	_report("stanza", stanza_s, expected_tags, expected_tags, len(held_out))
+
+	lexicon, default = amz_pos.build_lexicon(zip(train, train_tags))
+	if not amz_pos.lexicon_path.exists():
+		print(f"Saving the lexicon to {amz_pos.lexicon_path}")
+		amz_pos.save_lexicon(amz_pos.lexicon_path, lexicon, default)
+
+	try:
+		perceptron_tagger = amz_pos.PerceptronTagger()
+	except LookupError:
+		print("perceptron: skipped, its model is not installed, see nltk.download")
+	else:
+		perceptron_s, tags = _tag(perceptron_tagger, held_out)
+		_report("perceptron", perceptron_s, tags, expected_tags, len(held_out))
+
+	lexicon_tagger = amz_pos.LexiconTagger(lexicon, default)
+	lexicon_s, tags = _tag(lexicon_tagger, held_out)
+	_report("lexicon", lexicon_s, tags, expected_tags, len(held_out))
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		bench_csv_f = Path(sys.argv[1])
+	bench(bench_csv_f)
@@ -0,0 +1,85 @@
+"""
+Benchmarks the batch scorer in `amz_vader` against NLTK's VADER
+`polarity_scores` on the electronics dataset.
+
+Both score the review texts of the first `bench_reviews` lines of
+`data/amz-electronics/raw/json`, once as written and once normalized
+the way the reducers normalize them. The compound scores are checked
+to agree within `bench_tolerance`, and the throughput of each is printed.
+"""
+import sys
+import time
+from pathlib import Path
+
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+import amz_io
+import amz_json
+import amz_norm
+import amz_vader
+
+
+# The dataset file to benchmark against.
+bench_json_f = Path("data/amz-electronics/raw/json")
+
+# The number of reviews to benchmark with.
+bench_reviews = 2 ** 14
+
+# The number of reviews scored at a time by the batch scorer.
+bench_batch_size = 256
+
+# The maximum difference allowed between compound scores.
+bench_tolerance = 1e-4
+
+
+def _load_texts(json_f):
+	project = amz_json.projector([ "reviewText" ])
+	texts = []
+	with amz_io.open_raw_json(json_f) as json_h:
+		for line in json_h:
+			texts.append(project(line)[0])
+			if len(texts) == bench_reviews:
+				break
+	return texts
+
+
+def _bench(name, texts, sid, scorer):
+	start = time.perf_counter()
+	expected = [ sid.polarity_scores(text)["compound"] for text in texts ]
+	nltk_s = time.perf_counter() - start
+
+	start = time.perf_counter()
+	actual = []
+	for i in range(0, len(texts), bench_batch_size):
+		actual.extend(scorer.compound(texts[i:i + bench_batch_size]))
+	batch_s = time.perf_counter() - start
+
+	errors = [ abs(a - e) for a, e in zip(actual, expected) ]
+	mismatches = sum(1 for error in errors if error > bench_tolerance)
+
+	print(f"{name}:")
+	print("  nltk:     %8.3fs %10.0f reviews/s" % (nltk_s, len(texts) / nltk_s))
+	print("  batch:    %8.3fs %10.0f reviews/s" % (batch_s, len(texts) / batch_s))
+	print("  speedup:  %8.2fx" % (nltk_s / batch_s))
+	print("  max error: %.6f, %d reviews off by more than %g" % (max(errors), mismatches, bench_tolerance))
+	return mismatches
+
+
+def bench(json_f):
+	print(f"Loading {json_f}...")
+	texts = _load_texts(json_f)
+	norms = [ amz_norm.norm(text) for text in texts ]
+	print(f"Benchmarking {len(texts)} reviews...")
+
+	sid = SentimentIntensityAnalyzer()
+	scorer = amz_vader.BatchScorer(sid)
+	mismatches = _bench("raw text", texts, sid, scorer)
+	mismatches += _bench("normalized text", norms, sid, scorer)
+	if mismatches:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		bench_json_f = Path(sys.argv[1])
+	bench(bench_json_f)
@@ -0,0 +1,272 @@
+"""
+A columnar binary alternative to the sanitized CSV files written by
+`amz-sanitize.py`.
+
+A columnar file holds one row per review made of the review text,
+the integer `overall` rating and the item `asin`, laid out as
+
+	header
+	text blob     every text as a little-endian uint32 byte length
+	              followed by its UTF-8 bytes
+	text offsets  uint64 per row, offset of its text record in the file
+	ratings       int8 per row
+	asin ids      uint32 per row, index into the asin table
+	asin table    uint32 offsets (one per asin, plus one) into a
+	              blob of the concatenated UTF-8 asins
+
+where each column starts on an 8 byte boundary and is stored in the
+native byte order of the machine that wrote it. Readers memory-map
+the file and slice rows straight out of it, so no CSV parsing or
+unquoting is ever needed and texts keep their original quotes.
+
+Columnar files are named after the CSV file they replace, with the
+`csv` prefix swapped for `col`, e.g. `raw/col-train` for
+`raw/csv-train`.
+"""
+import sys
+import mmap
+import struct
+from array import array
+
+import udax as dx
+
+
+_magic = b"AMZCOL01"
+
+# magic, byte order, row count, asin count, text offsets, ratings,
+# asin ids, asin table offsets, asin blob, end of file
+_header = struct.Struct("<8s8sQQQQQQQQ")
+
+_text_len = struct.Struct("<I")
+
+# The number of bytes to use as the write buffer, 2^21 = 2MB.
+write_buffer_size = 2 ** 21
+
+
+def col_path(csv_f):
+	"""
+	Returns the columnar counterpart of the CSV file `csv_f`.
+	"""
+	name = csv_f.name
+	if name.startswith("csv"):
+		name = "col" + name[3:]
+	else:
+		name = name + ".col"
+	return csv_f.with_name(name)
+
+
+def prefer_columnar(csv_f):
+	"""
+	Returns the columnar counterpart of `csv_f` if it exists and is at
+	least as recent as `csv_f` itself, or `None` if the CSV file should
+	be read instead.
+	"""
+	col_f = col_path(csv_f)
+	if not col_f.exists():
+		return None
+	if csv_f.exists() and csv_f.stat().st_mtime > col_f.stat().st_mtime:
+		return None
+	return col_f
+
+
+def source_path(csv_f):
+	"""
+	Returns the file the rows of `csv_f` are read from, its columnar
+	counterpart if `prefer_columnar` picks it or `csv_f` itself otherwise.
+	"""
+	return prefer_columnar(csv_f) or csv_f
+
+
+def read_rows(csv_f):
+	"""
+	Yields the `(text, rating)` of each review in `csv_f`, reading its
+	columnar counterpart instead whenever an up-to-date one exists. The
+	rating is an int either way, where the CSV files hold e.g. "5.0".
+	"""
+	col_f = prefer_columnar(csv_f)
+	if col_f is not None:
+		with ColumnarReader(col_f) as reader:
+			for text, rating, _ in reader:
+				yield text, rating
+	else:
+		with dx.f_open_large_read(csv_f) as csv_h:
+			for line in csv_h:
+				text, rating, *_ = dx.csv_parseln(line)
+				yield text, int(float(rating))
+
+
+def row_reporter(csv_f, block_size):
+	"""
+	Returns a `udax.BlockProcessReporter` over the rows `read_rows` yields
+	for `csv_f`.
+	"""
+	col_f = prefer_columnar(csv_f)
+	if col_f is not None:
+		return dx.BlockProcessReporter(block_size, row_count(col_f))
+	return dx.BlockProcessReporter.file_lines(csv_f, block_size=block_size)
+
+
+def _pad(handle):
+	padding = -handle.tell() % 8
+	if padding:
+		handle.write(b"\0" * padding)
+	return handle.tell()
+
+
+class ColumnarWriter:
+	"""
+	Streams rows into a new columnar file. The texts are written as they
+	arrive, while the small fixed-width columns are kept in memory and
+	written, together with the header, when the writer is closed.
+	"""
+
+	def __init__(self, path, buffering=write_buffer_size):
+		self.path = path
+		self.handle = open(path, mode="wb", buffering=buffering)
+		self.handle.write(b"\0" * _header.size)
+		self.offsets = array("Q")
+		self.ratings = array("b")
+		self.asin_ids = array("I")
+		self.asins = {}
+
+	def write_row(self, text, rating, asin):
+		asin_id = self.asins.get(asin)
+		if asin_id is None:
+			asin_id = self.asins[asin] = len(self.asins)
+
+		encoded = text.encode("utf-8")
+		self.offsets.append(self.handle.tell())
+		self.handle.write(_text_len.pack(len(encoded)))
+		self.handle.write(encoded)
+		self.ratings.append(int(float(rating)))
+		self.asin_ids.append(asin_id)
+
+	def close(self):
+		if self.handle is None:
+			return
+		handle = self.handle
+		self.handle = None
+
+		offsets_at = _pad(handle)
+		self.offsets.tofile(handle)
+		ratings_at = _pad(handle)
+		self.ratings.tofile(handle)
+		asin_ids_at = _pad(handle)
+		self.asin_ids.tofile(handle)
+
+		asin_blob = bytearray()
+		asin_offsets = array("I", [ 0 ])
+		for asin in self.asins: # dicts preserve insertion, i.e. id, order
+			asin_blob += str(asin).encode("utf-8")
+			asin_offsets.append(len(asin_blob))
+		asin_offsets_at = _pad(handle)
+		asin_offsets.tofile(handle)
+		asin_blob_at = handle.tell()
+		handle.write(asin_blob)
+		end = handle.tell()
+
+		handle.seek(0)
+		handle.write(_header.pack(
+			_magic, sys.byteorder.encode("ascii").ljust(8, b"\0"),
+			len(self.offsets), len(self.asins),
+			offsets_at, ratings_at, asin_ids_at, asin_offsets_at, asin_blob_at, end))
+		handle.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class ColumnarReader:
+	"""
+	Memory-maps a columnar file for reading. Iterating the reader yields
+	`(text, rating, asin)` tuples in file order, and rows may also be
+	accessed at random through `text`, `rating` and `asin`.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, mode="rb") as handle:
+			self.mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, byteorder, n_rows, n_asins, offsets_at, ratings_at, asin_ids_at, \
+			asin_offsets_at, asin_blob_at, end = _header.unpack_from(self.mm, 0)
+		if magic != _magic:
+			self.close()
+			raise ValueError(f"{path} is not a columnar file")
+		if byteorder.rstrip(b"\0").decode("ascii") != sys.byteorder:
+			self.close()
+			raise ValueError(f"{path} was written with a different byte order")
+
+		view = memoryview(self.mm)
+		self.offsets = view[offsets_at:offsets_at + 8 * n_rows].cast("Q")
+		self.ratings = view[ratings_at:ratings_at + n_rows].cast("b")
+		self.asin_ids = view[asin_ids_at:asin_ids_at + 4 * n_rows].cast("I")
+
+		asin_offsets = view[asin_offsets_at:asin_offsets_at + 4 * (n_asins + 1)].cast("I")
+		asin_blob = bytes(view[asin_blob_at:end])
+		self.asins = [ asin_blob[asin_offsets[i]:asin_offsets[i + 1]].decode("utf-8") for i in range(n_asins) ]
+		asin_offsets.release()
+		view.release()
+
+	def __len__(self):
+		return len(self.ratings)
+
+	def text(self, i):
+		o = self.offsets[i] + _text_len.size
+		n, = _text_len.unpack_from(self.mm, o - _text_len.size)
+		return self.mm[o:o + n].decode("utf-8")
+
+	def rating(self, i):
+		return self.ratings[i]
+
+	def asin(self, i):
+		return self.asins[self.asin_ids[i]]
+
+	def __iter__(self):
+		mm = self.mm
+		asins = self.asins
+		unpack_from = _text_len.unpack_from
+		for i in range(len(self.ratings)):
+			o = self.offsets[i]
+			n, = unpack_from(mm, o)
+			o += _text_len.size
+			yield mm[o:o + n].decode("utf-8"), self.ratings[i], asins[self.asin_ids[i]]
+
+	def close(self):
+		if self.mm is None:
+			return
+		for column in ("offsets", "ratings", "asin_ids"):
+			if hasattr(self, column):
+				getattr(self, column).release()
+		self.mm.close()
+		self.mm = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def row_count(path):
+	"""
+	Returns the number of rows in the columnar file at `path` by reading
+	its header only.
+	"""
+	with open(path, mode="rb") as handle:
+		return _header.unpack(handle.read(_header.size))[2]
+
+
+def concat(path, part_paths):
+	"""
+	Concatenates the columnar files `part_paths`, in order, into a new
+	columnar file at `path`, re-interning the asins of all parts.
+	"""
+	with ColumnarWriter(path) as writer:
+		for part_path in part_paths:
+			with ColumnarReader(part_path) as reader:
+				for text, rating, asin in reader:
+					writer.write_row(text, rating, asin)
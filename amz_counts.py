@@ -0,0 +1,469 @@
+"""
+Compact count tables for the unigram, bigram and Turney bigram
+features of `amz_gen_feature_index_table.py`.
+
+Words are interned into a `Vocab` of int32 ids, and a bigram is packed
+into a single int64 key as `first << 32 | second`. A `CountTable` holds
+its keys as a sorted NumPy array with parallel arrays of positive and
+negative counts, plus the position of the first counted occurrence of
+each key, which reproduces the order in which a dict would have seen
+the keys, so `.table` files come out exactly as they used to.
+
+A `FeatureCounter` buffers the word ids and tags of whole reviews in
+flat arrays and only derives and counts the n-grams of the buffer, with
+NumPy, once it fills up. Given a memory budget, it spills its tables to
+disk whenever they outgrow it and merges them back when writing them,
+see `amz_spill`.
+"""
+from array import array
+
+import numpy as np
+
+import amz_spill
+import amz_table
+
+
+# The number of words buffered by a `FeatureCounter` before they are
+# counted, 2^20 words take about 5MB.
+count_buffer_words = 2 ** 20
+
+# The number of bytes the count tables of a `FeatureCounter` may take
+# before they are spilled to disk, or `None` to always count in memory.
+# An entry takes 32 bytes, and merging a buffer into a table briefly
+# takes about three times as much. The vocabulary is not accounted for.
+count_memory_budget = None
+
+_entry_bytes = 32
+
+# The tags tested by the Turney bigram rules, mapped to small ids. Any
+# other tag maps to 0, and -1 stands for the missing tag past the end
+# of a review.
+_tag_ids = { "ADJ": 1, "NOUN": 2, "ADV": 3, "VERB": 4 }
+_ADJ, _NOUN, _ADV, _VERB = 1, 2, 3, 4
+
+_empty = np.empty(0, dtype=np.int64)
+
+
+class Vocab:
+	"""
+	Interns words to consecutive int32 ids.
+	"""
+
+	def __init__(self):
+		self.ids = {}
+		self.words = []
+
+	def __len__(self):
+		return len(self.words)
+
+	def intern(self, words):
+		"""
+		Returns the ids of `words`, interning the words not seen before.
+		"""
+		ids = self.ids
+		out = []
+		for word in words:
+			i = ids.get(word)
+			if i is None:
+				i = ids[word] = len(self.words)
+				self.words.append(word)
+			out.append(i)
+		return out
+
+
+def pack_bigrams(first, second):
+	return (first.astype(np.int64) << 32) | second.astype(np.int64)
+
+
+def unpack_bigrams(keys):
+	return keys >> 32, keys & 0xFFFFFFFF
+
+
+def _contains(sorted_keys, keys):
+	if len(sorted_keys) == 0:
+		return np.zeros(len(keys), dtype=bool)
+	i = np.searchsorted(sorted_keys, keys)
+	i[i == len(sorted_keys)] = 0
+	return sorted_keys[i] == keys
+
+
+def sum_by_key(keys, pos, neg, first):
+	"""
+	Returns the sorted unique `keys` with the `pos` and `neg` counts of
+	equal keys summed and the least of their `first` positions.
+	"""
+	uniq, inverse = np.unique(keys, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	merged_first = np.full(len(uniq), np.iinfo(np.int64).max)
+	np.minimum.at(merged_first, inverse, first)
+	return uniq, \
+		np.bincount(inverse, weights=pos, minlength=len(uniq)).astype(np.int64), \
+		np.bincount(inverse, weights=neg, minlength=len(uniq)).astype(np.int64), \
+		merged_first
+
+
+class CountTable:
+	"""
+	The positive and negative counts of a set of keys, int64 unless another
+	`key_dtype` is given, kept sorted by key, along with the position of the
+	first counted occurrence of each.
+	"""
+
+	def __init__(self, key_dtype=np.int64):
+		self.keys = np.empty(0, dtype=key_dtype)
+		self.pos = _empty
+		self.neg = _empty
+		self.first = _empty
+
+	def __len__(self):
+		return len(self.keys)
+
+	def contains(self, keys):
+		"""
+		Returns a boolean mask of which of `keys` are in the table.
+		"""
+		return _contains(self.keys, keys)
+
+	def add(self, keys, positive, first):
+		"""
+		Counts occurrences of `keys`, where `positive` tells whether each
+		occurred in a positive review and `first` gives its position.
+		"""
+		if len(keys) == 0:
+			return
+		positive = positive.astype(np.int64)
+		self._merge(keys, positive, 1 - positive, first)
+
+	def merge(self, other):
+		"""
+		Adds the counts of `other` to this table.
+		"""
+		self._merge(other.keys, other.pos, other.neg, other.first)
+
+	def _merge(self, keys, pos, neg, first):
+		self.keys, self.pos, self.neg, self.first = sum_by_key(
+			np.concatenate((self.keys, keys)),
+			np.concatenate((self.pos, pos)),
+			np.concatenate((self.neg, neg)),
+			np.concatenate((self.first, first)))
+
+	def ranked(self):
+		"""
+		Returns the indices of the keys by decreasing total count, ties in
+		order of first occurrence.
+		"""
+		return np.lexsort((self.first, -(self.pos + self.neg)))
+
+	def totals(self):
+		pos = int(self.pos.sum())
+		neg = int(self.neg.sum())
+		return pos + neg, pos, neg
+
+
+class FeatureCounter:
+	"""
+	Counts the unigrams, the bigrams of non-overlapping word pairs and the
+	Turney bigrams of reviews, where a bigram is counted in the Turney table
+	from its first occurrence whose tags match one of the Turney rules on.
+
+	Once the tables take more than `memory_budget` bytes they are spilled
+	to a temporary directory under `spill_dir`.
+	"""
+
+	def __init__(self, memory_budget=None, spill_dir=None):
+		self.memory_budget = count_memory_budget if memory_budget is None else memory_budget
+		self.spill_dir = spill_dir
+		self.spill = None
+		self.vocab = Vocab()
+		self.unigrams = CountTable()
+		self.bigrams = CountTable()
+		self.turney_bigrams = CountTable()
+		self.pos_reviews = 0
+		self.neg_reviews = 0
+
+		# the keys of the spilled Turney bigrams, whose later occurrences
+		# are always counted
+		self._turney_spilled = _empty
+		self._n_unigrams = 0
+		self._n_bigrams = 0
+		self._words = array("i")
+		self._tags = array("b")
+		self._lens = array("q")
+		self._positive = array("b")
+
+	def add(self, words, tags, positive):
+		"""
+		Counts a review of `words` with the UPOS `tags` of each word, which
+		was `positive` or not. Without `tags`, the review has no Turney
+		bigrams.
+		"""
+		if tags is None:
+			tags = [ None ] * len(words)
+		if len(tags) != len(words):
+			raise ValueError(f"{len(tags)} tags given for {len(words)} words")
+		if positive:
+			self.pos_reviews += 1
+		else:
+			self.neg_reviews += 1
+		self._words.extend(self.vocab.intern(words))
+		self._tags.extend([ _tag_ids.get(tag, 0) for tag in tags ])
+		self._lens.append(len(words))
+		self._positive.append(1 if positive else 0)
+		if len(self._words) >= count_buffer_words:
+			self.flush()
+
+	def flush(self):
+		"""
+		Counts the buffered reviews.
+		"""
+		if not self._lens:
+			return
+		words = np.frombuffer(self._words, dtype=np.int32).astype(np.int64)
+		tags = np.frombuffer(self._tags, dtype=np.int8)
+		lens = np.frombuffer(self._lens, dtype=np.int64)
+		positive = np.repeat(np.frombuffer(self._positive, dtype=np.int8), lens)
+
+		self.unigrams.add(words, positive, self._n_unigrams + np.arange(len(words)))
+		self._n_unigrams += len(words)
+
+		# the bigrams start at even offsets into each review, leaving
+		# out a trailing odd word
+		starts = np.cumsum(lens) - lens
+		offset = np.arange(len(words)) - np.repeat(starts, lens)
+		remaining = np.repeat(lens, lens) - offset
+		at = np.flatnonzero((offset % 2 == 0) & (remaining > 1))
+		keys = pack_bigrams(words[at], words[at + 1])
+		first = self._n_bigrams + np.arange(len(at))
+		self._n_bigrams += len(at)
+		self.bigrams.add(keys, positive[at], first)
+
+		t_first = tags[at]
+		t_second = tags[at + 1]
+		t_third = np.where(remaining[at] > 2, tags[np.minimum(at + 2, len(tags) - 1)], -1)
+		qualifies = _turney_qualifies(t_first, t_second, t_third)
+		counted = self.turney_bigrams.contains(keys) | \
+				  _contains(self._turney_spilled, keys) | \
+				  _qualified_so_far(keys, qualifies)
+		self.turney_bigrams.add(keys[counted], positive[at][counted], first[counted])
+
+		self._words = array("i")
+		self._tags = array("b")
+		self._lens = array("q")
+		self._positive = array("b")
+
+		if self.memory_budget is not None and self._table_bytes() > self.memory_budget:
+			self._spill_tables()
+
+	def _tables(self):
+		return { "uni": self.unigrams, "bi": self.bigrams, "turney_bi": self.turney_bigrams }
+
+	def _table_bytes(self):
+		entries = sum(len(table) for table in self._tables().values())
+		return entries * _entry_bytes + self._turney_spilled.nbytes
+
+	def _spill_tables(self):
+		if self.spill is None:
+			self.spill = amz_spill.Spill(self.spill_dir)
+		self._turney_spilled = np.union1d(self._turney_spilled, self.turney_bigrams.keys)
+		for name, table in self._tables().items():
+			self.spill.write(name, table.keys, table.pos, table.neg, table.first)
+		self.unigrams = CountTable()
+		self.bigrams = CountTable()
+		self.turney_bigrams = CountTable()
+
+	@property
+	def spilled(self):
+		return self.spill is not None
+
+	def merge(self, other):
+		"""
+		Adds the counts of `other`, a counter of the reviews that follow the
+		reviews of this one, with the same result as counting all of them
+		in this counter. Counters that spilled cannot be merged.
+		"""
+		if self.spilled or other.spilled:
+			raise ValueError("spilled counters cannot be merged")
+		self.flush()
+		other.flush()
+		remap = np.array(self.vocab.intern(other.vocab.words), dtype=np.int64)
+		unigrams = _remapped(other.unigrams, remap, 1, self._n_unigrams)
+		bigrams = _remapped(other.bigrams, remap, 2, self._n_bigrams)
+		turney_bigrams = _remapped(other.turney_bigrams, remap, 2, self._n_bigrams)
+
+		# every occurrence of a bigram that already qualified here counts,
+		# whether or not it qualified within `other`
+		carried = self.turney_bigrams.contains(bigrams.keys)
+		fresh = ~self.turney_bigrams.contains(turney_bigrams.keys)
+		self.turney_bigrams.merge(_subset(bigrams, carried))
+		self.turney_bigrams.merge(_subset(turney_bigrams, fresh))
+		self.unigrams.merge(unigrams)
+		self.bigrams.merge(bigrams)
+
+		self.pos_reviews += other.pos_reviews
+		self.neg_reviews += other.neg_reviews
+		self._n_unigrams += other._n_unigrams
+		self._n_bigrams += other._n_bigrams
+
+	def write_tables(self, uni_f, bi_f, turney_bi_f, open_write):
+		"""
+		Writes the unigram, bigram and Turney bigram tables with `open_write`,
+		merging them back from disk if they were spilled.
+		"""
+		self.flush()
+		if not self.spilled:
+			write_table(uni_f, self.unigrams, self.vocab, 1, open_write)
+			write_table(bi_f, self.bigrams, self.vocab, 2, open_write)
+			write_table(turney_bi_f, self.turney_bigrams, self.vocab, 2, open_write)
+			return
+
+		self._spill_tables()
+		with self.spill:
+			write_spilled_table(uni_f, self.spill, "uni", self.vocab, 1, open_write)
+			write_spilled_table(bi_f, self.spill, "bi", self.vocab, 2, open_write)
+			write_spilled_table(turney_bi_f, self.spill, "turney_bi", self.vocab, 2, open_write)
+
+	def write_binary_tables(self, uni_f, bi_f, turney_bi_f):
+		"""
+		Writes the unigram, bigram and Turney bigram tables as binary tables
+		mirroring the text tables `uni_f`, `bi_f` and `turney_bi_f`. Spilled
+		tables no longer fit in memory and cannot be written this way.
+		"""
+		if self.spilled:
+			raise ValueError("spilled tables cannot be written as binary tables")
+		self.flush()
+		write_binary_table(amz_table.btable_path(uni_f), self.unigrams, self.vocab, 1)
+		write_binary_table(amz_table.btable_path(bi_f), self.bigrams, self.vocab, 2)
+		write_binary_table(amz_table.btable_path(turney_bi_f), self.turney_bigrams, self.vocab, 2)
+
+
+def _turney_qualifies(t_first, t_second, t_third):
+	return ((t_first == _ADJ) & (t_second == _NOUN)) | \
+		   ((t_first == _ADV) & (t_second == _VERB)) | \
+		   ((t_first == _ADV) & (t_second == _ADJ) & (t_third != _NOUN)) | \
+		   ((t_first == _ADJ) & (t_second == _ADJ) & (t_third != _NOUN)) | \
+		   ((t_first == _NOUN) & (t_second == _ADJ) & (t_third != _NOUN))
+
+
+def turney_bigram_starts(tags):
+	"""
+	Returns the offsets of the bigrams of a review with the UPOS `tags`
+	whose tags match one of the Turney rules.
+	"""
+	ids = np.array([ _tag_ids.get(tag, 0) for tag in tags ] + [ -1 ], dtype=np.int8)
+	at = np.arange(0, len(tags) - 1, 2)
+	return np.flatnonzero(_turney_qualifies(ids[at], ids[at + 1], ids[at + 2])) * 2
+
+
+def _remapped(table, remap, order, offset):
+	"""
+	Returns a copy of `table` with its word ids mapped through `remap` and
+	its first occurrences moved `offset` positions later.
+	"""
+	if order == 1:
+		keys = remap[table.keys]
+	else:
+		first, second = unpack_bigrams(table.keys)
+		keys = pack_bigrams(remap[first], remap[second])
+	remapped = CountTable()
+	remapped.keys, remapped.pos, remapped.neg, remapped.first = sum_by_key(keys, table.pos, table.neg, table.first + offset)
+	return remapped
+
+
+def _subset(table, mask):
+	subset = CountTable(key_dtype=table.keys.dtype)
+	subset.keys = table.keys[mask]
+	subset.pos = table.pos[mask]
+	subset.neg = table.neg[mask]
+	subset.first = table.first[mask]
+	return subset
+
+
+def _qualified_so_far(keys, qualifies):
+	"""
+	Returns whether each occurrence of `keys` is at or after an occurrence
+	of the same key that `qualifies`.
+	"""
+	order = np.argsort(keys, kind="stable")
+	sorted_keys = keys[order]
+	seen = np.cumsum(qualifies[order])
+	group_start = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+	group_sizes = np.diff(np.r_[group_start, len(keys)])
+	before_group = np.repeat(np.r_[0, seen][group_start], group_sizes)
+	result = np.empty(len(keys), dtype=bool)
+	result[order] = seen - before_group > 0
+	return result
+
+
+def _ngrams(table, vocab, order, ranked):
+	words = vocab.words
+	keys = table.keys[ranked].tolist()
+	if order == 1:
+		return [ (words[key],) for key in keys ]
+	return [ (words[key >> 32], words[key & 0xFFFFFFFF]) for key in keys ]
+
+
+def write_table(table_f, table, vocab, order, open_write):
+	"""
+	Writes `table` as text to `table_f`: the total, positive and negative
+	counts on a line each, then a line of the words of each key of the
+	given n-gram `order` followed by its positive and negative counts, most
+	frequent first.
+	"""
+	ranked = table.ranked()
+	with open_write(table_f) as table_h:
+		_write_header(table_h, table.totals())
+		counts = zip(table.pos[ranked].tolist(), table.neg[ranked].tolist())
+		for ngram, (p, n) in zip(_ngrams(table, vocab, order, ranked), counts):
+			table_h.write(f"{' '.join(ngram)} {p} {n}\n")
+
+
+def write_spilled_table(table_f, spill, name, vocab, order, open_write):
+	"""
+	Does what `write_table` does for the table `name` spilled to `spill`.
+	"""
+	ranked_runs = []
+	total_pos = 0
+	total_neg = 0
+	pending = []
+
+	def rank_pending():
+		keys, pos, neg, first = (np.concatenate(column) for column in zip(*pending))
+		ranked = np.lexsort((first, -(pos + neg)))
+		ranked_runs.append(spill.write_ranked(keys[ranked], pos[ranked], neg[ranked], first[ranked]))
+		pending.clear()
+
+	for block in amz_spill.merge_by_key(spill.runs.get(name, [])):
+		summed = sum_by_key(*block)
+		total_pos += int(summed[1].sum())
+		total_neg += int(summed[2].sum())
+		pending.append(summed)
+		if sum(len(keys) for keys, *_ in pending) >= amz_spill.merge_block_entries:
+			rank_pending()
+	if pending:
+		rank_pending()
+
+	words = vocab.words
+	with open_write(table_f) as table_h:
+		_write_header(table_h, (total_pos + total_neg, total_pos, total_neg))
+		for key, p, n in amz_spill.merge_by_rank(ranked_runs):
+			if order == 1:
+				table_h.write(f"{words[key]} {p} {n}\n")
+			else:
+				table_h.write(f"{words[key >> 32]} {words[key & 0xFFFFFFFF]} {p} {n}\n")
+
+
+def _write_header(table_h, totals):
+	total, pos, neg = totals
+	table_h.write(f"{total}\n")
+	table_h.write(f"{pos}\n")
+	table_h.write(f"{neg}\n")
+
+
+def write_binary_table(btable_f, table, vocab, order):
+	"""
+	Writes `table` as a binary table of the given n-gram `order` to
+	`btable_f`, see `amz_table`.
+	"""
+	ranked = table.ranked()
+	amz_table.write(btable_f, order, _ngrams(table, vocab, order, ranked),
+		table.pos[ranked], table.neg[ranked], table.totals())
@@ -1,11 +1,155 @@
 import os
 import sys
-import stanza
 import udax as dx
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import amz_pos
+import amz_shard
+import amz_counts
+import amz_ngrams
+import amz_columnar
+
+
+# The number of worker processes that count shards of the training set,
+# whose counts are then merged, where a value < 1 means one worker per
+# available core. A value of 1 counts in this process. Shards are
+# always counted and merged in memory, so more than one worker cannot be
+# combined with `amz_counts.count_memory_budget`.
+worker_processes = 1
+
+# The number of shards per worker.
+ranges_per_worker = 4
+
+# Whether to POS tag the reviews, without which the Turney bigram table
+# comes out empty.
+tag_pos = True
+
+
+def _shards(csv_f, n_shards):
+	"""
+	Splits the rows of `csv_f`, or of its up-to-date columnar counterpart,
+	into at most `n_shards` shards of consecutive rows. A shard is a `(kind,
+	path, first_row, start, end)` tuple, where `start` and `end` are row
+	numbers of a columnar file or byte offsets of a CSV file.
+	"""
+	col_f = amz_columnar.prefer_columnar(csv_f)
+	if col_f is not None:
+		rows = amz_columnar.row_count(col_f)
+		bounds = [ rows * i // n_shards for i in range(n_shards + 1) ]
+		return [ ("col", col_f, start, start, end) for start, end in zip(bounds, bounds[1:]) if end > start ]
+
+	shards = []
+	first_row = 0
+	for start, end in amz_shard.f_byte_ranges(csv_f, n_shards):
+		shards.append(("csv", csv_f, first_row, start, end))
+		first_row += amz_shard.f_range_line_count(csv_f, start, end)
+	return shards
+
+
+def _shard_rows(shard):
+	kind, path, _, start, end = shard
+	if kind == "col":
+		with amz_columnar.ColumnarReader(path) as reader:
+			for i in range(start, end):
+				yield reader.text(i), reader.rating(i)
+	else:
+		for line in amz_shard.f_range_lines(path, start, end):
+			text, rating, *_ = dx.csv_parseln(line.decode("utf-8"))
+			yield text, int(float(rating))
+
+
+def _count(tagged_rows, counter, reporter=None):
+	"""
+	Counts the `((text, rating), tags)` of `tagged_rows` into `counter` and
+	into a new counter for each order of `amz_ngrams.ngram_orders`, which
+	are returned.
+	"""
+	ngram_counters = [ amz_ngrams.ngram_counter(order) for order in amz_ngrams.ngram_orders ]
+	for (text, rating), pos in tagged_rows:
+		# in this case, pos is any rating > 3, neg is any <= 3
+		words = text.split()
+		is_positive = int(rating) > 3
+		counter.add(words, pos, is_positive)
+		for ngram_counter in ngram_counters:
+			ngram_counter.add(words, is_positive)
+		if reporter is not None:
+			reporter.ping()
+	return ngram_counters
+
+
+def _count_shard(shard, tag_f, tag_mode, part):
+	"""
+	Counts the rows of `shard`, the `part`-th shard, with their tags read
+	from `tag_f` if `tag_mode` is "cached", tagged and saved to a part file
+	of `tag_f` if it is "tag", or without tags otherwise.
+	"""
+	rows = _shard_rows(shard)
+	if tag_mode == "cached":
+		tagged_rows = zip(rows, amz_pos.read_tags(tag_f, shard[2]))
+	elif tag_mode == "tag":
+		tagged_rows = amz_pos.tagged_part(rows, amz_pos.tag_part_path(tag_f, part))
+	else:
+		tagged_rows = ((row, None) for row in rows)
+
+	counter = amz_counts.FeatureCounter(memory_budget=float("inf"))
+	ngram_counters = _count(tagged_rows, counter)
+	counter.flush()
+	for ngram_counter in ngram_counters:
+		ngram_counter.flush()
+	return counter, ngram_counters
+
+
+def _count_serial(raw, csv_f, tag_f):
+	print("Gathering size information...")
+	reporter = amz_columnar.row_reporter(csv_f, block_size=16)
+
+	rows = amz_columnar.read_rows(csv_f)
+	if tag_pos:
+		tagged_rows = amz_pos.tagged_cached(rows, csv_f, tag_f)
+	else:
+		tagged_rows = ((row, None) for row in rows)
 
+	print("Processing...")
+	counter = amz_counts.FeatureCounter(spill_dir=raw)
+	reporter.start()
+	ngram_counters = _count(tagged_rows, counter, reporter)
+	reporter.finish()
+	return counter, ngram_counters
 
-pos_tagger = stanza.Pipeline(lang="en", processors="tokenize,pos")
+
+def _count_parallel(csv_f, tag_f, workers):
+	tag_mode = None
+	if tag_pos:
+		key, valid = amz_pos.tags_valid(csv_f, tag_f)
+		tag_mode = "cached" if valid else "tag"
+		if valid:
+			print(f"Reusing the POS tags saved in {tag_f}")
+
+	print(f"Sharding {csv_f} for {workers} workers...")
+	shards = _shards(csv_f, workers * ranges_per_worker)
+
+	print("Processing...")
+	counter = None
+	ngram_counters = None
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [ executor.submit(_count_shard, shard, tag_f, tag_mode, i) for i, shard in enumerate(shards) ]
+		for i, future in enumerate(futures):
+			shard_counter, shard_ngram_counters = future.result()
+			if counter is None:
+				counter, ngram_counters = shard_counter, shard_ngram_counters
+			else:
+				counter.merge(shard_counter)
+				for ngram_counter, shard_ngram_counter in zip(ngram_counters, shard_ngram_counters):
+					ngram_counter.merge(shard_ngram_counter)
+			print(f"[%5.1f%%] Counted shard {i + 1}/{len(futures)}" % (100 * (i + 1) / len(futures)))
+
+	if tag_mode == "tag":
+		amz_pos.join_tag_parts(tag_f, [ amz_pos.tag_part_path(tag_f, i) for i in range(len(shards)) ], key)
+	if counter is None:
+		counter = amz_counts.FeatureCounter()
+		ngram_counters = [ amz_ngrams.ngram_counter(order) for order in amz_ngrams.ngram_orders ]
+	return counter, ngram_counters
 
 
 def gen_feature_index_tables(amz_ds):
@@ -19,157 +163,41 @@ def gen_feature_index_tables(amz_ds):
 	all_bi_f    = raw.joinpath("all_bi.table")
 	turney_bi_f = raw.joinpath("turney_bi.table")
 
-	all_uni_table = {}
-	all_bi_table = {}
-	turney_bi_table = {}
-	
-	# in this case, pos is any rating > 3, neg is any <= 3
-	pos_ratings = 0
-	neg_ratings = 0
+	workers = amz_shard.worker_count(worker_processes)
+	if workers > 1 and amz_counts.count_memory_budget is not None:
+		raise ValueError(
+			f"counting with {workers} worker processes holds every table in memory, "
+			"set worker_processes = 1 to count within amz_counts.count_memory_budget")
 
-	print("Gathering size information...")
-	reporter = dx.BlockProcessReporter.file_lines(csv_f, block_size=16)
 	stopwatch = dx.Stopwatch()
-
-	print("Processing...")
 	stopwatch.start()
-	reporter.start()
-	with dx.f_open_large_write(tag_f) as tag_h:
-		with dx.f_open_large_read(csv_f) as csv_h:
-			# c = 0
-			for line in csv_h:
-				# c += 1
-				# if c == 32:
-				# 	break
-				text, rating, est_rating, est_correct = dx.csv_parseln(line)
-				i_rating = int(rating)
-				i_est_rating = int(est_rating)
-
-				is_positive = i_rating > 3
-				pos_inc = 1 if is_positive else 0
-				neg_inc = 0 if is_positive else 1
-
-				pos_ratings += pos_inc
-				neg_ratings += neg_inc
-
-				words = text.split()
-				pos = [word.upos for sent in pos_tagger(text).sentences for word in sent.words]
-				
-				# record unigrams
-				for word in words:
-					if word in all_uni_table:
-						record = all_uni_table[word]
-						record[0] += pos_inc
-						record[1] += neg_inc
-						all_uni_table[word] = record
-					else:
-						n_record = [
-							pos_inc,
-							neg_inc
-						]
-						all_uni_table[word] = n_record
-
-				# record bigrams
-				i = 0
-				while i < len(words) - 1:
-					w_first = words[i]
-					w_second = words[i + 1]
-					bigram = (w_first, w_second)
-
-					t_first = pos[i]
-					t_second = pos[i + 1]
-					t_third = None if i >= len(words) - 2 else pos[i + 2]
-
-					# all bigrams
-					if bigram in all_bi_table:
-						record = all_bi_table[bigram]
-						record[0] += pos_inc
-						record[1] += neg_inc
-						all_uni_table[word] = record
-					else:
-						n_record = [
-							pos_inc,
-							neg_inc
-						]
-						all_bi_table[bigram] = n_record
-
-					# turney bigrams:
-					if bigram in turney_bi_table:
-						record = turney_bi_table[bigram]
-						record[0] += pos_inc
-						record[1] += neg_inc
-						turney_bi_table[bigram] = record
-					elif (t_first == "ADJ"  and t_second == "NOUN") or \
-						 (t_first == "ADV"  and t_second == "VERB") or \
-						 (t_first == "ADV"  and t_second == "ADJ" and t_third != "NOUN") or \
-						 (t_first == "ADJ"  and t_second == "ADJ" and t_third != "NOUN") or \
-						 (t_first == "NOUN" and t_second == "ADJ" and t_third != "NOUN"):
-						n_record = [
-							pos_inc,
-							neg_inc
-						]
-						turney_bi_table[bigram] = n_record
-
-					i += 2
-
-				# save tags to an external CSV
-				dx.csv_writeln(*pos, stream=tag_h)
-
-				reporter.ping()
-			reporter.finish()
+	if workers == 1:
+		counter, ngram_counters = _count_serial(raw, csv_f, tag_f)
+	else:
+		counter, ngram_counters = _count_parallel(csv_f, tag_f, workers)
 	stopwatch.stop()
 	print(f"Finished processing in {repr(stopwatch)}")
 
-	print(f"Saving unigram table to {all_uni_f}...")
-	with dx.f_open_large_write(all_uni_f) as all_uni_h:
-		total_unigrams = 0
-		total_pos_unigrams = 0
-		total_neg_unigrams = 0
-		for posneg in all_uni_table.values():
-			total_unigrams += (posneg[0] + posneg[1])
-			total_pos_unigrams += posneg[0]
-			total_neg_unigrams += posneg[1]
-		all_uni_h.write(f"{total_unigrams}\n")
-		all_uni_h.write(f"{total_pos_unigrams}\n")
-		all_uni_h.write(f"{total_neg_unigrams}\n")
-		for uni, posneg in sorted(all_uni_table.items(), key=lambda x: x[1][0] + x[1][1], reverse=True):
-			all_uni_h.write(f"{uni} {posneg[0]} {posneg[1]}\n")
-	
-	print(f"Saving all bigram table to {all_bi_f}...")
-	with dx.f_open_large_write(all_bi_f) as all_bi_h:
-		total_bigrams = 0
-		total_pos_bigrams = 0
-		total_neg_bigrams = 0
-		for posneg in all_bi_table.values():
-			total_bigrams += (posneg[0] + posneg[1])
-			total_pos_bigrams += posneg[0]
-			total_neg_bigrams += posneg[1]
-		all_bi_h.write(f"{total_bigrams}\n")
-		all_bi_h.write(f"{total_pos_bigrams}\n")
-		all_bi_h.write(f"{total_neg_bigrams}\n")
-		for bi, posneg in sorted(all_bi_table.items(), key=lambda x: x[1][0] + x[1][1], reverse=True):
-			all_bi_h.write(f"{bi[0]} {bi[1]} {posneg[0]} {posneg[1]}\n")
-	
-	print(f"Saving turney bigram table to {turney_bi_f}...")
-	with dx.f_open_large_write(turney_bi_f) as turney_bi_h:
-		total_bigrams = 0
-		total_pos_bigrams = 0
-		total_neg_bigrams = 0
-		for posneg in turney_bi_table.values():
-			total_bigrams += (posneg[0] + posneg[1])
-			total_pos_bigrams += posneg[0]
-			total_neg_bigrams += posneg[1]
-		turney_bi_h.write(f"{total_bigrams}\n")
-		turney_bi_h.write(f"{total_pos_bigrams}\n")
-		turney_bi_h.write(f"{total_neg_bigrams}\n")
-		for bi, posneg in sorted(turney_bi_table.items(), key=lambda x: x[1][0] + x[1][1], reverse=True):
-			turney_bi_h.write(f"{bi[0]} {bi[1]} {posneg[0]} {posneg[1]}\n")
+	print(f"Saving unigram table to {all_uni_f}, all bigram table to {all_bi_f} and turney bigram table to {turney_bi_f}...")
+	counter.write_tables(all_uni_f, all_bi_f, turney_bi_f, dx.f_open_large_write)
+	if counter.spilled:
+		# the text tables are newer, so any stale binary ones are ignored
+		print("The tables were spilled to disk, not saving their binary counterparts")
+	else:
+		print("Saving their binary counterparts...")
+		counter.write_binary_tables(all_uni_f, all_bi_f, turney_bi_f)
+
+	for ngram_counter in ngram_counters:
+		ngram_f = amz_ngrams.ngram_table_path(raw, ngram_counter.order)
+		print(f"Saving {ngram_counter.order}-gram table to {ngram_f}...")
+		ngram_counter.write(ngram_f, dx.f_open_large_write)
+		print(f"  {ngram_counter.bounds()}")
 
 	print(f"Writing naive bayes probabilities to {nb_f}...")
 	with open(nb_f, mode="w") as nb_h:
-		tot_ratings = pos_ratings + neg_ratings
-		ratio_pos = pos_ratings / tot_ratings
-		ratio_neg = neg_ratings / tot_ratings
+		tot_ratings = counter.pos_reviews + counter.neg_reviews
+		ratio_pos = counter.pos_reviews / tot_ratings
+		ratio_neg = counter.neg_reviews / tot_ratings
 		nb_h.write(f"{ratio_pos} {ratio_neg}\n")
 
 	print("Ok")
@@ -1,44 +1,286 @@
+"""
+Generates sparse feature vectors of the training and testing sets, so
+that the classifiers can load ready-made matrices instead of tokenizing
+the reviews again. Each review becomes a row of a CSR matrix per kind of
+feature, unigrams, bigrams, Turney bigrams and the n-grams of
+`amz_ngrams.ngram_orders`, whose columns depend on `vector_mode`:
+
+	table  the `feature_dim` most frequent entries of the feature's table
+	       written by `amz_gen_feature_index_table.py`, i.e. the first
+	       `feature_dim` lines of the `.table` file, valued by their
+	       number of occurrences in the review
+	hash   `hash_buckets` buckets, into which each n-gram is hashed with
+	       `amz_table.ngram_key`, adding 1 or -1 by the top bit of the
+	       key so that collisions tend to cancel out rather than pile up
+
+The hash mode needs neither the tables nor any vocabulary, so a set is
+vectorized in a single pass with memory bound by its non-zero entries.
+
+The n-grams of a review are taken as by `amz_nb.py`: every word for the
+unigrams and the non-overlapping word pairs for the bigrams. In table
+mode, the Turney bigrams are those same pairs looked up in the Turney
+table. In hash mode, they are only the pairs whose tags match one of the
+Turney rules, so the reviews are POS tagged, or their tags read from
+e.g. `raw/tag-test`, see `amz_pos`.
+
+A matrix is saved with `numpy.savez` as `data`, `indices`, `indptr`,
+`format` and `shape`, which `scipy.sparse.load_npz` reads as is, along
+with the `ratings` of its rows, e.g. to
+`raw/all_uni.16.vectors-train.npz`, or `raw/all_uni.h262144.vectors-train.npz`
+in hash mode. See `load_vectors`.
+"""
 import os
 import sys
 import udax as dx
+from array import array
 from pathlib import Path
+from collections import Counter
+
+import numpy as np
+
+import amz_nb
+import amz_pos
+import amz_table
+import amz_counts
+import amz_ngrams
+import amz_columnar
 
 
-# The dimension of the feature space.
+# How n-grams map to columns, "table" or "hash".
+vector_mode = "table"
+
+# The dimension of the feature space in table mode.
 feature_dim = 16
 
+# The dimension of the feature space in hash mode.
+hash_buckets = 2 ** 18
+
+# The sets to vectorize, by the suffix of their `csv-` file.
+vector_splits = ( "train", "test" )
+
+
+def vectors_path(raw, name, split):
+	"""
+	Returns the path of the vectors of the `split` set over the feature
+	`name`, e.g. "all_uni", in the current `vector_mode`.
+	"""
+	dim = f"h{hash_buckets}" if vector_mode == "hash" else f"{feature_dim}"
+	return raw.joinpath(f"{name}.{dim}.vectors-{split}.npz")
+
+
+class CsrBuilder:
+	"""
+	Builds a CSR matrix of `columns` columns a row at a time, holding only
+	its non-zero entries.
+	"""
+
+	def __init__(self, columns):
+		self.columns = columns
+		self.data = array("i")
+		self.indices = array("i")
+		self.indptr = array("q", [ 0 ])
+
+	def __len__(self):
+		return len(self.indptr) - 1
+
+	def add_row(self, counts):
+		"""
+		Appends a row holding the `column: value` entries of `counts`.
+		"""
+		for column in sorted(counts):
+			self.indices.append(column)
+			self.data.append(counts[column])
+		self.indptr.append(len(self.indices))
+
+	def tocsr(self):
+		"""
+		Returns the rows added so far as a `scipy.sparse.csr_matrix`.
+		"""
+		from scipy.sparse import csr_matrix
+		return csr_matrix((
+			np.frombuffer(self.data, dtype=np.int32),
+			np.frombuffer(self.indices, dtype=np.int32),
+			np.frombuffer(self.indptr, dtype=np.int64)), shape=(len(self), self.columns))
+
+	def save(self, vectors_f, ratings):
+		with open(vectors_f, mode="wb") as vectors_h:
+			np.savez(vectors_h,
+				data=np.frombuffer(self.data, dtype=np.int32),
+				indices=np.frombuffer(self.indices, dtype=np.int32),
+				indptr=np.frombuffer(self.indptr, dtype=np.int64),
+				format=np.array(b"csr"),
+				shape=np.array([ len(self), self.columns ], dtype=np.int64),
+				ratings=np.asarray(ratings, dtype=np.int8))
+
+
+def load_vectors(vectors_f):
+	"""
+	Returns the vectors saved to `vectors_f` as a `scipy.sparse.csr_matrix`
+	and the rating of each row as an int8 array.
+	"""
+	from scipy.sparse import csr_matrix
+	with np.load(vectors_f) as vectors:
+		matrix = csr_matrix((vectors["data"], vectors["indices"], vectors["indptr"]), shape=tuple(vectors["shape"]))
+		return matrix, vectors["ratings"]
 
-def gen_vector_tables(amz_ds):
-	raw = amz_ds.joinpath("raw")
-	csv_f = raw.joinpath("csv")
-	tag_f = raw.joinpath("tag")
 
-	all_uni_table_f     = raw.joinpath("all_uni.table")
-	all_bi_table_f      = raw.joinpath("all_bi.table")
-	turney_bi_table_f   = raw.joinpath("turney_bi.table")
+def _feature_index(table_f, words=1):
+	"""
+	Returns the column of each of the `feature_dim` most frequent entries
+	of `table_f`, by entry.
+	"""
+	table, _, _, _ = amz_nb.ldtable(table_f, words, feature_dim)
+	if words == 1:
+		return { (entry,): column for column, entry in enumerate(table) }
+	return { entry: column for column, entry in enumerate(table) }
 
-	all_uni_vectors_f   = raw.joinpath(f"all_uni.{feature_dim}.vectors")
-	all_bi_vectors_f    = raw.joinpath(f"all_bi.{feature_dim}.vectors")
-	turney_bi_vectors_f = raw.joinpath(f"turney_bi.{feature_dim}.vectors")
 
+def _turney_bigrams(words, tags):
+	return [ (words[i], words[i + 1]) for i in amz_counts.turney_bigram_starts(tags).tolist() ]
 
-	csv_h = dx.f_open_large_read(csv_f)
-	tag_h = dx.f_open_large_read(tag_f)
 
-	all_uni_vectors   = []
-	all_bi_vectors    = []
-	turney_bi_vectors = []
+class TableColumns:
+	"""
+	Maps n-grams to the columns of their entries in `index`, leaving out
+	those not in it.
+	"""
 
+	def __init__(self, index):
+		self.index = index
 
-	for line in csv_h:
-		data = dx.csv_parseln(line)
+	def __call__(self, grams):
+		index = self.index
+		return Counter(index[gram] for gram in grams if gram in index)
 
 
+class HashColumns:
+	"""
+	Maps n-grams to `buckets` columns by their `amz_table.ngram_key`,
+	signed by its top bit.
+	"""
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+
+	def __call__(self, grams):
+		buckets = self.buckets
+		counts = Counter()
+		for gram in grams:
+			key = amz_table.ngram_key(gram)
+			counts[key % buckets] += -1 if key >> 63 else 1
+		return { column: value for column, value in counts.items() if value }
+
+
+def table_features(raw):
+	"""
+	Returns the `(name, order, columns)` of each feature in table mode.
+	"""
+	features = [
+		("all_uni", 1, TableColumns(_feature_index(raw.joinpath("all_uni.table")))),
+		("all_bi", 2, TableColumns(_feature_index(raw.joinpath("all_bi.table"), words=2))),
+		("turney_bi", 2, TableColumns(_feature_index(raw.joinpath("turney_bi.table"), words=2))),
+	]
+	for order in amz_ngrams.ngram_orders:
+		ngram_f = amz_ngrams.ngram_table_path(raw, order)
+		features.append((ngram_f.stem, order, TableColumns(_feature_index(ngram_f, words=order))))
+	return features
+
+
+def hash_features(turney=True):
+	"""
+	Returns the `(name, order, columns)` of each feature in hash mode,
+	where the Turney bigrams are left out unless `turney`.
+	"""
+	columns = HashColumns(hash_buckets)
+	features = [ ("all_uni", 1, columns), ("all_bi", 2, columns) ]
+	if turney:
+		features.append(("turney_bi", "turney", columns))
+	for order in amz_ngrams.ngram_orders:
+		features.append((amz_ngrams.ngram_table_path(Path(), order).stem, order, columns))
+	return features
+
+
+def vectorize(tagged_rows, features, columns, reporter=None):
+	"""
+	Vectorizes the `((text, rating), tags)` of `tagged_rows` over `features`,
+	a `(name, order, columns)` tuple per feature where `order` is the order
+	of its n-grams, or "turney" for the Turney bigrams by `tags`, and
+	`columns` maps a review's n-grams to a dict of column values. Returns
+	a `CsrBuilder` of `columns` columns per feature, by name, and the
+	rating of each review.
+	"""
+	builders = { name: CsrBuilder(columns) for name, _, _ in features }
+	ratings = array("b")
+	for (text, rating), tags in tagged_rows:
+		words = text.split()
+		bigrams = amz_ngrams.ngrams(words, 2)
+		for name, order, to_columns in features:
+			if order == 1:
+				grams = [ (word,) for word in words ]
+			elif order == 2:
+				grams = bigrams
+			elif order == "turney":
+				grams = _turney_bigrams(words, tags)
+			else:
+				grams = amz_ngrams.ngrams(words, order)
+			builders[name].add_row(to_columns(grams))
+		ratings.append(int(rating))
+		if reporter is not None:
+			reporter.ping()
+	return builders, ratings
+
+
+def gen_vector_tables(amz_ds):
+	print(f"Generating vector tables for {amz_ds}...")
+	raw = amz_ds.joinpath("raw")
+
+	if vector_mode == "hash":
+		features = hash_features()
+		columns = hash_buckets
+	else:
+		features = table_features(raw)
+		columns = feature_dim
+
+	for split in vector_splits:
+		csv_f = raw.joinpath(f"csv-{split}")
+		if not amz_columnar.source_path(csv_f).exists():
+			print(f"No {csv_f}, skipping")
+			continue
+
+		rows = amz_columnar.read_rows(csv_f)
+		if vector_mode == "hash":
+			tagged_rows = amz_pos.tagged_cached(rows, csv_f, raw.joinpath(f"tag-{split}"))
+		else:
+			tagged_rows = ((row, None) for row in rows)
+
+		print(f"Vectorizing {csv_f}...")
+		reporter = amz_columnar.row_reporter(csv_f, block_size=1024)
+		stopwatch = dx.Stopwatch()
+		stopwatch.start()
+		reporter.start()
+		builders, ratings = vectorize(tagged_rows, features, columns, reporter)
+		reporter.finish()
+		stopwatch.stop()
+		print(f"Done in {repr(stopwatch)}")
+
+		for name, builder in builders.items():
+			vectors_f = vectors_path(raw, name, split)
+			print(f"Saving {len(builder)} vectors with {len(builder.data)} non-zero entries to {vectors_f}...")
+			builder.save(vectors_f, ratings)
+
+	print("Ok")
+
 
 if __name__ == "__main__":
 	# verify global settings
-	if vector_size < 1:
-		print("vector_size must be >= 1")
+	if vector_mode not in ("table", "hash"):
+		print("vector_mode must be \"table\" or \"hash\"")
+		sys.exit(1)
+	if feature_dim < 1:
+		print("feature_dim must be >= 1")
+		sys.exit(1)
+	if hash_buckets < 1 or hash_buckets > 2 ** 31:
+		print("hash_buckets must be >= 1 and <= 2^31")
 		sys.exit(1)
 
 	data = Path("data")
@@ -0,0 +1,213 @@
+"""
+A persistent index over the reviews of a raw dataset dump, recording
+for every review its byte offset in `raw/json`, its `overall` rating,
+the length of its text in characters and the number of words of its
+normalized text.
+
+The reducers use the index to select the reviews matching their
+parameters without scanning the dump, then seek straight to them.
+The index is stored next to the dump as `raw/json.idx` and is rebuilt
+automatically whenever the dump changes.
+
+The index file is laid out as a header followed by the four columns,
+each in the native byte order of the machine that built it:
+
+	header        magic, byte order, row count, and the size and
+	              modification time of the indexed dump
+	offsets       uint64 per review
+	ratings       int8 per review
+	text lengths  uint32 per review
+	word counts   uint32 per review
+"""
+import sys
+import random
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import udax as dx
+
+import amz_io
+import amz_json
+import amz_norm
+import amz_shard
+
+
+# The number of bytes to use as the read buffer, 2^21 = 2MB.
+read_buffer_size = 2 ** 21
+
+# The number of worker processes used to build an index, where a
+# value < 1 means one worker per available core.
+worker_processes = 1
+
+# The number of byte ranges assigned to each worker process.
+ranges_per_worker = 4
+
+_magic = b"AMZIDX01"
+
+# magic, byte order, row count, dump size, dump mtime
+_header = struct.Struct("<8s8sQQQ")
+
+
+def index_path(json_f):
+	return json_f.with_name(json_f.name + ".idx")
+
+
+class ReviewIndex:
+	"""
+	The columns of an index, where row `i` describes the `i`-th review of
+	the dump in file order.
+	"""
+
+	def __init__(self):
+		self.offsets = array("Q")
+		self.ratings = array("b")
+		self.text_lens = array("I")
+		self.word_counts = array("I")
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def extend(self, other):
+		self.offsets.extend(other.offsets)
+		self.ratings.extend(other.ratings)
+		self.text_lens.extend(other.text_lens)
+		self.word_counts.extend(other.word_counts)
+
+	def save(self, idx_f, json_f):
+		stat = json_f.stat()
+		with open(idx_f, mode="wb") as idx_h:
+			idx_h.write(_header.pack(
+				_magic, sys.byteorder.encode("ascii").ljust(8, b"\0"),
+				len(self), stat.st_size, stat.st_mtime_ns))
+			self.offsets.tofile(idx_h)
+			self.ratings.tofile(idx_h)
+			self.text_lens.tofile(idx_h)
+			self.word_counts.tofile(idx_h)
+
+	@classmethod
+	def load(cls, idx_f, json_f):
+		"""
+		Loads the index `idx_f` of `json_f`, or returns `None` if it is
+		missing, unreadable or out of date.
+		"""
+		if not idx_f.exists():
+			return None
+		stat = json_f.stat()
+		with open(idx_f, mode="rb") as idx_h:
+			header = idx_h.read(_header.size)
+			if len(header) < _header.size:
+				return None
+			magic, byteorder, rows, size, mtime = _header.unpack(header)
+			if magic != _magic or byteorder.rstrip(b"\0").decode("ascii") != sys.byteorder:
+				return None
+			if size != stat.st_size or mtime != stat.st_mtime_ns:
+				return None
+			index = cls()
+			try:
+				index.offsets.fromfile(idx_h, rows)
+				index.ratings.fromfile(idx_h, rows)
+				index.text_lens.fromfile(idx_h, rows)
+				index.word_counts.fromfile(idx_h, rows)
+			except EOFError:
+				return None
+		return index
+
+
+def _index_range(json_f, start, end):
+	index = ReviewIndex()
+	project = amz_json.projector([ "reviewText", "overall" ])
+	offset = start
+	for line in amz_shard.f_range_lines(json_f, start, end, buffering=read_buffer_size):
+		text, overall = project(line)
+		index.offsets.append(offset)
+		index.ratings.append(int(float(overall)))
+		index.text_lens.append(len(text))
+		index.word_counts.append(len(amz_norm.words(text)))
+		offset += len(line)
+	return index
+
+
+def build_index(json_f):
+	"""
+	Builds the index of the uncompressed dump `json_f`.
+	"""
+	workers = amz_shard.worker_count(worker_processes)
+	ranges = amz_shard.f_byte_ranges(json_f, workers * ranges_per_worker)
+	index = ReviewIndex()
+	if workers == 1:
+		for i, (start, end) in enumerate(ranges):
+			index.extend(_index_range(json_f, start, end))
+			print(f"[%5.1f%%] Indexed range {i + 1}/{len(ranges)}" % (100 * (i + 1) / len(ranges)))
+		return index
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [ executor.submit(_index_range, json_f, start, end) for start, end in ranges ]
+		for i, future in enumerate(futures):
+			index.extend(future.result())
+			print(f"[%5.1f%%] Indexed range {i + 1}/{len(futures)}" % (100 * (i + 1) / len(futures)))
+	return index
+
+
+def load_index(json_f):
+	"""
+	Returns the index of the dump `json_f`, building and saving it first
+	if it does not exist or is out of date. Compressed dumps cannot be
+	indexed, in which case `None` is returned.
+	"""
+	if amz_io.is_compressed(json_f):
+		print(f"Cannot index {json_f}, compressed dumps do not support random access")
+		return None
+
+	idx_f = index_path(json_f)
+	index = ReviewIndex.load(idx_f, json_f)
+	if index is None:
+		print(f"Building review index {idx_f}...")
+		stopwatch = dx.Stopwatch()
+		stopwatch.start()
+		index = build_index(json_f)
+		index.save(idx_f, json_f)
+		stopwatch.stop()
+		print(f"Indexed {len(index)} reviews in {repr(stopwatch)}")
+	return index
+
+
+def select_rows(rows, strata, quotas, seed=None):
+	"""
+	Selects up to `quotas[s]` of the `rows` in each stratum `s`, where
+	`strata(row)` gives the stratum of a row, and returns them in
+	increasing row order.
+
+	With a `seed` of `None`, the first rows of each stratum are selected,
+	just like a scan of the dump would. Otherwise, a seeded random sample
+	of each stratum is selected.
+	"""
+	picked = []
+	if seed is None:
+		taken = dict.fromkeys(quotas, 0)
+		for row in rows:
+			stratum = strata(row)
+			if stratum in taken and taken[stratum] < quotas[stratum]:
+				taken[stratum] += 1
+				picked.append(row)
+		return picked
+
+	rng = random.Random(seed)
+	by_stratum = {}
+	for row in rows:
+		by_stratum.setdefault(strata(row), []).append(row)
+	for stratum, quota in quotas.items():
+		candidates = by_stratum.get(stratum, [])
+		picked.extend(rng.sample(candidates, min(quota, len(candidates))))
+	return sorted(picked)
+
+
+def read_lines(json_f, offsets):
+	"""
+	Yields the lines starting at the given `offsets` of `json_f`, in
+	increasing offset order.
+	"""
+	with open(json_f, mode="rb", buffering=read_buffer_size) as json_h:
+		for offset in sorted(offsets):
+			json_h.seek(offset)
+			yield json_h.readline()
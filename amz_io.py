@@ -0,0 +1,175 @@
+"""
+Input helpers for the raw review dumps, which may be stored either
+uncompressed as `raw/json` or compressed as `raw/json.gz`,
+`raw/json.bz2` or `raw/json.xz`.
+
+Compressed dumps are decompressed on a background thread that feeds
+a bounded queue of decompressed chunks, so decompression overlaps
+with the parsing done by the reading thread (zlib, bz2 and lzma all
+release the GIL while they work).
+"""
+import io
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+
+# The candidate names of the raw dataset dump, in order of preference.
+raw_json_names = [ "json", "json.gz", "json.bz2", "json.xz" ]
+
+# The number of bytes to use as the read buffer, 2^21 = 2MB.
+read_buffer_size = 2 ** 21
+
+# The number of decompressed bytes handed from the decompression thread
+# to the reading thread at a time, 2^20 = 1MB.
+decompress_chunk_size = 2 ** 20
+
+# The maximum number of decompressed chunks waiting to be read. This
+# bounds the memory used when decompression outpaces parsing.
+decompress_queue_depth = 16
+
+_openers = {
+	".gz": lambda handle: gzip.GzipFile(fileobj=handle, mode="rb"),
+	".bz2": lambda handle: bz2.BZ2File(handle, mode="rb"),
+	".xz": lambda handle: lzma.LZMAFile(handle, mode="rb"),
+}
+
+
+def raw_json_path(raw):
+	"""
+	Returns the path of the raw dataset dump in the `raw` directory,
+	preferring an uncompressed dump. If none exists, `raw/json` is
+	returned so that errors name the expected file.
+	"""
+	for name in raw_json_names:
+		path = raw.joinpath(name)
+		if path.exists():
+			return path
+	return raw.joinpath(raw_json_names[0])
+
+
+def is_compressed(path):
+	return path.suffix in _openers
+
+
+class _DecompressingReader(io.RawIOBase):
+	"""
+	A raw binary stream over the decompressed contents of a file, which is
+	decompressed ahead of the reader on a background thread.
+	"""
+
+	def __init__(self, path, opener):
+		self.handle = open(path, mode="rb")
+		self.stream = opener(self.handle)
+		self.queue = queue.Queue(maxsize=decompress_queue_depth)
+		self.stopping = threading.Event()
+		self.chunk = b""
+		self.pos = 0
+		self.done = False
+
+		# The number of compressed bytes behind the data handed to the
+		# reader so far, which can be compared against the size of the
+		# compressed file for progress.
+		self.compressed_offset = 0
+
+		self.thread = threading.Thread(target=self._decompress, daemon=True)
+		self.thread.start()
+
+	def _put(self, item):
+		while not self.stopping.is_set():
+			try:
+				self.queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def _decompress(self):
+		try:
+			while True:
+				chunk = self.stream.read(decompress_chunk_size)
+				if not chunk:
+					break
+				if not self._put((chunk, self.handle.tell())):
+					return
+			self._put(None)
+		except Exception as e:
+			self._put(e)
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		if self.pos == len(self.chunk):
+			if self.done:
+				return 0
+			item = self.queue.get()
+			if item is None:
+				self.done = True
+				return 0
+			if isinstance(item, Exception):
+				self.done = True
+				raise item
+			self.chunk, self.compressed_offset = item
+			self.pos = 0
+
+		n = min(len(b), len(self.chunk) - self.pos)
+		b[:n] = self.chunk[self.pos:self.pos + n]
+		self.pos += n
+		return n
+
+	def close(self):
+		if not self.closed:
+			self.stopping.set()
+			self.thread.join()
+			self.stream.close()
+			self.handle.close()
+		super().close()
+
+
+def open_raw_json(path, mode="r", buffering=read_buffer_size):
+	"""
+	Opens the raw dataset dump at `path` for reading in text ("r") or
+	binary ("rb") mode, transparently decompressing it if `path` ends in
+	`.gz`, `.bz2` or `.xz`.
+	"""
+	opener = _openers.get(path.suffix)
+	if opener is None:
+		return open(path, mode=mode, buffering=buffering)
+
+	reader = io.BufferedReader(_DecompressingReader(path, opener), buffer_size=buffering)
+	if "b" in mode:
+		return reader
+	return io.TextIOWrapper(reader)
+
+
+def compressed_offset(handle):
+	"""
+	Returns the number of compressed bytes consumed by a handle returned by
+	`open_raw_json`, or `None` if the handle is not decompressing.
+	"""
+	raw = getattr(handle, "buffer", handle)
+	raw = getattr(raw, "raw", None)
+	if isinstance(raw, _DecompressingReader):
+		return raw.compressed_offset
+	return None
+
+
+def f_line_count(path, buffering=read_buffer_size):
+	"""
+	Counts the lines of the, possibly compressed, dataset dump at `path`.
+	"""
+	count = 0
+	last = b"\n"
+	with open_raw_json(path, mode="rb", buffering=buffering) as handle:
+		while True:
+			chunk = handle.read(buffering)
+			if not chunk:
+				break
+			count += chunk.count(b"\n")
+			last = chunk[-1:]
+	if last != b"\n":
+		count += 1
+	return count
@@ -0,0 +1,111 @@
+"""
+Field projection for the line-delimited JSON review datasets.
+
+Every script only needs two or three keys out of each review, yet
+`json.loads` builds the whole object, including the long `summary`,
+`reviewerName` and `helpful` values nobody reads. The projector
+below locates each requested key in the raw line and decodes only
+its value, falling back to `json.loads` whenever a line does not
+look the way it expects.
+"""
+import re
+import json
+
+
+_decoder = json.JSONDecoder()
+
+# Matches the separator after a key, up to the start of its value.
+_separator_re = re.compile(r'\s*:\s*')
+
+# Matches a plain integer or decimal number value.
+_number_re = re.compile(r'(-?\d+)(\.\d+)?(?=[\s,}\]])')
+
+
+def _is_escaped(line, p):
+	"""
+	Returns whether the quote at index `p` of `line` is preceded by an odd
+	number of backslashes, i.e. is an escaped quote inside another string.
+	"""
+	b = p - 1
+	while b >= 0 and line[b] == '\\':
+		b -= 1
+	return (p - 1 - b) % 2 == 1
+
+
+def _project_value(line, token):
+	"""
+	Decodes the value of the first key `token` (the key including its quotes)
+	in `line`. Raises `ValueError` if the key could not be located.
+	"""
+	p = line.find(token)
+	while p != -1:
+		if p == 0 or line[p - 1] != '\\' or not _is_escaped(line, p):
+			m = _separator_re.match(line, p + len(token))
+			if m is not None:
+				v = m.end()
+				# Strings without escapes and plain numbers are sliced out of
+				# the line directly, anything else goes through the decoder.
+				if line.startswith('"', v):
+					q = line.find('"', v + 1)
+					if q != -1 and line.find('\\', v + 1, q) == -1:
+						return line[v + 1:q]
+				else:
+					n = _number_re.match(line, v)
+					if n is not None:
+						whole, frac = n.groups()
+						return int(whole) if frac is None else float(whole + frac)
+				return _decoder.raw_decode(line, v)[0]
+		p = line.find(token, p + 1)
+	raise ValueError(f"key {token} not found")
+
+
+def projector(keys):
+	"""
+	Creates a function that takes a raw JSON line, as `str` or `bytes`,
+	and returns a tuple of the values of `keys` in the given order.
+
+	Lines the projector cannot handle are decoded with `json.loads`, so a
+	`KeyError` is raised if a key is missing from the line, just as with
+	indexing the result of `json.loads`.
+	"""
+	keys = tuple(keys)
+	tokens = tuple((json.dumps(key) + ': ', len(json.dumps(key)) + 2) for key in keys)
+	number_match = _number_re.match
+
+	def _project(line):
+		if isinstance(line, bytes):
+			line = line.decode("utf-8")
+		values = []
+		try:
+			for token, token_len in tokens:
+				# Fast path for the compact `"key": value` form the datasets
+				# are written in, falling back to the general search otherwise.
+				p = line.find(token)
+				if p > 0 and line[p - 1] != '\\':
+					v = p + token_len
+					if line.startswith('"', v):
+						q = line.find('"', v + 1)
+						if q != -1 and line.find('\\', v + 1, q) == -1:
+							values.append(line[v + 1:q])
+							continue
+					else:
+						n = number_match(line, v)
+						if n is not None:
+							whole, frac = n.groups()
+							values.append(int(whole) if frac is None else float(whole + frac))
+							continue
+				values.append(_project_value(line, token[:-2]))
+		except ValueError:
+			obj = json.loads(line)
+			return tuple(obj[key] for key in keys)
+		return tuple(values)
+
+	return _project
+
+
+def project(line, keys):
+	"""
+	Returns a tuple of the values of `keys` in the raw JSON `line`. Prefer
+	`projector` when projecting the same keys out of many lines.
+	"""
+	return projector(keys)(line)
@@ -0,0 +1,73 @@
+"""
+Loads the heavy NLP models and libraries of the scripts on first use.
+
+Importing stanza pulls in torch and building an NLTK VADER analyzer
+reads its lexicon, which costs seconds, so a script that only
+rewrites tables, or fails early on a missing file, should pay for none
+of them. Every accessor here imports or builds its model the first time
+it is called and hands out the same instance afterwards; a worker
+process forked after the first call inherits it, and any other process
+loads its own on first use.
+
+	vader          NLTK's VADER `SentimentIntensityAnalyzer`
+	vader_scorer   an `amz_vader.BatchScorer` of `vader()`
+	stanza         the stanza module
+	stanza_pipeline
+	               a stanza pipeline per distinct configuration
+	perceptron     NLTK's pretrained averaged perceptron tagger
+
+`amz_norm.stopword_set` and `amz_norm.lemma` load NLTK's stopwords
+and WordNet the same way.
+"""
+import json
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def vader():
+	from nltk.sentiment.vader import SentimentIntensityAnalyzer
+	return SentimentIntensityAnalyzer()
+
+
+@functools.lru_cache(maxsize=None)
+def vader_scorer():
+	import amz_vader
+	return amz_vader.BatchScorer(vader())
+
+
+@functools.lru_cache(maxsize=None)
+def stanza():
+	import stanza
+	return stanza
+
+
+@functools.lru_cache(maxsize=None)
+def _stanza_pipeline(config_json):
+	return stanza().Pipeline(**json.loads(config_json))
+
+
+def stanza_pipeline(config):
+	"""
+	Returns the stanza pipeline built with the keyword arguments `config`,
+	building it only once per distinct `config`.
+	"""
+	return _stanza_pipeline(json.dumps(config, sort_keys=True))
+
+
+@functools.lru_cache(maxsize=None)
+def perceptron():
+	from nltk.tag.perceptron import PerceptronTagger
+	return PerceptronTagger()
+
+
+@functools.lru_cache(maxsize=None)
+def version(package):
+	"""
+	Returns the installed version of `package` without importing it where
+	its distribution metadata allows.
+	"""
+	import importlib.metadata
+	try:
+		return importlib.metadata.version(package)
+	except importlib.metadata.PackageNotFoundError:
+		return importlib.import_module(package).__version__
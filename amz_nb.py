@@ -3,6 +3,15 @@ import sys
 import udax as dx
 from pathlib import Path
 
+import amz_table
+import amz_ngrams
+import amz_columnar
+
+
+# The number of most frequent entries of each table the model uses, or
+# `None` to use every entry.
+max_table_entries = 2048
+
 
 def ldtable(path, words=1, max_entries=2048):
 	entries = 0
@@ -30,6 +39,41 @@ def ldtable(path, words=1, max_entries=2048):
 	return table, h_tot, h_pos, h_neg
 
 
+class TextTable:
+	"""
+	A `.table` text file read into a dict, looked up like an
+	`amz_table.BinaryTable`.
+	"""
+
+	def __init__(self, path, words=1, max_entries=2048):
+		self.order = words
+		self.table, self.total, self.total_pos, self.total_neg = ldtable(path, words, max_entries)
+
+	def counts(self, ngrams, max_entries=None):
+		"""
+		Returns the `(pos, neg)` counts of those of `ngrams` in the table,
+		in order, where the table was already cut to `max_entries` on load.
+		"""
+		table = self.table
+		if self.order == 1:
+			return [ table[ngram[0]] for ngram in ngrams if ngram[0] in table ]
+		return [ table[ngram] for ngram in ngrams if ngram in table ]
+
+	def close(self):
+		pass
+
+
+def open_table(table_f, words=1):
+	"""
+	Opens the table `table_f`, memory-mapping its binary counterpart if
+	it is up to date or reading the text table otherwise.
+	"""
+	btable_f = amz_table.prefer_binary(table_f)
+	if btable_f is not None:
+		return amz_table.BinaryTable(btable_f)
+	return TextTable(table_f, words, max_table_entries)
+
+
 def nb(amz_ds):
 	raw = amz_ds.joinpath("raw")
 
@@ -41,12 +85,16 @@ def nb(amz_ds):
 	turney_bi_f = raw.joinpath("turney_bi.table")
 	
 	print("Gathering size information...")
-	reporter = dx.BlockProcessReporter.file_lines(csv_f, block_size=256)
+	reporter = amz_columnar.row_reporter(csv_f, block_size=256)
 	stopwatch = dx.Stopwatch()
 
-	all_uni_table, all_uni_tot, all_uni_pos, all_uni_neg = ldtable(all_uni_f)
-	all_bi_table, all_bi_tot, all_bi_pos, all_bi_neg = ldtable(all_bi_f, words=2)
-	turney_bi_table, turney_bi_tot, turney_bi_pos, turney_bi_neg = ldtable(turney_bi_f, words=2)
+	all_uni_table = open_table(all_uni_f)
+	all_bi_table = open_table(all_bi_f, words=2)
+	turney_bi_table = open_table(turney_bi_f, words=2)
+	all_uni_pos, all_uni_neg = all_uni_table.total_pos, all_uni_table.total_neg
+	all_bi_pos, all_bi_neg = all_bi_table.total_pos, all_bi_table.total_neg
+	turney_bi_pos, turney_bi_neg = turney_bi_table.total_pos, turney_bi_table.total_neg
+	ngram_tables = { order: open_table(amz_ngrams.ngram_table_path(raw, order), words=order) for order in amz_ngrams.ngram_orders }
 
 	percent_pos = 0
 	percent_neg = 0
@@ -68,87 +116,74 @@ def nb(amz_ds):
 	turney_predict_tot = 0
 	turney_predict_acc = 0
 
+	ngram_predict_correct = { order: 0 for order in ngram_tables }
+	ngram_predict_tot = 0
+
 	print("Processing...")
 	stopwatch.start()
 	reporter.start()
-	with dx.f_open_large_read(csv_f) as csv_h:
-		for line in csv_h:
-			text, rating, est_rating, est_correct = dx.csv_parseln(line)
-			i_rating = int(rating)
-			i_est_rating = int(rating)
-			words = text.split()
+	for text, rating in amz_columnar.read_rows(csv_f):
+		i_rating = int(rating)
+		words = text.split()
 
-			p_pos = percent_pos
-			p_neg = percent_neg
+		p_pos = percent_pos
+		p_neg = percent_neg
 
-			# unigram naive bayes
-			for word in words:
-				if word not in all_uni_table:
-					continue
-				info = all_uni_table[word]
-				pos_count, neg_count = info
+		# unigram naive bayes
+		for pos_count, neg_count in all_uni_table.counts([ (word,) for word in words ], max_table_entries):
+			p_pos *= pos_count / all_uni_pos
+			p_neg *= neg_count / all_uni_neg
 
-				p_pos *= pos_count / all_uni_pos
-				p_neg *= neg_count / all_uni_neg
+		if (p_pos - p_neg > 0 and i_rating > 3) or (p_pos - p_neg < 0 and i_rating <= 3): # predicted correct
+			uni_predict_correct += 1
+		uni_predict_tot += 1
 
-			if (p_pos - p_neg > 0 and i_rating > 3) or (p_pos - p_neg < 0 and i_rating <= 3): # predicted correct
-				uni_predict_correct += 1
-			uni_predict_tot += 1
+		
+		p_pos = percent_pos
+		p_neg = percent_neg
 
-			
-			p_pos = percent_pos
-			p_neg = percent_neg
+		# all bigrams
+		bigrams = [ (words[i], words[i + 1]) for i in range(0, len(words) - 1, 2) ]
+		for pos_count, neg_count in all_bi_table.counts(bigrams, max_table_entries):
+			p_pos *= pos_count / all_bi_pos
+			p_neg *= neg_count / all_bi_neg
 
-			# all bigrams
-			i = 0
-			while i < len(words) - 1:
-				first = words[i]
-				second = words[i + 1]
-				bigram = (first, second)
-				i += 2
+		if (p_pos - p_neg > 0 and i_rating > 3) or (p_pos - p_neg < 0 and i_rating <= 3): # predicted correct
+			bi_predict_correct += 1
+		bi_predict_tot += 1
 
-				if bigram not in all_bi_table:
-					continue
 
-				info = all_bi_table[bigram]
-				pos_count, neg_count = info
-				
-				p_pos *= pos_count / all_bi_pos
-				p_neg *= neg_count / all_bi_neg
+		p_pos = percent_pos
+		p_neg = percent_neg
 
-			if (p_pos - p_neg > 0 and i_rating > 3) or (p_pos - p_neg < 0 and i_rating <= 3): # predicted correct
-				bi_predict_correct += 1
-			bi_predict_tot += 1
+		# turney bigrams
+		for pos_count, neg_count in turney_bi_table.counts(bigrams, max_table_entries):
+			p_pos *= pos_count / turney_bi_pos
+			p_neg *= neg_count / turney_bi_neg
+
+		if (p_pos - p_neg > 0 and i_rating > 3) or (p_pos - p_neg < 0 and i_rating <= 3): # predicted correct
+			turney_predict_correct += 1
+		turney_predict_tot += 1
 
 
+		# higher order n-grams
+		for order, ngram_table in ngram_tables.items():
 			p_pos = percent_pos
 			p_neg = percent_neg
-
-			# turney bigrams
-			i = 0
-			while i < len(words) - 1:
-				first = words[i]
-				second = words[i + 1]
-				bigram = (first)
-				i += 2
-				
-				if bigram not in turney_bi_table:
-					continue
-
-				info = turney_bi_table[bigram]
-				pos_count, neg_count = info
-
-				p_pos *= pos_count / turney_bi_pos
-				p_neg *= neg_count / turney_bi_neg
+			for pos_count, neg_count in ngram_table.counts(amz_ngrams.ngrams(words, order), max_table_entries):
+				p_pos *= pos_count / ngram_table.total_pos
+				p_neg *= neg_count / ngram_table.total_neg
 
 			if (p_pos - p_neg > 0 and i_rating > 3) or (p_pos - p_neg < 0 and i_rating <= 3): # predicted correct
-				turney_predict_correct += 1
-			turney_predict_tot += 1
+				ngram_predict_correct[order] += 1
+		ngram_predict_tot += 1
+
+		reporter.ping()
 
-			reporter.ping()
-	
 	reporter.finish()
 	stopwatch.stop()
+	for table in (all_uni_table, all_bi_table, turney_bi_table, *ngram_tables.values()):
+		table.close()
 	print(f"Done in {repr(stopwatch)}")
 	
 	uni_predict_acc = uni_predict_correct / uni_predict_tot
@@ -160,6 +195,8 @@ def nb(amz_ds):
 		nb_report_h.write("unigram accuracy: %.3f\n" % (100 * uni_predict_acc))
 		nb_report_h.write("all bigram accuracy: %.3f\n" % (100 * bi_predict_acc))
 		nb_report_h.write("turney bigram accuracy: %.3f\n" % (100 * turney_predict_acc))
+		for order, correct in ngram_predict_correct.items():
+			nb_report_h.write("all %d-gram accuracy: %.3f\n" % (order, 100 * correct / ngram_predict_tot))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,391 @@
+"""
+Streaming n-gram counting of any order, for features beyond the
+unigram and bigram tables of `amz_gen_feature_index_table.py`.
+
+The n-grams of a review are taken the way its bigrams are, as
+non-overlapping windows of `order` words at offsets 0, `order`,
+2 * `order` and so on, leaving out a shorter trailing window. Each
+order is counted into its own table, e.g. `raw/all_3gram.table`, in the
+format of the other `.table` files, with a binary counterpart, see
+`amz_table`, and a `.bounds` file describing how far its counts may be
+off.
+
+An n-gram is a row of `order` int32 word ids, used as a key through a
+fixed-width void view of the row. Three counting modes are available:
+
+	exact        every n-gram is counted, in memory growing with the
+	             number of distinct n-grams
+	misra_gries  a Misra-Gries summary of `ngram_capacity`
+	             `(n-gram, class)` counters; each count is short of its
+	             true count by at most the summed decrements, which are
+	             at most N / (`ngram_capacity` + 1) for N occurrences
+	count_min    a count-min sketch of `sketch_depth` x `sketch_width`
+	             counters per class, with the `ngram_capacity` n-grams of
+	             highest estimated count kept as candidates; each count
+	             exceeds its true count by at most e * N / `sketch_width`
+	             with probability 1 - e^-`sketch_depth`
+
+The approximate modes keep memory fixed apart from the vocabulary. The
+counters of consecutive runs of reviews can be merged, with the same
+guarantees as counting the runs in one counter.
+"""
+import math
+from array import array
+
+import numpy as np
+
+import amz_table
+import amz_counts
+
+
+# The orders of the n-gram tables counted and evaluated beyond the
+# unigram and bigram tables, e.g. (3, 4).
+ngram_orders = ()
+
+# One of "exact", "misra_gries" or "count_min".
+ngram_mode = "exact"
+
+# The number of counters of a Misra-Gries summary, or of candidate
+# n-grams kept alongside a count-min sketch.
+ngram_capacity = 2 ** 18
+
+# The number of counters per row of a count-min sketch, a power of 2.
+sketch_width = 2 ** 20
+
+# The number of rows, i.e. of hash functions, of a count-min sketch.
+sketch_depth = 4
+
+
+def ngram_table_path(raw, order):
+	return raw.joinpath(f"all_{order}gram.table")
+
+
+def bounds_path(table_f):
+	return table_f.with_suffix(".bounds")
+
+
+def ngrams(words, order):
+	"""
+	Returns the non-overlapping n-grams of `words` as tuples of `order`
+	words.
+	"""
+	return [ tuple(words[i:i + order]) for i in range(0, len(words) - order + 1, order) ]
+
+
+def _row_keys(rows):
+	rows = np.ascontiguousarray(rows, dtype=np.int32)
+	return rows.view(np.dtype((np.void, 4 * rows.shape[1]))).reshape(-1)
+
+
+def _key_rows(keys, width):
+	return keys.view(np.int32).reshape(-1, width)
+
+
+class NgramCounter:
+	"""
+	Buffers the word ids of whole reviews and hands their n-grams of the
+	given `order` to `_count` once the buffer fills up.
+	"""
+
+	mode = None
+
+	def __init__(self, order):
+		self.order = order
+		self.vocab = amz_counts.Vocab()
+		self.n_ngrams = 0
+		self.n_pos = 0
+		self.n_neg = 0
+		self._words = array("i")
+		self._lens = array("q")
+		self._positive = array("b")
+
+	def add(self, words, positive):
+		"""
+		Counts the n-grams of a review of `words`, which was `positive` or
+		not.
+		"""
+		self._words.extend(self.vocab.intern(words))
+		self._lens.append(len(words))
+		self._positive.append(1 if positive else 0)
+		if len(self._words) >= amz_counts.count_buffer_words:
+			self.flush()
+
+	def flush(self):
+		"""
+		Counts the buffered reviews.
+		"""
+		if not self._lens:
+			return
+		order = self.order
+		words = np.frombuffer(self._words, dtype=np.int32)
+		lens = np.frombuffer(self._lens, dtype=np.int64)
+		positive = np.repeat(np.frombuffer(self._positive, dtype=np.int8).astype(np.int64), lens)
+
+		starts = np.cumsum(lens) - lens
+		offset = np.arange(len(words)) - np.repeat(starts, lens)
+		remaining = np.repeat(lens, lens) - offset
+		at = np.flatnonzero((offset % order == 0) & (remaining >= order))
+		keys = _row_keys(words[at[:, None] + np.arange(order)])
+		positive = positive[at]
+		first = self.n_ngrams + np.arange(len(at))
+
+		self.n_ngrams += len(at)
+		self.n_pos += int(positive.sum())
+		self.n_neg += len(at) - int(positive.sum())
+		self._count(keys, positive, first)
+
+		self._words = array("i")
+		self._lens = array("q")
+		self._positive = array("b")
+
+	def merge(self, other):
+		"""
+		Adds the counts of `other`, a counter of the same order and mode over
+		the reviews that follow the reviews of this one.
+		"""
+		self.flush()
+		other.flush()
+		remap = np.array(self.vocab.intern(other.vocab.words), dtype=np.int32)
+		self._merge(other, remap)
+		self.n_ngrams += other.n_ngrams
+		self.n_pos += other.n_pos
+		self.n_neg += other.n_neg
+
+	def _remap(self, keys, remap, width):
+		rows = _key_rows(keys, width).copy()
+		rows[:, :self.order] = remap[rows[:, :self.order]]
+		return _row_keys(rows)
+
+	def _remapped(self, table, remap, width):
+		remapped = amz_counts.CountTable(key_dtype=table.keys.dtype)
+		remapped.keys, remapped.pos, remapped.neg, remapped.first = amz_counts.sum_by_key(
+			self._remap(table.keys, remap, width), table.pos, table.neg, table.first + self.n_ngrams)
+		return remapped
+
+	def _count(self, keys, positive, first):
+		raise NotImplementedError
+
+	def _merge(self, other, remap):
+		raise NotImplementedError
+
+	def table(self):
+		"""
+		Returns the counted n-grams as an `amz_counts.CountTable`.
+		"""
+		raise NotImplementedError
+
+	def bounds(self):
+		"""
+		Returns a description of how far the counts of the table may be off.
+		"""
+		raise NotImplementedError
+
+	def write(self, table_f, open_write):
+		"""
+		Writes the table to `table_f` with `open_write`, its binary
+		counterpart and its `.bounds` file.
+		"""
+		self.flush()
+		table = self.table()
+		ranked = table.ranked()
+		words = self.vocab.words
+		ngrams = [ tuple(words[i] for i in row) for row in _key_rows(table.keys[ranked], self.order).tolist() ]
+		pos = table.pos[ranked]
+		neg = table.neg[ranked]
+		total, total_pos, total_neg = table.totals()
+
+		with open_write(table_f) as table_h:
+			table_h.write(f"{total}\n")
+			table_h.write(f"{total_pos}\n")
+			table_h.write(f"{total_neg}\n")
+			for ngram, p, n in zip(ngrams, pos.tolist(), neg.tolist()):
+				table_h.write(f"{' '.join(ngram)} {p} {n}\n")
+		amz_table.write(amz_table.btable_path(table_f), self.order, ngrams, pos, neg, (total, total_pos, total_neg))
+		with open(bounds_path(table_f), mode="w") as bounds_h:
+			bounds_h.write(f"{self.bounds()}\n")
+
+
+class ExactNgramCounter(NgramCounter):
+
+	mode = "exact"
+
+	def __init__(self, order):
+		super().__init__(order)
+		self.counts = amz_counts.CountTable(key_dtype=_row_keys(np.empty((0, order))).dtype)
+
+	def _count(self, keys, positive, first):
+		self.counts.add(keys, positive, first)
+
+	def _merge(self, other, remap):
+		self.counts.merge(self._remapped(other.counts, remap, self.order))
+
+	def table(self):
+		return self.counts
+
+	def bounds(self):
+		return f"exact counts of {self.n_ngrams} {self.order}-grams"
+
+
+class MisraGriesNgramCounter(NgramCounter):
+	"""
+	Counts `(n-gram, class)` pairs with a Misra-Gries summary of `capacity`
+	counters, merged with the exact counts of each buffer and cut back to
+	`capacity` by subtracting the next largest count from every counter.
+	"""
+
+	mode = "misra_gries"
+
+	def __init__(self, order, capacity=None):
+		super().__init__(order)
+		self.capacity = ngram_capacity if capacity is None else capacity
+		self.decrement = 0
+		# the key of a counter is the n-gram's ids followed by its class
+		self.summary = amz_counts.CountTable(key_dtype=_row_keys(np.empty((0, order + 1))).dtype)
+
+	def _count(self, keys, positive, first):
+		rows = np.empty((len(keys), self.order + 1), dtype=np.int32)
+		rows[:, :-1] = _key_rows(keys, self.order)
+		rows[:, -1] = positive
+		self.summary.add(_row_keys(rows), positive, first)
+		self._cut()
+
+	def _merge(self, other, remap):
+		self.summary.merge(self._remapped(other.summary, remap, self.order + 1))
+		self.decrement += other.decrement
+		self._cut()
+
+	def _cut(self):
+		summary = self.summary
+		if len(summary) > self.capacity:
+			counts = summary.pos + summary.neg
+			cut = int(np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1])
+			keep = counts > cut
+			self.decrement += cut
+			# a counter is of one class only, so only one of pos and neg is set
+			summary.keys = summary.keys[keep]
+			summary.pos = np.maximum(summary.pos[keep] - cut, 0)
+			summary.neg = np.maximum(summary.neg[keep] - cut, 0)
+			summary.first = summary.first[keep]
+
+	def table(self):
+		summary = self.summary
+		ngram_keys = _row_keys(_key_rows(summary.keys, self.order + 1)[:, :-1])
+		table = amz_counts.CountTable(key_dtype=ngram_keys.dtype)
+		table.keys, table.pos, table.neg, table.first = amz_counts.sum_by_key(
+			ngram_keys, summary.pos, summary.neg, summary.first)
+		return table
+
+	def bounds(self):
+		n = self.n_ngrams
+		return f"misra_gries with {self.capacity} counters over {n} {self.order}-grams: " \
+			f"every positive and negative count is at most {self.decrement} below its true count " \
+			f"(N / (k + 1) = {n / (self.capacity + 1):.1f}), and every count above that is kept"
+
+
+class CountMinNgramCounter(NgramCounter):
+	"""
+	Counts n-grams with a count-min sketch per class, keeping the
+	`capacity` n-grams of highest estimated total count as candidates.
+	"""
+
+	mode = "count_min"
+
+	def __init__(self, order, capacity=None, width=None, depth=None):
+		super().__init__(order)
+		self.capacity = ngram_capacity if capacity is None else capacity
+		self.width = sketch_width if width is None else width
+		self.depth = sketch_depth if depth is None else depth
+		if self.width & (self.width - 1):
+			raise ValueError(f"the sketch width {self.width} is not a power of 2")
+		self.sketch = np.zeros((2, self.depth, self.width), dtype=np.int64)
+		rng = np.random.default_rng(0x414d5a)
+		self._a = rng.integers(1, 2 ** 63, size=self.depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+		self._b = rng.integers(0, 2 ** 63, size=self.depth, dtype=np.uint64)
+		self._word_fingerprints = np.empty(0, dtype=np.uint64)
+		# the keys and first occurrences of the candidates, sorted by key
+		self.candidate_keys = _row_keys(np.empty((0, order)))
+		self.candidate_first = np.empty(0, dtype=np.int64)
+
+	def _fingerprints(self):
+		# hashing the words rather than their ids makes the sketches of
+		# counters with different vocabularies mergeable
+		words = self.vocab.words
+		known = len(self._word_fingerprints)
+		if known < len(words):
+			fingerprints = [ amz_table.ngram_key((word,)) for word in words[known:] ]
+			self._word_fingerprints = np.concatenate((self._word_fingerprints, np.array(fingerprints, dtype=np.uint64)))
+		return self._word_fingerprints
+
+	def _hashes(self, keys):
+		# FNV-1a over the word fingerprints, then multiply-shift per row
+		word_fingerprints = self._fingerprints()
+		fingerprint = np.full(len(keys), 0xcbf29ce484222325, dtype=np.uint64)
+		for column in _key_rows(keys, self.order).T:
+			fingerprint ^= word_fingerprints[column]
+			fingerprint *= np.uint64(0x100000001b3)
+		shift = np.uint64(64 - self.width.bit_length() + 1)
+		return ((self._a[:, None] * fingerprint + self._b[:, None]) >> shift).astype(np.int64)
+
+	def _estimate(self, hashes):
+		rows = np.arange(self.depth)[:, None]
+		return self.sketch[1][rows, hashes].min(axis=0), self.sketch[0][rows, hashes].min(axis=0)
+
+	def _count(self, keys, positive, first):
+		hashes = self._hashes(keys)
+		for c, mask in ((1, positive == 1), (0, positive == 0)):
+			for i in range(self.depth):
+				self.sketch[c, i] += np.bincount(hashes[i, mask], minlength=self.width)
+
+		self._add_candidates(keys, first)
+
+	def _merge(self, other, remap):
+		if (other.width, other.depth) != (self.width, self.depth):
+			raise ValueError("count-min sketches of different shapes cannot be merged")
+		self.sketch += other.sketch
+		self._add_candidates(self._remap(other.candidate_keys, remap, self.order), other.candidate_first + self.n_ngrams)
+
+	def _add_candidates(self, keys, first):
+		zeros = np.zeros(len(self.candidate_keys) + len(keys), dtype=np.int64)
+		keys, _, _, first = amz_counts.sum_by_key(
+			np.concatenate((self.candidate_keys, keys)), zeros, zeros,
+			np.concatenate((self.candidate_first, first)))
+		if len(keys) > self.capacity:
+			pos, neg = self._estimate(self._hashes(keys))
+			keep = np.sort(np.argpartition(-(pos + neg), self.capacity)[:self.capacity])
+			keys = keys[keep]
+			first = first[keep]
+		self.candidate_keys = keys
+		self.candidate_first = first
+
+	def table(self):
+		table = amz_counts.CountTable(key_dtype=self.candidate_keys.dtype)
+		table.keys = self.candidate_keys
+		table.pos, table.neg = self._estimate(self._hashes(table.keys))
+		table.first = self.candidate_first
+		return table
+
+	def bounds(self):
+		slack_pos = math.e * self.n_pos / self.width
+		slack_neg = math.e * self.n_neg / self.width
+		confidence = 1 - math.exp(-self.depth)
+		return f"count_min {self.depth}x{self.width} over {self.n_ngrams} {self.order}-grams, " \
+			f"top {self.capacity} kept: each positive count is at most {slack_pos:.1f} and each " \
+			f"negative count at most {slack_neg:.1f} above its true count with probability {confidence:.4f}"
+
+
+_counters = {
+	"exact": ExactNgramCounter,
+	"misra_gries": MisraGriesNgramCounter,
+	"count_min": CountMinNgramCounter,
+}
+
+
+def ngram_counter(order, mode=None):
+	"""
+	Returns a counter of n-grams of `order` in `mode`, `ngram_mode` by
+	default.
+	"""
+	mode = ngram_mode if mode is None else mode
+	if mode not in _counters:
+		raise ValueError(f"unknown n-gram counting mode {mode!r}")
+	return _counters[mode](order)
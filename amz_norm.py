@@ -0,0 +1,98 @@
+"""
+Text normalization shared by the scripts, built on precompiled
+`str.translate` tables, frozenset stopword lookups and a bounded memo
+of WordNet lemmas.
+
+Two flavours of punctuation handling are kept apart because the
+scripts depend on them as they are:
+
+	lifting    replaces punctuation with whitespace, which is what
+	           `udax.s_norm` and `surjective_punct_remove` do, so
+	           "don't" becomes the words "don" and "t"
+	stripping  deletes punctuation, which is what the NLTK pipeline
+	           does, so "don't" becomes the word "dont"
+
+Punctuation is that of `string.punctuation` in both cases.
+"""
+import string
+import functools
+
+
+# The maximum number of distinct words whose lemma is memoized. Review
+# vocabularies follow Zipf's law, so a memo much smaller than the
+# vocabulary still catches nearly every lookup.
+lemma_memo_size = 2 ** 18
+
+_lift_table = str.maketrans(string.punctuation, " " * len(string.punctuation))
+_strip_table = str.maketrans("", "", string.punctuation)
+
+
+def lift_punct(text):
+	"""
+	Replaces every punctuation character of `text` with a space.
+	"""
+	return text.translate(_lift_table)
+
+
+def strip_punct(text):
+	"""
+	Deletes every punctuation character of `text`.
+	"""
+	return text.translate(_strip_table)
+
+
+def words(text):
+	"""
+	Returns the lowercase words of `text` with its punctuation lifted, i.e.
+	`udax.s_norm(text).split()`.
+	"""
+	return lift_punct(text).lower().split()
+
+
+def norm(text):
+	"""
+	Equivalent to `udax.s_norm(text)`.
+	"""
+	return " ".join(words(text))
+
+
+@functools.lru_cache(maxsize=None)
+def stopword_set(language="english"):
+	"""
+	Returns NLTK's stopwords of `language` as a frozenset.
+	"""
+	from nltk.corpus import stopwords as nltk_stopwords
+	return frozenset(nltk_stopwords.words(language))
+
+
+def drop_stopwords(words, stopwords=None):
+	"""
+	Returns the `words` that are not `stopwords`, which default to the
+	English stopwords.
+	"""
+	if stopwords is None:
+		stopwords = stopword_set()
+	return [ word for word in words if word not in stopwords ]
+
+
+@functools.lru_cache(maxsize=None)
+def _lemmatizer():
+	from nltk.stem import WordNetLemmatizer
+	return WordNetLemmatizer()
+
+
+@functools.lru_cache(maxsize=lemma_memo_size)
+def lemma(word):
+	"""
+	Returns the WordNet lemma of `word`, looking up each distinct word
+	only once while it stays in the memo.
+	"""
+	return _lemmatizer().lemmatize(word)
+
+
+def lemmatize(text, sep=" "):
+	"""
+	Lemmatizes each word of `text`, as split by `sep`, and joins them back
+	with `sep`.
+	"""
+	return sep.join([ lemma(word) for word in text.split(sep) ])
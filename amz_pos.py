@@ -0,0 +1,385 @@
+"""
+Universal POS tagging of the already normalized review texts.
+
+Texts are space-split words, and the tags of a text line up one-to-one
+with `text.split()`. The tagger is one of the backends in `taggers`,
+chosen by `tagger_backend`:
+
+	stanza      stanza's neural pipeline, handed the words pretokenized,
+	            one single-sentence document per text
+	perceptron  NLTK's averaged perceptron, whose Penn Treebank tags are
+	            mapped to UPOS
+	lexicon     the most frequent tag of each word, as saved to
+	            `lexicon_path` by `build_lexicon` from the tags of another
+	            backend, and the most frequent tag overall otherwise
+
+Texts are read ahead in chunks, sorted by length within a chunk and
+tagged in batches of similar length, which keeps stanza's padding down.
+Batches are spread over a pool of worker processes that each hold one
+tagger, and the tags are yielded in the original order. Neither stanza
+nor NLTK is loaded before a tagger is built, see `amz_models`.
+
+Tagging takes hours on a large reduction, so the tags of a training set
+are saved as a CSV row per review, e.g. to `raw/tag-train`, alongside a
+key file, e.g. `raw/tag-train.key`, holding a digest of the file the
+training set is read from, `raw/col-train` or `raw/csv-train`, and of the
+tagger backend and configuration. As long as both are unchanged and there
+is a line of tags per row, later runs stream the saved tags instead of
+tagging again.
+"""
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import udax as dx
+
+import amz_shard
+import amz_models
+import amz_columnar
+
+
+# The tagger backend, one of the keys of `taggers`.
+tagger_backend = "stanza"
+
+# The keyword arguments of the stanza pipeline.
+tagger_config = {
+	"lang": "en",
+	"processors": "tokenize,pos",
+	"tokenize_pretokenized": True,
+	"pos_batch_size": 5000,
+	"verbose": False,
+}
+
+# The lexicon of the "lexicon" backend.
+lexicon_path = Path("data/pos.lexicon")
+
+# The number of worker processes that tag, each holding one tagger,
+# where a value < 1 means one worker per available core. A value of 1
+# tags in this process.
+tagger_processes = 1
+
+# The number of texts tagged in one call of the tagger.
+tag_batch_size = 64
+
+# The number of texts read ahead and bucketed by length at a time.
+tag_chunk_size = 4096
+
+# The number of bytes read at a time when hashing a training set.
+hash_buffer_size = 2 ** 21
+
+# The UPOS tag of each Penn Treebank tag, following the conversion of
+# the Universal Dependencies English treebanks.
+_penn_upos = {
+	"JJ": "ADJ", "JJR": "ADJ", "JJS": "ADJ",
+	"NN": "NOUN", "NNS": "NOUN", "NNP": "PROPN", "NNPS": "PROPN",
+	"RB": "ADV", "RBR": "ADV", "RBS": "ADV", "WRB": "ADV",
+	"VB": "VERB", "VBD": "VERB", "VBG": "VERB", "VBN": "VERB", "VBP": "VERB", "VBZ": "VERB",
+	"MD": "AUX",
+	"PRP": "PRON", "PRP$": "PRON", "WP": "PRON", "WP$": "PRON", "EX": "PRON",
+	"DT": "DET", "PDT": "DET", "WDT": "DET",
+	"IN": "ADP",
+	"CC": "CCONJ",
+	"CD": "NUM",
+	"RP": "PART", "TO": "PART", "POS": "PART",
+	"UH": "INTJ",
+	"SYM": "SYM", "$": "SYM", "#": "SYM",
+	".": "PUNCT", ",": "PUNCT", ":": "PUNCT", "``": "PUNCT", "''": "PUNCT", "-LRB-": "PUNCT", "-RRB-": "PUNCT",
+	"FW": "X", "LS": "X",
+}
+
+
+class StanzaTagger:
+	"""
+	Tags with a stanza pipeline built from `tagger_config`.
+	"""
+
+	def __init__(self):
+		self.pipeline = amz_models.stanza_pipeline(tagger_config)
+		self.document = amz_models.stanza().Document
+
+	@staticmethod
+	def identity():
+		return json.dumps(tagger_config, sort_keys=True) + amz_models.version("stanza")
+
+	def tag(self, texts):
+		docs = self.pipeline([ self.document([], text=text) for text in texts ])
+		return [ [ word.upos for sent in doc.sentences for word in sent.words ] for doc in docs ]
+
+
+class PerceptronTagger:
+	"""
+	Tags with NLTK's pretrained averaged perceptron, mapping its Penn
+	Treebank tags to UPOS.
+	"""
+
+	def __init__(self):
+		self.tagger = amz_models.perceptron()
+
+	@staticmethod
+	def identity():
+		return f"perceptron {amz_models.version('nltk')}"
+
+	def tag(self, texts):
+		tag = self.tagger.tag
+		return [ [ _penn_upos.get(penn, "X") for _, penn in tag(text.split()) ] for text in texts ]
+
+
+class LexiconTagger:
+	"""
+	Tags each word with its tag in the lexicon at `lexicon_path`, or in
+	`lexicon` with the `default` tag if they are given.
+	"""
+
+	def __init__(self, lexicon=None, default=None):
+		if lexicon is None:
+			lexicon, default = load_lexicon(lexicon_path)
+		self.lexicon, self.default = lexicon, default
+
+	@staticmethod
+	def identity():
+		with open(lexicon_path, mode="rb") as lexicon_h:
+			return f"lexicon {hashlib.sha1(lexicon_h.read()).hexdigest()}"
+
+	def tag(self, texts):
+		get = self.lexicon.get
+		default = self.default
+		return [ [ get(word, default) for word in text.split() ] for text in texts ]
+
+
+taggers = {
+	"stanza": StanzaTagger,
+	"perceptron": PerceptronTagger,
+	"lexicon": LexiconTagger,
+}
+
+
+def build_lexicon(tagged_texts):
+	"""
+	Returns the most frequent tag of each word of the `(text, tags)` pairs
+	of `tagged_texts`, and the most frequent tag overall.
+	"""
+	counts = {}
+	overall = Counter()
+	for text, tags in tagged_texts:
+		for word, tag in zip(text.split(), tags):
+			counts.setdefault(word, Counter())[tag] += 1
+			overall[tag] += 1
+	lexicon = { word: word_counts.most_common(1)[0][0] for word, word_counts in counts.items() }
+	default = overall.most_common(1)[0][0] if overall else "NOUN"
+	return lexicon, default
+
+
+def save_lexicon(lexicon_f, lexicon, default):
+	"""
+	Saves a lexicon as its default tag on the first line, then a line of
+	each word and its tag.
+	"""
+	with open(lexicon_f, mode="w") as lexicon_h:
+		lexicon_h.write(f"{default}\n")
+		for word, tag in lexicon.items():
+			lexicon_h.write(f"{word} {tag}\n")
+
+
+def load_lexicon(lexicon_f):
+	"""
+	Returns the lexicon and default tag saved by `save_lexicon`.
+	"""
+	with open(lexicon_f, mode="r") as lexicon_h:
+		default = lexicon_h.readline().strip()
+		lexicon = dict(line.split() for line in lexicon_h if line.strip())
+	return lexicon, default
+
+
+_tagger = None
+
+# The backend and identity of `_tagger`, which is built again for other ones.
+_tagger_identity = None
+
+
+def _identity():
+	return tagger_backend, taggers[tagger_backend].identity()
+
+
+def _init_tagger(backend, config, lexicon_f):
+	global _tagger, _tagger_identity, tagger_backend, tagger_config, lexicon_path
+	tagger_backend, tagger_config, lexicon_path = backend, config, lexicon_f
+	_tagger = taggers[backend]()
+	_tagger_identity = _identity()
+
+
+def _tag_batch(texts):
+	return _tagger.tag(texts)
+
+
+def _chunks(items, size):
+	chunk = []
+	for item in items:
+		chunk.append(item)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+def _tag_chunk(texts, map_batches):
+	"""
+	Tags `texts` in length-bucketed batches, tagged by `map_batches(_tag_batch,
+	batches)`, and returns the tags in the order of `texts`.
+	"""
+	order = sorted(range(len(texts)), key=lambda i: texts[i].count(" "))
+	batches = [ order[i:i + tag_batch_size] for i in range(0, len(order), tag_batch_size) ]
+	tags = [ None ] * len(texts)
+	results = map_batches(_tag_batch, [ [ texts[i] for i in batch ] for batch in batches ])
+	for batch, batch_tags in zip(batches, results):
+		for i, text_tags in zip(batch, batch_tags):
+			tags[i] = text_tags
+	return tags
+
+
+def tagged(rows, processes=None):
+	"""
+	Yields `(row, tags)` for each of the `rows`, in order, where `tags` are
+	the UPOS tags of the words of the text `row[0]`, tagged by `processes`
+	workers, `tagger_processes` by default.
+	"""
+	workers = amz_shard.worker_count(tagger_processes if processes is None else processes)
+	if workers == 1:
+		if _tagger is None or _tagger_identity != _identity():
+			_init_tagger(tagger_backend, tagger_config, lexicon_path)
+		for chunk in _chunks(rows, tag_chunk_size):
+			yield from zip(chunk, _tag_chunk([ row[0] for row in chunk ], map))
+		return
+
+	initargs = (tagger_backend, tagger_config, lexicon_path)
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_tagger, initargs=initargs) as executor:
+		for chunk in _chunks(rows, tag_chunk_size):
+			yield from zip(chunk, _tag_chunk([ row[0] for row in chunk ], executor.map))
+
+
+def tag_key_path(tag_f):
+	return tag_f.with_name(tag_f.name + ".key")
+
+
+def _line_count(path, digest=None):
+	"""
+	Returns the number of lines of the file at `path`, feeding its contents
+	to `digest` if given.
+	"""
+	lines = 0
+	last = b"\n"
+	with open(path, mode="rb") as handle:
+		while True:
+			chunk = handle.read(hash_buffer_size)
+			if not chunk:
+				break
+			if digest is not None:
+				digest.update(chunk)
+			lines += chunk.count(b"\n")
+			last = chunk[-1:]
+	return lines + (last != b"\n")
+
+
+def tag_key(csv_f):
+	"""
+	Returns the digest of the name and contents of the file the rows of
+	`csv_f` are read from, i.e. `amz_columnar.source_path(csv_f)`, and of
+	the tagger backend and configuration that the saved tags of `csv_f`
+	must match, along with the number of rows.
+	"""
+	source_f = amz_columnar.source_path(csv_f)
+	digest = hashlib.sha1()
+	digest.update(taggers[tagger_backend].identity().encode("utf-8"))
+	digest.update(b"\0" + source_f.name.encode("utf-8") + b"\0")
+	rows = _line_count(source_f, digest)
+	if source_f != csv_f:
+		rows = amz_columnar.row_count(source_f)
+	return digest.hexdigest(), rows
+
+
+def _write_tags(tag_h, tags):
+	# `dx.csv_writeln` splits a row of a single tag into its letters, as
+	# it unpacks any row of one iterable cell
+	tag_h.write(",".join(f'"{tag}"' for tag in tags) + "\n")
+
+
+def tags_valid(csv_f, tag_f):
+	"""
+	Returns the tag key of `csv_f` and whether the tags saved in `tag_f`
+	match it, with a line of tags per row.
+	"""
+	key, rows = tag_key(csv_f)
+	key_f = tag_key_path(tag_f)
+	if not (tag_f.exists() and key_f.exists() and key_f.read_text().strip() == key):
+		return key, False
+	return key, _line_count(tag_f) == rows
+
+
+def read_tags(tag_f, start=0):
+	"""
+	Yields the tags saved in each row of `tag_f`, from its `start`-th row
+	on.
+	"""
+	with dx.f_open_large_read(tag_f) as tag_h:
+		if start:
+			tag_h.seek(amz_shard.f_line_offset(tag_f, start))
+		for line in tag_h:
+			yield dx.csv_parseln(line) if line.strip() else []
+
+
+def tagged_cached(rows, csv_f, tag_f):
+	"""
+	Does what `tagged` does for the `rows` of the set `csv_f`,
+	streaming the tags saved in `tag_f` if they are still valid, or tagging
+	the rows and saving their tags to `tag_f` otherwise.
+	"""
+	key, valid = tags_valid(csv_f, tag_f)
+	key_f = tag_key_path(tag_f)
+	if valid:
+		print(f"Reusing the POS tags saved in {tag_f}")
+		yield from zip(rows, read_tags(tag_f))
+		return
+
+	if key_f.exists():
+		os.remove(key_f)
+	with dx.f_open_large_write(tag_f) as tag_h:
+		for row, tags in tagged(rows):
+			_write_tags(tag_h, tags)
+			yield row, tags
+	# only mark the tags valid once every row was tagged
+	key_f.write_text(f"{key}\n")
+
+
+def tag_part_path(tag_f, part):
+	return tag_f.with_name(f"{tag_f.name}.part-{part:04d}")
+
+
+def tagged_part(rows, part_f):
+	"""
+	Does what `tagged` does in this process, saving the tags to the part
+	file `part_f`, which `join_tag_parts` later joins with the others.
+	"""
+	with dx.f_open_large_write(part_f) as part_h:
+		for row, tags in tagged(rows, processes=1):
+			_write_tags(part_h, tags)
+			yield row, tags
+
+
+def join_tag_parts(tag_f, part_fs, key):
+	"""
+	Concatenates the part files `part_fs`, in order, into `tag_f`, removes
+	them and marks the tags valid for the tag `key`.
+	"""
+	key_f = tag_key_path(tag_f)
+	if key_f.exists():
+		os.remove(key_f)
+	with open(tag_f, mode="wb") as tag_h:
+		for part_f in part_fs:
+			with open(part_f, mode="rb") as part_h:
+				shutil.copyfileobj(part_h, tag_h, hash_buffer_size)
+			os.remove(part_f)
+	key_f.write_text(f"{key}\n")
@@ -32,18 +32,24 @@ Average Rating: 4.223
 """
 import os
 import sys
-import json
+import contextlib
 import udax as dx
-from nltk.corpus import stopwords
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from pathlib import Path
 
+import amz_io
+import amz_json
+import amz_models
+import amz_norm
+import amz_index
+import amz_shard
+import amz_reduce_pool
+import amz_vader_cache
 
-sid = SentimentIntensityAnalyzer()
 
 # Stopwords will be removed immediately to reduce
-# storage requirements and processing time later.
-useless_words = set(stopwords.words("english"))
+# storage requirements and processing time later,
+# NLTK's English stopwords if `None`, loaded on first use.
+useless_words = None
 
 # The minimum number of words required for a review
 # to be considered in the reduction process.
@@ -60,66 +66,215 @@ tests_per_rating = 256
 # feedback to the user.
 report_block_size = 1024
 
+# The number of worker processes that normalize and score reviews,
+# where a value < 1 means one worker per available core. The reduced
+# dataset is the same for any number of workers.
+worker_processes = 1
+
+# The number of reviews handed to a worker process at a time.
+batch_size = 256
+
+# Determines whether reviews are scored a batch at a time with the
+# NumPy scorer of `amz_vader` instead of one by one with NLTK, which
+# gives the same compound scores.
+use_batch_vader = True
+
+# Determines whether VADER scores are looked up in, and added to,
+# the persistent score cache (see `amz_vader_cache`) shared with
+# the other scripts that score reviews.
+use_vader_cache = True
+
+# Determines whether the reviews are selected through the
+# persistent review index (see `amz_index`), built on first
+# use, instead of scanning `raw/json` until the quotas fill.
+use_review_index = False
+
+# The seed of the stratified random sample of matching reviews
+# selected through the review index, or `None` to select the
+# first matching reviews just like a scan does.
+review_sample_seed = None
+
+
+def _open_reviews(json_f):
+	"""
+	Opens the reviews of `json_f` to reduce, which are only those selected
+	through the review index when `use_review_index` is enabled.
+	"""
+	if use_review_index:
+		index = amz_index.load_index(json_f)
+		if index is not None:
+			quota = max_per_rating + tests_per_rating
+			rows = amz_index.select_rows(
+				(i for i in range(len(index)) if index.word_counts[i] >= min_words_per_review),
+				index.ratings.__getitem__,
+				{ rating: quota for rating in range(1, 6) },
+				seed=review_sample_seed)
+			print(f"Selected {len(rows)} reviews through the review index")
+			return contextlib.closing(amz_index.read_lines(json_f, [ index.offsets[i] for i in rows ]))
+	return amz_io.open_raw_json(json_f)
+
+
+_project = amz_json.projector([ "reviewText", "overall" ])
+
+# The score cache of the current reduction, inherited by worker processes.
+_vader_cache = None
+
+
+def _score_texts(texts):
+	if use_batch_vader:
+		return amz_models.vader_scorer().compound(texts)
+	sid = amz_models.vader()
+	return [ sid.polarity_scores(text)["compound"] for text in texts ]
+
+
+def _load_models():
+	"""
+	Loads the models a reduction uses up front, so that forked worker
+	processes inherit them instead of each loading its own.
+	"""
+	if use_batch_vader:
+		amz_models.vader_scorer()
+	else:
+		amz_models.vader()
+	if useless_words is None:
+		amz_norm.stopword_set()
+
+
+def _compound_batch(rnorms):
+	"""
+	Returns the compound VADER score of each of `rnorms` and whether it
+	was cached.
+	"""
+	if _vader_cache is not None:
+		return _vader_cache.score_batch(rnorms, _score_texts)
+	return [ (compound, False) for compound in _score_texts(rnorms) ]
+
+
+def _prepare_review(ln, full_ratings):
+	"""
+	Normalizes the review on line `ln`, returning `(rnorm, rating)`, or
+	`None` if the review is too short or its rating is in `full_ratings`.
+	"""
+	text, overall = _project(ln)
+	rating = int(float(overall))
+	if rating in full_ratings:
+		return None
+
+	words = amz_norm.words(text)
+	if len(words) < min_words_per_review:
+		return None
+
+	rnorm = ' '.join(amz_norm.drop_stopwords(words, useless_words))
+	return rnorm, rating
+
+
+def _score_batch(lines, full_ratings):
+	"""
+	Normalizes and scores the reviews on `lines`, returning for each the row
+	to write as `(rnorm, rating, est_rating, est_rating_correct)` followed by
+	its compound score and whether it was cached, or `None` if it is skipped.
+	"""
+	reviews = [ _prepare_review(ln, full_ratings) for ln in lines ]
+	scores = iter(_compound_batch([ review[0] for review in reviews if review is not None ]))
+	rows = []
+	for review in reviews:
+		if review is None:
+			rows.append(None)
+			continue
+
+		rnorm, rating = review
+		est_sentiment, cached = next(scores)
+		est_rating = int((est_sentiment + 1) * 5 / 2) + 1 # convert from (-1, 1) to [1, 5]
+
+		est_rating_correct = (rating > 3 and est_rating > 3) or \
+							 (rating == 3 and est_rating == 3) or \
+							 (rating < 3 and est_rating < 3)
+
+		rows.append((rnorm, rating, est_rating, est_rating_correct, est_sentiment, cached))
+	return rows
+
 
 def reduce_dataset(amz_ds):
+	"""
+	Reduces the dataset `amz_ds`, saving the VADER scores cached on the way
+	even if the reduction fails or is interrupted.
+	"""
+	global _vader_cache
+	if use_vader_cache:
+		_vader_cache = amz_vader_cache.ScoreCache()
+	try:
+		_reduce_dataset(amz_ds)
+	finally:
+		if _vader_cache is not None:
+			_vader_cache.close()
+			_vader_cache = None
+
+
+def _reduce_dataset(amz_ds):
 	print(f"Reducing {amz_ds}...")
 	raw = amz_ds.joinpath("raw")
-	json_f = raw.joinpath("json")
+	json_f = amz_io.raw_json_path(raw)
 	csv_f = raw.joinpath("csv-train")
 	csv_test_f = raw.joinpath("csv-test")
 
 	max_reviews_acceptable = (max_per_rating + tests_per_rating) * 5
 	rating_table = [ 0, 0, 0, 0, 0 ]
 	testing_rating_table = [ 0, 0, 0, 0, 0 ]
+	full_ratings = set()
 	reviews_tot = 0
 	est_ratings_correct = 0
 
 	reporter = dx.BlockProcessReporter(report_block_size, max_reviews_acceptable)
 	stopwatch = dx.Stopwatch()
 
+	def _accept(row):
+		"""
+		Writes a scored review unless the quotas of its rating filled up
+		after it was scored, and returns whether all quotas are full.
+		"""
+		nonlocal reviews_tot, est_ratings_correct
+		rnorm, rating, est_rating, est_rating_correct, est_sentiment, cached = row
+		if _vader_cache is not None:
+			_vader_cache.record(rnorm, est_sentiment, cached)
+		if rating in full_ratings:
+			return False
+
+		if est_rating_correct:
+			est_ratings_correct += 1
+
+		if rating_table[rating - 1] < max_per_rating:
+			dx.csv_writeln(rnorm, rating, est_rating, est_rating_correct, stream=csv_h)
+			rating_table[rating - 1] += 1
+		else:
+			dx.csv_writeln(rnorm, rating, est_rating, est_rating_correct, stream=csv_test_h)
+			testing_rating_table[rating - 1] += 1
+
+		if rating_table[rating - 1] == max_per_rating and \
+		   testing_rating_table[rating - 1] == tests_per_rating:
+			full_ratings.add(rating)
+
+		reviews_tot += 1
+		reporter.ping()
+
+		return reviews_tot == max_reviews_acceptable
+
+	print("Loading models...")
+	_load_models()
+
 	print("Processing...")
 	stopwatch.start()
 	reporter.start()
 	with dx.f_open_large_write(csv_test_f) as csv_test_h:
 		with dx.f_open_large_write(csv_f) as csv_h:
-			with dx.f_open_large_read(json_f) as json_h:
-				for ln in json_h:
-					obj = json.loads(ln)
-					rating = int(float(obj["overall"]))
-					
-					if rating_table[rating - 1] == max_per_rating and \
-					   testing_rating_table[rating - 1] == tests_per_rating:
-						continue
-
-					norm = dx.s_norm(obj["reviewText"])
-					words = norm.split()
-					if len(words) < min_words_per_review:
-						continue
-
-					rnorm = ' '.join(filter(lambda x: x not in useless_words, words))
-					score = sid.polarity_scores(rnorm)
-					est_sentiment = score["compound"]
-					est_rating = int((est_sentiment + 1) * 5 / 2) + 1 # convert from (-1, 1) to [1, 5]
-
-					est_rating_correct = (rating > 3 and est_rating > 3) or \
-										 (rating == 3 and est_rating == 3) or \
-										 (rating < 3 and est_rating < 3)
-
-					if est_rating_correct:
-						est_ratings_correct += 1
-
-					if rating_table[rating - 1] < max_per_rating:
-						dx.csv_writeln(rnorm, rating, est_rating, est_rating_correct, stream=csv_h)
-						rating_table[rating - 1] += 1
-					else:
-						dx.csv_writeln(rnorm, rating, est_rating, est_rating_correct, stream=csv_test_h)
-						testing_rating_table[rating - 1] += 1
-					
-					reviews_tot += 1
-					reporter.ping()
-
-					if reviews_tot == max_reviews_acceptable:
-						break
+			with _open_reviews(json_f) as json_h:
+				if amz_shard.worker_count(worker_processes) == 1:
+					amz_reduce_pool.reduce_serial(
+						json_h, _score_batch, _accept, batch_size,
+						skip_state=lambda: full_ratings)
+				else:
+					amz_reduce_pool.reduce_parallel(
+						json_h, _score_batch, _accept, worker_processes, batch_size,
+						skip_state=lambda: frozenset(full_ratings))
 	
 	stopwatch.stop()
 	reporter.finish()
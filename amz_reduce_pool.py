@@ -0,0 +1,85 @@
+"""
+A process pool for the reducers, in which worker processes normalize
+and score batches of reviews while this process, the coordinator,
+accepts the scored reviews in dataset order and enforces the quotas.
+
+Batches are handed out in dataset order and their results consumed
+in that same order, so the reduced dataset is identical to that of a
+serial run regardless of the number of workers. Only a bounded number
+of batches is in flight at any time, and no further batches are
+handed out once the quotas are full.
+"""
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+import amz_shard
+
+
+# The number of batches in flight per worker process, which keeps the
+# workers busy while the coordinator consumes results.
+batches_per_worker = 4
+
+
+def _batched(lines, batch_size):
+	batch = []
+	for line in lines:
+		batch.append(line)
+		if len(batch) == batch_size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def reduce_serial(lines, score_batch, consume, batch_size, skip_state=None):
+	"""
+	Does what `reduce_parallel` does, in this process.
+	"""
+	for batch in _batched(lines, batch_size):
+		skip = skip_state() if skip_state is not None else None
+		for score in score_batch(batch, skip):
+			if score is not None and consume(score):
+				return
+
+
+def reduce_parallel(lines, score_batch, consume, workers, batch_size, skip_state=None):
+	"""
+	Scores `lines` in batches of `batch_size` with `score_batch(batch, skip)`
+	on `workers` worker processes and passes each non-`None` score, in
+	dataset order, to `consume(score)` until it returns `True`, i.e. until
+	all quotas are full.
+
+	If given, `skip_state()` is called whenever a batch is handed out, and its
+	result is passed to `score_batch` so that workers can skip reviews that
+	can no longer be accepted, e.g. those of a rating whose quota is already
+	full. Otherwise `None` is passed.
+	`score_batch` must be a module-level function so it can be pickled.
+	"""
+	workers = amz_shard.worker_count(workers)
+	batches = _batched(lines, batch_size)
+	pending = collections.deque()
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		def _submit():
+			batch = next(batches, None)
+			if batch is None:
+				return False
+			skip = skip_state() if skip_state is not None else None
+			pending.append(executor.submit(score_batch, batch, skip))
+			return True
+
+		for _ in range(workers * batches_per_worker):
+			if not _submit():
+				break
+
+		done = False
+		while pending and not done:
+			for score in pending.popleft().result():
+				if score is not None and consume(score):
+					done = True
+					break
+			if not done:
+				_submit()
+
+		for future in pending:
+			future.cancel()
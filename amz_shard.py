@@ -0,0 +1,142 @@
+"""
+Utilities for splitting the large line-delimited dataset files
+(e.g. `raw/json`) into newline-aligned byte ranges so that each
+range can be processed independently, typically in its own worker
+process.
+
+A byte range is a `(start, end)` pair of file offsets where
+`start` is always the first byte of a line and `end` is always
+one past the trailing newline of a line (or the end of the file),
+so no line is ever split between two ranges.
+"""
+import os
+
+
+# The number of bytes read at a time when scanning a byte range.
+#
+# 2^21 = 2MB, matching the read buffers used by the scripts.
+range_read_buffer = 2 ** 21
+
+
+def worker_count(workers):
+	"""
+	Resolves a configured worker count, where any value < 1 means
+	"one worker per available core".
+	"""
+	if workers is None or workers < 1:
+		return os.cpu_count() or 1
+	return workers
+
+
+def f_byte_ranges(path, n_ranges, start=0, end=None):
+	"""
+	Splits the file at `path` into at most `n_ranges` newline-aligned
+	byte ranges of roughly equal size. The ranges are returned in
+	file order, are contiguous, and together cover the whole file.
+
+	If `start` and `end` are given, only the byte range `[start, end)`,
+	which must itself be newline-aligned, is split instead.
+	"""
+	if end is None:
+		end = os.path.getsize(path)
+	size = end - start
+	if size <= 0:
+		return []
+	n_ranges = max(1, min(n_ranges, size))
+
+	bounds = [ start ]
+	with open(path, mode="rb") as handle:
+		for i in range(1, n_ranges):
+			guess = start + size * i // n_ranges
+			if guess <= bounds[-1]:
+				continue
+			handle.seek(guess - 1)
+			handle.readline() # skip to the start of the next line
+			offset = handle.tell()
+			if offset >= end:
+				break
+			if offset > bounds[-1]:
+				bounds.append(offset)
+	bounds.append(end)
+
+	return [ (bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) ]
+
+
+def f_range_lines(path, start, end, buffering=range_read_buffer):
+	"""
+	Yields each line, as `bytes` including the trailing newline,
+	of the byte range `[start, end)` of the file at `path`.
+	"""
+	with open(path, mode="rb", buffering=buffering) as handle:
+		handle.seek(start)
+		remaining = end - start
+		while remaining > 0:
+			line = handle.readline()
+			if not line:
+				break
+			remaining -= len(line)
+			yield line
+
+
+def f_last_line_end(path, buffering=range_read_buffer):
+	"""
+	Returns the offset one past the last newline of the file at `path`,
+	i.e. the end of its last complete line, or 0 if it has none.
+	"""
+	size = os.path.getsize(path)
+	with open(path, mode="rb", buffering=0) as handle:
+		end = size
+		while end > 0:
+			start = max(0, end - buffering)
+			handle.seek(start)
+			chunk = handle.read(end - start)
+			p = chunk.rfind(b"\n")
+			if p != -1:
+				return start + p + 1
+			end = start
+	return 0
+
+
+def f_range_line_count(path, start, end, buffering=range_read_buffer):
+	"""
+	Counts the lines in the byte range `[start, end)` of the file at
+	`path`. A trailing line without a newline is counted as well.
+	"""
+	count = 0
+	last = b"\n"
+	with open(path, mode="rb", buffering=0) as handle:
+		handle.seek(start)
+		remaining = end - start
+		while remaining > 0:
+			chunk = handle.read(min(buffering, remaining))
+			if not chunk:
+				break
+			remaining -= len(chunk)
+			count += chunk.count(b"\n")
+			last = chunk[-1:]
+	if last != b"\n":
+		count += 1
+	return count
+
+
+def f_line_offset(path, lnum, buffering=range_read_buffer):
+	"""
+	Returns the offset of the start of the `lnum`-th line, counting from 0,
+	of the file at `path`, or the size of the file if it has fewer lines.
+	"""
+	offset = 0
+	with open(path, mode="rb", buffering=0) as handle:
+		while lnum > 0:
+			chunk = handle.read(buffering)
+			if not chunk:
+				break
+			lines = chunk.count(b"\n")
+			if lines < lnum:
+				lnum -= lines
+				offset += len(chunk)
+				continue
+			p = -1
+			for _ in range(lnum):
+				p = chunk.index(b"\n", p + 1)
+			return offset + p + 1
+	return offset
@@ -0,0 +1,157 @@
+"""
+External-memory counting for the count tables of `amz_counts`.
+
+Once a `FeatureCounter` outgrows its memory budget, each of its tables
+is spilled to disk as a run: the table's key-sorted `keys`, `pos`, `neg`
+and `first` arrays saved as raw int64 column files in a directory of
+their own, after which the counter starts over with empty tables. When
+the tables are written, the runs of a table are k-way merged by key a
+block at a time, the counts of equal keys are summed, and the summed
+entries are sorted by rank, i.e. by decreasing total count and then by
+first occurrence, a block at a time and spilled again. A last k-way
+merge of those ranked runs yields the entries in the order of the
+`.table` file.
+
+Runs are read a slice at a time, the slices of all the runs of a merge
+together holding about `merge_block_entries` entries.
+"""
+import heapq
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+
+# The number of entries held in memory at a time while merging.
+merge_block_entries = 2 ** 20
+
+# The least number of entries read from a run at a time.
+_min_read_entries = 2 ** 10
+
+_columns = ("keys", "pos", "neg", "first")
+
+
+class Run:
+	"""
+	A run of `(keys, pos, neg, first)` columns saved in `run_d`.
+	"""
+
+	def __init__(self, run_d, length):
+		self.run_d = run_d
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def read(self, start, end):
+		"""
+		Returns the columns of the entries `[start, end)` of the run.
+		"""
+		end = min(end, self.length)
+		return tuple(
+			np.fromfile(self.run_d.joinpath(column), dtype=np.int64, count=end - start, offset=8 * start)
+			for column in _columns)
+
+
+def write_run(run_d, keys, pos, neg, first):
+	run_d.mkdir(parents=True)
+	for column, values in zip(_columns, (keys, pos, neg, first)):
+		np.asarray(values, dtype=np.int64).tofile(run_d.joinpath(column))
+	return Run(run_d, len(keys))
+
+
+class Spill:
+	"""
+	A temporary directory under `spill_dir`, or the system's temporary
+	directory if it is `None`, holding the runs of any number of named
+	tables. The directory is removed on `close`.
+	"""
+
+	def __init__(self, spill_dir=None):
+		self.root = Path(tempfile.mkdtemp(prefix="spill-", dir=spill_dir))
+		self.runs = {}
+		self.n_runs = 0
+
+	def _run_d(self):
+		self.n_runs += 1
+		return self.root.joinpath(f"run-{self.n_runs:06d}")
+
+	def write(self, name, keys, pos, neg, first):
+		"""
+		Spills a key-sorted run of the table `name`.
+		"""
+		if len(keys):
+			self.runs.setdefault(name, []).append(write_run(self._run_d(), keys, pos, neg, first))
+
+	def write_ranked(self, keys, pos, neg, first):
+		"""
+		Spills a rank-sorted run, returned rather than kept with the
+		key-sorted runs.
+		"""
+		return write_run(self._run_d(), keys, pos, neg, first)
+
+	def close(self):
+		if self.root is None:
+			return
+		self.runs = {}
+		shutil.rmtree(self.root, ignore_errors=True)
+		self.root = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def _read_size(runs, block_entries):
+	if block_entries is None:
+		block_entries = merge_block_entries
+	return max(block_entries // max(len(runs), 1), _min_read_entries)
+
+
+def merge_by_key(runs, block_entries=None):
+	"""
+	K-way merges the key-sorted `runs`, whose keys are unique within each
+	run, yielding blocks of concatenated `(keys, pos, neg, first)` arrays
+	such that the blocks come in key order and all the entries of a key
+	are in the same block.
+	"""
+	step = _read_size(runs, block_entries)
+	buffers = [ run.read(0, step) for run in runs ]
+	at = [ len(buffer[0]) for buffer in buffers ]
+	while True:
+		for i, run in enumerate(runs):
+			if len(buffers[i][0]) == 0 and at[i] < len(run):
+				buffers[i] = run.read(at[i], at[i] + step)
+				at[i] += len(buffers[i][0])
+		active = [ i for i in range(len(runs)) if len(buffers[i][0]) ]
+		if not active:
+			return
+
+		# the rest of each run is past the smallest last key of the buffers
+		bound = min(buffers[i][0][-1] for i in active)
+		parts = []
+		for i in active:
+			end = int(np.searchsorted(buffers[i][0], bound, side="right"))
+			parts.append(tuple(column[:end] for column in buffers[i]))
+			buffers[i] = tuple(column[end:] for column in buffers[i])
+
+		yield tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def _ranked_entries(run, step):
+	for start in range(0, len(run), step):
+		keys, pos, neg, first = run.read(start, start + step)
+		yield from zip((-(pos + neg)).tolist(), first.tolist(), keys.tolist(), pos.tolist(), neg.tolist())
+
+
+def merge_by_rank(runs, block_entries=None):
+	"""
+	K-way merges the rank-sorted `runs`, yielding their `(key, pos, neg)`
+	entries by decreasing total count, ties by first occurrence.
+	"""
+	step = _read_size(runs, block_entries)
+	for _, _, key, pos, neg in heapq.merge(*(_ranked_entries(run, step) for run in runs)):
+		yield key, pos, neg
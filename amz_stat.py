@@ -3,11 +3,21 @@ Compile statistics for each amazon dataset.
 """
 import os
 import sys
-import json
+import math
+import heapq
+import pickle
+import random
+import hashlib
+from array import array
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 import udax as dx
 
+import amz_io
+import amz_json
+import amz_shard
+
 
 # A 2^21 = 2MB buffer size for reading.
 read_buffer_size = 2 ** 21
@@ -19,65 +29,247 @@ write_buffer_size = 2 ** 19
 # chunks. This is mainly used to control feed
 block_size = 2 ** 16
 
+# The number of worker processes used to compile the statistics.
+#
+# A value of 1 processes the dataset serially in this process. Any
+# other value splits `raw/json` into newline-aligned byte ranges whose
+# statistics are compiled by separate worker processes and merged,
+# where a value < 1 means one worker per available core. Compressed
+# dumps are always processed serially.
+worker_processes = 1
+
+# The number of byte ranges assigned to each worker process.
+ranges_per_worker = 4
+
+# Determines whether the statistics are compiled incrementally.
+#
+# When enabled, the aggregated statistics and the offset of the last
+# review processed are saved to `raw/stat.ckpt`, and later runs only
+# process the reviews appended to `raw/json` since then. The checkpoint
+# is discarded whenever the reviews it covers have changed. Compressed
+# dumps are always processed in full.
+incremental = False
+
+# The number of bytes at the start of the dataset and before the
+# checkpointed offset whose digest is used to detect whether the
+# already processed reviews have changed.
+checkpoint_digest_size = 2 ** 16
+
+# The maximum number of items listed in the report, most reviewed
+# first, or `None` to list every item.
+max_report_items = None
+
+# The number of reviews to sample for a quick preview of the statistics,
+# or 0 to compile the exact statistics.
+#
+# In preview mode, reviews are read from random byte offsets of
+# `raw/json` (resyncing to the next line) and an estimate of the
+# statistics with 95% confidence intervals is written to
+# `raw/stat.preview` instead of `raw/stat`. Compressed dumps cannot be
+# previewed.
+preview_samples = 0
+
+# The seed of the random offsets read in preview mode.
+preview_seed = 0
+
+# The number of counters of the heavy-hitters sketch used to estimate
+# the most reviewed items in preview mode. Any item with more than a
+# `1 / preview_heavy_items` share of the reviews is guaranteed to be
+# tracked.
+preview_heavy_items = 256
+
+# Bumped whenever the layout of a saved StatAggregate changes, so that
+# older checkpoints are discarded instead of misread.
+_checkpoint_version = 2
+
+_zero_ratings = array("I", [ 0, 0, 0, 0, 0 ])
+
+
+class StatAggregate:
+	"""
+	The statistics of some part of a dataset, which can be merged with the
+	statistics of the following parts to obtain those of the whole dataset.
+
+	Items are interned to dense ids in order of first appearance, with
+	`item_ids` mapping each item id (asin) to its dense id and `item_asins`
+	mapping it back. The number of reviews of item `i` is `item_counts[i]`
+	and its rating histogram is `item_ratings[5 * i:5 * i + 5]`. The
+	columns are flat arrays rather than per-item lists to keep the memory
+	use of large datasets down.
+	"""
+
+	def __init__(self):
+		self.tot_reviews = 0
+		self.tot_rating = 0
+		self.rating_stat = [ 0, 0, 0, 0, 0 ]
+
+		self.item_ids = {}
+		self.item_asins = []
+		self.item_counts = array("I")
+		self.item_ratings = array("I")
+
+	def _intern(self, item_id):
+		i = self.item_ids.get(item_id)
+		if i is None:
+			i = self.item_ids[item_id] = len(self.item_asins)
+			self.item_asins.append(item_id)
+			self.item_counts.append(0)
+			self.item_ratings.extend(_zero_ratings)
+		return i
+
+	def add(self, item_id, item_rating):
+		n_item_rating = int(float(item_rating))
+
+		self.tot_reviews += 1
+		self.tot_rating += item_rating
+
+		i = self._intern(item_id)
+		self.item_counts[i] += 1
+
+		if 1 <= n_item_rating and n_item_rating <= 5:
+			self.item_ratings[5 * i + n_item_rating - 1] += 1
+			self.rating_stat[n_item_rating - 1] += 1
+
+	def merge(self, other):
+		"""
+		Merges the statistics `other` of the part of the dataset following
+		this one into this aggregate.
+		"""
+		self.tot_reviews += other.tot_reviews
+		self.tot_rating += other.tot_rating
+		for r in range(5):
+			self.rating_stat[r] += other.rating_stat[r]
+
+		for j, item_id in enumerate(other.item_asins):
+			i = self._intern(item_id)
+			self.item_counts[i] += other.item_counts[j]
+			for r in range(5):
+				self.item_ratings[5 * i + r] += other.item_ratings[5 * j + r]
+		return self
+
+	def top_items(self, n=None):
+		"""
+		Returns the dense ids of the `n` most reviewed items, or of all items
+		if `n` is `None`, most reviewed first and in order of first
+		appearance among items with as many reviews.
+		"""
+		counts = self.item_counts
+		if n is None or n >= len(counts):
+			return sorted(range(len(counts)), key=counts.__getitem__, reverse=True)
+		return heapq.nlargest(n, range(len(counts)), key=counts.__getitem__)
 
-def gen_analytics(amz_ds):
-	raw = amz_ds.joinpath("raw")
-	json_f = raw.joinpath("json")
-	stat_f = raw.joinpath("stat")
-	print(f"Generating analytics of {amz_ds} into {stat_f}...")
 
-	# Setup feedback utilities
+def _aggregate_range(json_f, start, end):
+	agg = StatAggregate()
+	project = amz_json.projector([ "asin", "overall" ])
+	for line in amz_shard.f_range_lines(json_f, start, end, buffering=read_buffer_size):
+		agg.add(*project(line))
+	return agg
+
+
+def _aggregate_serial(json_f, start=0, end=None):
 	print(f"Gathering size information...")
-	max_lines = dx.f_line_count(json_f, buffering=read_buffer_size)
-	stopwatch = dx.Stopwatch()
+	if end is None:
+		max_lines = amz_io.f_line_count(json_f, buffering=read_buffer_size)
+	else:
+		max_lines = amz_shard.f_range_line_count(json_f, start, end)
 	reporter = dx.BlockProcessReporter(block_size, max_lines)
 
-	# Data to record
-	tot_reviews = 0
-	tot_items = 0
-	tot_rating = 0
+	agg = StatAggregate()
+	project = amz_json.projector([ "asin", "overall" ])
+	if end is None:
+		with amz_io.open_raw_json(json_f, mode="r", buffering=read_buffer_size) as json_h:
+			for line in json_h:
+				agg.add(*project(line))
+				reporter.ping()
+	else:
+		for line in amz_shard.f_range_lines(json_f, start, end, buffering=read_buffer_size):
+			agg.add(*project(line))
+			reporter.ping()
+	reporter.finish()
+	return agg
 
-	item_stat = {}
-	item_avg = 0
 
-	rating_stat = [ 0, 0, 0, 0, 0 ]
-	rating_avg = 0
+def _aggregate_parallel(json_f, start=0, end=None):
+	workers = amz_shard.worker_count(worker_processes)
+	ranges = amz_shard.f_byte_ranges(json_f, workers * ranges_per_worker, start, end)
+	print(f"Splitting {json_f} into {len(ranges)} ranges for {workers} workers...")
 
-	# load and compute the data analytics
-	print(f"Processing statistics for {amz_ds}...")
-	stopwatch.start()
-	with open(json_f, mode="r", buffering=read_buffer_size) as json_h:
-		for line in json_h:
-			obj = json.loads(line)
-
-			item_id = obj["asin"]
-			item_rating = obj["overall"]
-			n_item_rating = int(float(item_rating))
-
-			tot_reviews += 1
-			tot_rating += item_rating
-			
-			if item_id not in item_stat:
-				item_stat[item_id] = [ 0, [ 0, 0, 0, 0, 0, ] ]
-				tot_items += 1
-			else:
-				item_stat[item_id][0] += 1
-
-			if 1 <= n_item_rating and n_item_rating <= 5:
-				item_stat[item_id][1][n_item_rating - 1] += 1
-				rating_stat[n_item_rating - 1] += 1
-			
-			reporter.ping()
+	agg = StatAggregate()
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [ executor.submit(_aggregate_range, json_f, start, end) for start, end in ranges ]
+		# merge in dataset order so items keep their order of first appearance
+		for i, future in enumerate(futures):
+			agg.merge(future.result())
+			print(f"[%5.1f%%] Merged range {i + 1}/{len(futures)}" % (100 * (i + 1) / len(futures)))
+	return agg
 
-		item_avg = tot_reviews / tot_items
-		rating_avg = tot_rating / tot_reviews
 
-		reporter.finish()
-	stopwatch.stop()
-	print(f"Done processing in {repr(stopwatch)}")
+def _digest_before(json_f, offset):
+	digest = hashlib.sha1()
+	start = max(0, offset - checkpoint_digest_size)
+	with open(json_f, mode="rb") as json_h:
+		digest.update(json_h.read(min(offset, checkpoint_digest_size)))
+		json_h.seek(start)
+		digest.update(json_h.read(offset - start))
+	return digest.hexdigest()
+
+
+def _load_checkpoint(ckpt_f, json_f):
+	"""
+	Returns the aggregate and offset saved in the checkpoint `ckpt_f` if it
+	still describes the beginning of `json_f`, or `(None, 0)` otherwise.
+	"""
+	if not ckpt_f.exists():
+		return None, 0
+	try:
+		with open(ckpt_f, mode="rb") as ckpt_h:
+			ckpt = pickle.load(ckpt_h)
+	except (OSError, pickle.UnpicklingError, EOFError) as e:
+		print(f"Ignoring unreadable checkpoint {ckpt_f}: {e}")
+		return None, 0
+
+	if not isinstance(ckpt, dict):
+		print(f"Ignoring unreadable checkpoint {ckpt_f}: not a checkpoint")
+		return None, 0
+	if ckpt.get("version") != _checkpoint_version:
+		print(f"Ignoring checkpoint {ckpt_f} from an older version")
+		return None, 0
+
+	try:
+		offset = ckpt["offset"]
+		if json_f.stat().st_size < offset or _digest_before(json_f, offset) != ckpt["digest"]:
+			print(f"Ignoring checkpoint {ckpt_f}, {json_f} has changed")
+			return None, 0
+		agg = StatAggregate()
+		agg.__dict__.update(ckpt["aggregate"])
+	except KeyError as e:
+		print(f"Ignoring incomplete checkpoint {ckpt_f}: missing {e}")
+		return None, 0
+	return agg, offset
+
+
+def _save_checkpoint(ckpt_f, json_f, agg, offset):
+	ckpt = {
+		"version": _checkpoint_version,
+		"offset": offset,
+		"digest": _digest_before(json_f, offset),
+		"aggregate": vars(agg),
+	}
+	tmp_f = ckpt_f.with_name(ckpt_f.name + ".tmp")
+	with open(tmp_f, mode="wb", buffering=write_buffer_size) as ckpt_h:
+		pickle.dump(ckpt, ckpt_h, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_f, ckpt_f)
+
+
+def _write_stat(stat_f, agg):
+	tot_reviews = agg.tot_reviews
+	tot_items = len(agg.item_asins)
+	rating_stat = agg.rating_stat
+
+	item_avg = tot_reviews / tot_items
+	rating_avg = agg.tot_rating / tot_reviews
 
-	# Save the statistics to a file
-	print(f"Saving statistics to {stat_f}...")
 	with open(stat_f, mode="w", buffering=write_buffer_size) as stat_h:
 		stat_h.write(f"Total reviews: {tot_reviews}\n")
 		stat_h.write(f"Total items: {tot_items}\n")
@@ -95,9 +287,11 @@ def gen_analytics(amz_ds):
 		stat_h.write("\n")
 
 		stat_h.write("%12s %10s %10s %8s %8s %8s %8s %8s\n" % ("Item ID", "Freq", "Freq %", "5/5 %", "4/5 %", "3/5 %", "2/5 %", "1/5 %"))
-		for item, data in sorted(item_stat.items(), key=lambda x: x[1][0], reverse=True):
-			count = data[0]
-			r1, r2, r3, r4, r5 = data[1]
+		for i in agg.top_items(max_report_items):
+			item = agg.item_asins[i]
+			# the report has always counted the reviews after an item's first
+			count = agg.item_counts[i] - 1
+			r1, r2, r3, r4, r5 = agg.item_ratings[5 * i:5 * i + 5]
 			tot_local_rating = r1 + r2 + r3 + r4 + r5
 
 			freq = 100 * count / tot_items
@@ -107,14 +301,221 @@ def gen_analytics(amz_ds):
 			percent_2 = 100 * r2 / tot_local_rating
 			percent_1 = 100 * r1 / tot_local_rating
 
-			#                 |    |        |        |        |        |        |        
+			#                 |    |        |        |        |        |        |
 			stat_h.write("%12s %10d %8.3f %% %6.1f %% %6.1f %% %6.1f %% %6.1f %% %6.1f %%\n" % (item, count, freq, percent_5, percent_4, percent_3, percent_2, percent_1))
+
+
+class SpaceSaving:
+	"""
+	The Space-Saving heavy-hitters sketch, which estimates the most frequent
+	items of a stream in memory bounded by its `capacity`.
+
+	Each tracked item keeps its estimated count, the maximum overestimation
+	of that count, and the rating histogram of the occurrences seen since
+	it was last (re)admitted into the sketch.
+	"""
+
+	def __init__(self, capacity):
+		self.capacity = capacity
+		self.counters = {}
+
+	def add(self, item_id, n_item_rating):
+		counter = self.counters.get(item_id)
+		if counter is None:
+			error = 0
+			if len(self.counters) == self.capacity:
+				evicted = min(self.counters, key=lambda x: self.counters[x][0])
+				error = self.counters.pop(evicted)[0]
+			counter = self.counters[item_id] = [ error, error, [ 0, 0, 0, 0, 0 ] ]
+		counter[0] += 1
+		if 1 <= n_item_rating and n_item_rating <= 5:
+			counter[2][n_item_rating - 1] += 1
+
+	def top(self):
+		"""
+		Returns `(item_id, count, error, ratings)` of the tracked items that
+		are guaranteed to have occurred, i.e. whose count exceeds its error,
+		most frequent first.
+		"""
+		ranked = sorted(self.counters.items(), key=lambda x: x[1][0], reverse=True)
+		return [ (item_id, count, error, ratings) for item_id, (count, error, ratings) in ranked if count > error ]
+
+
+def _sample_lines(json_f, samples, seed):
+	"""
+	Yields the lines following `samples` random byte offsets of `json_f`,
+	wrapping around to the first line past the end of the file.
+	"""
+	size = json_f.stat().st_size
+	if size == 0:
+		return
+	rng = random.Random(seed)
+	offsets = sorted(rng.randrange(size) for _ in range(samples))
+	with open(json_f, mode="rb") as json_h:
+		for offset in offsets:
+			json_h.seek(offset)
+			if offset > 0:
+				json_h.readline() # resync to the start of the next line
+			line = json_h.readline()
+			if not line:
+				json_h.seek(0)
+				line = json_h.readline()
+			yield line
+
+
+def gen_preview(amz_ds):
+	raw = amz_ds.joinpath("raw")
+	json_f = amz_io.raw_json_path(raw)
+	preview_f = raw.joinpath("stat.preview")
+	if amz_io.is_compressed(json_f):
+		print(f"Cannot preview {json_f}, compressed dumps do not support random access")
+		return
+	if json_f.stat().st_size == 0:
+		print(f"Cannot preview {json_f}, it is empty")
+		return
+	print(f"Previewing analytics of {amz_ds} from {preview_samples} samples into {preview_f}...")
+
+	stopwatch = dx.Stopwatch()
+	stopwatch.start()
+
+	project = amz_json.projector([ "asin", "overall" ])
+	sketch = SpaceSaving(preview_heavy_items)
+	item_freqs = {}
+	rating_stat = [ 0, 0, 0, 0, 0 ]
+	n = 0
+	sum_len = sum_len2 = 0
+	sum_rating = sum_rating2 = 0
+	for line in _sample_lines(json_f, preview_samples, preview_seed):
+		item_id, item_rating = project(line)
+		n_item_rating = int(float(item_rating))
+
+		n += 1
+		sum_len += len(line)
+		sum_len2 += len(line) ** 2
+		sum_rating += item_rating
+		sum_rating2 += item_rating ** 2
+		if 1 <= n_item_rating and n_item_rating <= 5:
+			rating_stat[n_item_rating - 1] += 1
+
+		sketch.add(item_id, n_item_rating)
+		item_freqs[item_id] = item_freqs.get(item_id, 0) + 1
+
+	stopwatch.stop()
+	print(f"Done sampling in {repr(stopwatch)}")
+	if n == 0:
+		print(f"No reviews sampled, not saving {preview_f}")
+		return
+
+	z = 1.96 # 95% confidence
+	size = json_f.stat().st_size
+
+	# The number of reviews is estimated from the mean line length, with
+	# its interval derived from that of the mean (delta method).
+	mean_len = sum_len / n
+	var_len = max(0, sum_len2 / n - mean_len ** 2)
+	tot_reviews = size / mean_len
+	tot_reviews_ci = z * size * math.sqrt(var_len / n) / mean_len ** 2
+
+	# The number of items is estimated with the Chao1 richness estimator
+	# from the number of items sampled once and twice.
+	f1 = sum(1 for c in item_freqs.values() if c == 1)
+	f2 = sum(1 for c in item_freqs.values() if c == 2)
+	seen_items = len(item_freqs)
+	if f2 > 0:
+		est_items = seen_items + f1 * f1 / (2 * f2)
+	else:
+		est_items = seen_items + f1 * (f1 - 1) / 2
+	est_items = min(max(est_items, seen_items), tot_reviews)
+
+	mean_rating = sum_rating / n
+	var_rating = max(0, sum_rating2 / n - mean_rating ** 2)
+	mean_rating_ci = z * math.sqrt(var_rating / n)
+
+	print(f"Saving statistics preview to {preview_f}...")
+	with open(preview_f, mode="w", buffering=write_buffer_size) as stat_h:
+		stat_h.write(f"Sampled reviews: {n} (with 95% confidence intervals)\n")
+		stat_h.write("\n")
+		stat_h.write(f"Total reviews: %.0f (+/- %.0f)\n" % (tot_reviews, tot_reviews_ci))
+		stat_h.write(f"Total items: %.0f (Chao1 estimate, {seen_items} sampled)\n" % (est_items))
+		stat_h.write(f"Average reviews/item: %.3f (estimated)\n" % (tot_reviews / est_items))
+
+		stat_h.write("\n")
+
+		for r in range(5, 0, -1):
+			p = rating_stat[r - 1] / n
+			p_ci = z * math.sqrt(p * (1 - p) / n)
+			stat_h.write(f"Total {r}/5 ratings: %.0f (%.3f %% +/- %.3f %%)\n" % (p * tot_reviews, 100 * p, 100 * p_ci))
+		stat_h.write(f"Average Rating: %.3f (+/- %.3f)\n" % (mean_rating, mean_rating_ci))
+
+		stat_h.write("\n")
+
+		# Sampled counts are scaled up to the whole dataset, their error is
+		# the sketch's overestimation plus the sampling error.
+		stat_h.write("%12s %10s %10s %10s %8s %8s %8s %8s %8s\n" % ("Item ID", "Freq", "+/-", "Freq %", "5/5 %", "4/5 %", "3/5 %", "2/5 %", "1/5 %"))
+		scale = tot_reviews / n
+		for item, count, error, ratings in sketch.top():
+			r1, r2, r3, r4, r5 = ratings
+			tot_local_rating = max(1, r1 + r2 + r3 + r4 + r5)
+
+			p = count / n
+			freq_ci = scale * (error + z * math.sqrt(n * p * (1 - p)))
+			freq = 100 * count * scale / est_items
+			percent_5 = 100 * r5 / tot_local_rating
+			percent_4 = 100 * r4 / tot_local_rating
+			percent_3 = 100 * r3 / tot_local_rating
+			percent_2 = 100 * r2 / tot_local_rating
+			percent_1 = 100 * r1 / tot_local_rating
+
+			stat_h.write("%12s %10.0f %10.0f %8.3f %% %6.1f %% %6.1f %% %6.1f %% %6.1f %% %6.1f %%\n" % (item, count * scale, freq_ci, freq, percent_5, percent_4, percent_3, percent_2, percent_1))
 	print("Ok.")
-			
+
+
+def gen_analytics(amz_ds):
+	raw = amz_ds.joinpath("raw")
+	json_f = amz_io.raw_json_path(raw)
+	stat_f = raw.joinpath("stat")
+	ckpt_f = raw.joinpath("stat.ckpt")
+	print(f"Generating analytics of {amz_ds} into {stat_f}...")
+
+	stopwatch = dx.Stopwatch()
+	aggregate = _aggregate_serial if worker_processes == 1 else _aggregate_parallel
+
+	# load and compute the data analytics
+	print(f"Processing statistics for {amz_ds}...")
+	stopwatch.start()
+	if amz_io.is_compressed(json_f):
+		agg = _aggregate_serial(json_f)
+	elif not incremental:
+		agg = aggregate(json_f)
+	else:
+		agg, start = _load_checkpoint(ckpt_f, json_f)
+		if agg is None:
+			agg = StatAggregate()
+		else:
+			print(f"Resuming from byte {start} of {json_f}")
+
+		# Only complete lines are processed, a trailing partial line may
+		# still be in the middle of being appended.
+		end = amz_shard.f_last_line_end(json_f)
+		if end < json_f.stat().st_size:
+			print(f"Skipping the incomplete last line of {json_f}")
+		if start < end:
+			agg.merge(aggregate(json_f, start, end))
+			_save_checkpoint(ckpt_f, json_f, agg, end)
+	stopwatch.stop()
+	print(f"Done processing in {repr(stopwatch)}")
+
+	# Save the statistics to a file
+	print(f"Saving statistics to {stat_f}...")
+	_write_stat(stat_f, agg)
+	print("Ok.")
+
 
 if __name__ == "__main__":
 	data = Path("data")
 	for dataset in data.iterdir():
 		is_amazon = dataset.name.startswith("amz")
-		if is_amazon:
+		if is_amazon and preview_samples > 0:
+			gen_preview(dataset)
+		elif is_amazon:
 			gen_analytics(dataset)
@@ -0,0 +1,197 @@
+"""
+A memory-mapped binary alternative to the `.table` text files written
+by `amz_gen_feature_index_table.py`.
+
+A binary table holds the n-grams of one order with their positive and
+negative counts, laid out as
+
+	header  the n-gram order, the entry count and the total, positive
+	        and negative counts of the text table's header
+	keys    uint64 per entry, the 64 bit BLAKE2b digest of the n-gram's
+	        words joined by spaces, in ascending order
+	pos     int64 per entry, positive count
+	neg     int64 per entry, negative count
+	rank    uint32 per entry, its line in the text table, most frequent
+	        first
+
+where each column starts on an 8 byte boundary and is stored in the
+native byte order of the machine that wrote it. Readers memory-map
+the file and look n-grams up a batch at a time by binary search over
+`keys`, so opening a table costs neither parsing nor heap. The words
+themselves are not stored; two n-grams of a table sharing a digest is
+refused when writing, and an n-gram outside the table matching one by
+chance has a probability of about `len(table) / 2^64`.
+
+Binary tables are named after the text table they mirror with a
+`.btable` suffix, e.g. `raw/all_uni.btable` for `raw/all_uni.table`.
+"""
+import sys
+import mmap
+import struct
+import hashlib
+
+import numpy as np
+
+
+_magic = b"AMZTBL01"
+
+# magic, byte order, n-gram order, entry count, total, positive and
+# negative counts, keys, pos, neg, rank, end of file
+_header = struct.Struct("<8s8sQQqqqQQQQQ")
+
+
+def btable_path(table_f):
+	"""
+	Returns the binary counterpart of the text table `table_f`.
+	"""
+	return table_f.with_suffix(".btable")
+
+
+def prefer_binary(table_f):
+	"""
+	Returns the binary counterpart of `table_f` if it exists and is at
+	least as recent as `table_f` itself, or `None` if the text table
+	should be read instead.
+	"""
+	btable_f = btable_path(table_f)
+	if not btable_f.exists():
+		return None
+	if table_f.exists() and table_f.stat().st_mtime > btable_f.stat().st_mtime:
+		return None
+	return btable_f
+
+
+def ngram_key(ngram):
+	"""
+	Returns the key of the n-gram given as a sequence of words.
+	"""
+	digest = hashlib.blake2b(" ".join(ngram).encode("utf-8"), digest_size=8).digest()
+	return int.from_bytes(digest, "little")
+
+
+def ngram_keys(ngrams):
+	"""
+	Returns the keys of `ngrams` as a uint64 array.
+	"""
+	return np.fromiter((ngram_key(ngram) for ngram in ngrams), dtype=np.uint64, count=len(ngrams))
+
+
+def _pad(handle):
+	padding = -handle.tell() % 8
+	if padding:
+		handle.write(b"\0" * padding)
+	return handle.tell()
+
+
+def write(path, order, ngrams, pos, neg, totals):
+	"""
+	Writes a binary table of `order`-grams to `path`, where `ngrams` are
+	the n-grams, as sequences of words, most frequent first, `pos` and
+	`neg` their counts and `totals` the total, positive and negative
+	counts of the table.
+	"""
+	keys = ngram_keys(ngrams)
+	by_key = np.argsort(keys, kind="stable")
+	keys = keys[by_key]
+	if len(keys) > 1 and (keys[1:] == keys[:-1]).any():
+		raise ValueError(f"two n-grams of {path} share a key")
+	pos = np.asarray(pos, dtype=np.int64)[by_key]
+	neg = np.asarray(neg, dtype=np.int64)[by_key]
+	rank = by_key.astype(np.uint32)
+
+	total, total_pos, total_neg = totals
+	with open(path, mode="wb") as handle:
+		handle.write(b"\0" * _header.size)
+		keys_at = _pad(handle)
+		keys.tofile(handle)
+		pos_at = _pad(handle)
+		pos.tofile(handle)
+		neg_at = _pad(handle)
+		neg.tofile(handle)
+		rank_at = _pad(handle)
+		rank.tofile(handle)
+		end = handle.tell()
+
+		handle.seek(0)
+		handle.write(_header.pack(
+			_magic, sys.byteorder.encode("ascii").ljust(8, b"\0"),
+			order, len(keys), total, total_pos, total_neg,
+			keys_at, pos_at, neg_at, rank_at, end))
+
+
+class BinaryTable:
+	"""
+	Memory-maps a binary table for reading. The header counts are in
+	`order`, `total`, `total_pos` and `total_neg`, and n-grams are looked
+	up with `lookup` and `get`.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, mode="rb") as handle:
+			self.mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, byteorder, self.order, n, self.total, self.total_pos, self.total_neg, \
+			keys_at, pos_at, neg_at, rank_at, end = _header.unpack_from(self.mm, 0)
+		if magic != _magic:
+			self.close()
+			raise ValueError(f"{path} is not a binary table")
+		if byteorder.rstrip(b"\0").decode("ascii") != sys.byteorder:
+			self.close()
+			raise ValueError(f"{path} was written with a different byte order")
+
+		self.keys = np.frombuffer(self.mm, dtype=np.uint64, count=n, offset=keys_at)
+		self.pos = np.frombuffer(self.mm, dtype=np.int64, count=n, offset=pos_at)
+		self.neg = np.frombuffer(self.mm, dtype=np.int64, count=n, offset=neg_at)
+		self.rank = np.frombuffer(self.mm, dtype=np.uint32, count=n, offset=rank_at)
+
+	def __len__(self):
+		return len(self.keys)
+
+	def lookup(self, ngrams, max_entries=None):
+		"""
+		Returns the positive counts, negative counts and a mask of which of
+		`ngrams` were found, as arrays parallel to `ngrams`. Only the
+		`max_entries` most frequent n-grams are found if it is given, as if
+		the text table had been read up to that line.
+		"""
+		keys = ngram_keys(ngrams)
+		if len(self.keys) == 0:
+			found = np.zeros(len(keys), dtype=bool)
+			return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=np.int64), found
+		i = np.searchsorted(self.keys, keys)
+		i[i == len(self.keys)] = 0
+		found = self.keys[i] == keys
+		if max_entries is not None:
+			found &= self.rank[i] < max_entries
+		return np.where(found, self.pos[i], 0), np.where(found, self.neg[i], 0), found
+
+	def get(self, ngram, max_entries=None):
+		"""
+		Returns the `(pos, neg)` counts of `ngram`, or `None` if it is not
+		in the table.
+		"""
+		pos, neg, found = self.lookup([ ngram ], max_entries)
+		return (int(pos[0]), int(neg[0])) if found[0] else None
+
+	def counts(self, ngrams, max_entries=None):
+		"""
+		Returns the `(pos, neg)` counts of those of `ngrams` in the table,
+		in order.
+		"""
+		pos, neg, found = self.lookup(ngrams, max_entries)
+		return list(zip(pos[found].tolist(), neg[found].tolist()))
+
+	def close(self):
+		if self.mm is None:
+			return
+		# the arrays export the map's buffer, which must be released first
+		self.keys = self.pos = self.neg = self.rank = None
+		self.mm.close()
+		self.mm = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,301 @@
+"""
+A batch scorer compatible with the compound score of NLTK's VADER
+`SentimentIntensityAnalyzer.polarity_scores`, which scores a whole
+batch of reviews with NumPy instead of walking every token in Python.
+
+The lexicon, boosters and negations of an analyzer are compiled once
+into per-token property arrays indexed by integer token ids. Each
+review is then only split into tokens and mapped to ids in Python,
+while the VADER rules, which look at no more than three tokens either
+side of a sentiment word, are evaluated for every token of the batch
+at once on shifted copies of the concatenated id array.
+
+The rules, including NLTK's quirks, are reproduced as implemented in
+NLTK 3.5+: repeated tokens take the valence of their first occurrence,
+and only the first "but" of a review shifts the emphasis. Compound
+scores are rounded to 4 decimals like `polarity_scores` does and
+match it up to floating point summation order.
+"""
+import math
+import string
+from itertools import chain
+
+import numpy as np
+
+
+_punctuation = frozenset(string.punctuation)
+
+# Token flags, stored as a bitmask per token id. The `_LOWER_*` flags
+# test the lowercased token, the `_EXACT_*` flags the token as is,
+# just like the corresponding checks of the analyzer.
+_LOWER_LEAST = 1 << 0
+_LOWER_AT_VERY = 1 << 1
+_LOWER_BUT = 1 << 2
+_LOWER_KIND = 1 << 3
+_LOWER_OF = 1 << 4
+_EXACT_NEVER = 1 << 5
+_EXACT_SO_THIS = 1 << 6
+_NEGATED = 1 << 7
+_IN_LEXICON = 1 << 8
+_UPPER = 1 << 9
+
+
+class BatchScorer:
+	"""
+	Scores batches of texts with the lexicon and constants of the VADER
+	`analyzer`, a `SentimentIntensityAnalyzer`.
+	"""
+
+	def __init__(self, analyzer):
+		constants = analyzer.constants
+		self.lexicon = analyzer.lexicon
+		self.boosters = constants.BOOSTER_DICT
+		self.negations = constants.NEGATE
+		self.idioms = constants.SPECIAL_CASE_IDIOMS
+		self.punctuation = frozenset(constants.PUNC_LIST)
+		self.b_decr = constants.B_DECR
+		self.c_incr = constants.C_INCR
+		self.n_scalar = constants.N_SCALAR
+
+		# Maps a raw whitespace separated token to the id of the token it
+		# becomes once stripped of punctuation, or -1 if it is dropped.
+		self.raw_ids = {}
+
+		# Maps a token to its id, where id 0 is the padding token that
+		# stands in for the neighbours of the first and last tokens.
+		self.ids = { "": 0 }
+		self.valences = np.zeros(1024)
+		self.booster_values = np.zeros(1024)
+		self.flags = np.zeros(1024, dtype=np.uint16)
+
+	def _add_token(self, token):
+		i = len(self.ids)
+		self.ids[token] = i
+		if i == len(self.flags):
+			self.valences = np.concatenate((self.valences, np.zeros(i)))
+			self.booster_values = np.concatenate((self.booster_values, np.zeros(i)))
+			self.flags = np.concatenate((self.flags, np.zeros(i, dtype=np.uint16)))
+
+		lower = token.lower()
+		flags = 0
+		if lower in self.lexicon:
+			flags |= _IN_LEXICON
+			self.valences[i] = self.lexicon[lower]
+		self.booster_values[i] = self.boosters.get(lower, 0.0)
+		if token.isupper():
+			flags |= _UPPER
+		if lower in self.negations or "n't" in lower:
+			flags |= _NEGATED
+		if lower == "least":
+			flags |= _LOWER_LEAST
+		if lower in ("at", "very"):
+			flags |= _LOWER_AT_VERY
+		if lower == "but":
+			flags |= _LOWER_BUT
+		if lower == "kind":
+			flags |= _LOWER_KIND
+		if lower == "of":
+			flags |= _LOWER_OF
+		if token == "never":
+			flags |= _EXACT_NEVER
+		if token in ("so", "this"):
+			flags |= _EXACT_SO_THIS
+		self.flags[i] = flags
+		return i
+
+	def _raw_id(self, raw):
+		"""
+		Maps a raw token the way `SentiText` does: tokens of a single
+		character are dropped, and a word with a leading or trailing run of
+		punctuation from the analyzer's list is stripped of it.
+		"""
+		token = raw
+		if len(raw) < 2:
+			self.raw_ids[raw] = -1
+			return -1
+		if raw[0] in _punctuation:
+			j = 1
+			while j < len(raw) and raw[j] in _punctuation:
+				j += 1
+			word = raw[j:]
+			if raw[:j] in self.punctuation and len(word) > 1 and \
+			   not any(c in _punctuation for c in word):
+				token = word
+		elif raw[-1] in _punctuation:
+			j = len(raw) - 1
+			while j > 0 and raw[j - 1] in _punctuation:
+				j -= 1
+			word = raw[:j]
+			if raw[j:] in self.punctuation and len(word) > 1 and \
+			   not any(c in _punctuation for c in word):
+				token = word
+		i = self.ids.get(token)
+		if i is None:
+			i = self._add_token(token)
+		self.raw_ids[raw] = i
+		return i
+
+	def _token_ids(self, text):
+		raw_ids = self.raw_ids
+		ids = []
+		for raw in text.split():
+			i = raw_ids.get(raw)
+			if i is None:
+				i = self._raw_id(raw)
+			if i >= 0:
+				ids.append(i)
+		return ids
+
+	def _phrase_ids(self, phrase):
+		ids = [ self.ids.get(word, -1) for word in phrase.split() ]
+		return None if -1 in ids else ids
+
+	def compound(self, texts):
+		"""
+		Returns the compound score of each of the `texts`.
+		"""
+		reviews = [ self._token_ids(text) for text in texts ]
+		lens = np.fromiter((len(ids) for ids in reviews), dtype=np.int64, count=len(reviews))
+		n_tokens = int(lens.sum())
+		if n_tokens == 0:
+			return [ 0.0 ] * len(texts)
+
+		tok = np.fromiter(chain.from_iterable(reviews), dtype=np.int64, count=n_tokens)
+		review = np.repeat(np.arange(len(reviews)), lens)
+		starts = np.cumsum(lens) - lens
+		j = np.arange(n_tokens) - starts[review]
+		n = lens[review]
+
+		def _prev(k):
+			shifted = np.zeros(n_tokens, dtype=np.int64)
+			shifted[k:] = tok[:-k]
+			shifted[j < k] = 0
+			return shifted
+
+		def _next(k):
+			shifted = np.zeros(n_tokens, dtype=np.int64)
+			shifted[:-k] = tok[k:]
+			shifted[j + k >= n] = 0
+			return shifted
+
+		flags = self.flags[tok]
+		upper = ((flags & _UPPER) != 0).astype(np.float64)
+		upper_tokens = np.bincount(review, weights=upper, minlength=len(reviews))
+		cap_diff = ((upper_tokens > 0) & (upper_tokens < lens))[review]
+
+		in_lexicon = (flags & _IN_LEXICON) != 0
+		v = self.valences[tok].copy()
+		caps = in_lexicon & cap_diff & ((flags & _UPPER) != 0)
+		v = np.where(caps, np.where(v > 0, v + self.c_incr, v - self.c_incr), v)
+
+		prev = [ tok, _prev(1), _prev(2), _prev(3) ]
+		prev_flags = [ flags ] + [ self.flags[p] for p in prev[1:] ]
+		so_this = [ (f & _EXACT_SO_THIS) != 0 for f in prev_flags ]
+		never = [ (f & _EXACT_NEVER) != 0 for f in prev_flags ]
+		negated = [ (f & _NEGATED) != 0 for f in prev_flags ]
+
+		for start_i, damping in enumerate((1.0, 0.95, 0.9)):
+			k = start_i + 1
+			cond = in_lexicon & (j > start_i) & ((prev_flags[k] & _IN_LEXICON) == 0)
+
+			booster = self.booster_values[prev[k]]
+			s = np.where(v < 0, -booster, booster)
+			capped = (booster != 0) & ((prev_flags[k] & _UPPER) != 0) & cap_diff
+			s = np.where(capped, np.where(v > 0, s + self.c_incr, s - self.c_incr), s)
+			v = np.where(cond, v + s * damping, v)
+
+			if start_i == 0:
+				scale = np.where(negated[1], self.n_scalar, 1.0)
+			elif start_i == 1:
+				scale = np.where(never[2] & so_this[1], 1.5,
+					np.where(negated[2], self.n_scalar, 1.0))
+			else:
+				scale = np.where((never[3] & so_this[2]) | so_this[1], 1.25,
+					np.where(negated[3], self.n_scalar, 1.0))
+			v = np.where(cond, v * scale, v)
+
+			if start_i == 2:
+				v = np.where(cond, self._idioms(v, prev, _next), v)
+
+		least = ((prev_flags[1] & _LOWER_LEAST) != 0) & ((prev_flags[1] & _IN_LEXICON) == 0)
+		least &= (j == 1) | ((j > 1) & ((prev_flags[2] & _LOWER_AT_VERY) == 0))
+		v = np.where(in_lexicon & least, v * self.n_scalar, v)
+
+		next_1 = _next(1)
+		kind_of = ((flags & _LOWER_KIND) != 0) & ((self.flags[next_1] & _LOWER_OF) != 0) & (j < n - 1)
+		v = np.where(in_lexicon & ~kind_of & (self.booster_values[tok] == 0), v, 0.0)
+
+		# Repeated tokens take the valence of their first occurrence.
+		_, first, inverse = np.unique(review * len(self.ids) + tok, return_index=True, return_inverse=True)
+		sentiments = v[first[inverse.reshape(-1)]]
+
+		no_but = np.iinfo(np.int64).max
+		but_j = np.where((flags & _LOWER_BUT) != 0, j, no_but)
+		nonempty = lens > 0
+		first_but = np.full(len(reviews), no_but)
+		first_but[nonempty] = np.minimum.reduceat(but_j, starts[nonempty])
+		bi = first_but[review]
+		sentiments = np.where(bi == no_but, sentiments,
+			np.where(j < bi, sentiments * 0.5, np.where(j > bi, sentiments * 1.5, sentiments)))
+
+		sums = np.bincount(review, weights=sentiments, minlength=len(reviews))
+		scores = []
+		for text, sum_s in zip(texts, sums.tolist()):
+			ep_count = min(text.count("!"), 4)
+			qm_count = text.count("?")
+			amplifier = ep_count * 0.292
+			if qm_count > 1:
+				amplifier += qm_count * 0.18 if qm_count <= 3 else 0.96
+			if sum_s > 0:
+				sum_s += amplifier
+			elif sum_s < 0:
+				sum_s -= amplifier
+			scores.append(round(sum_s / math.sqrt(sum_s * sum_s + 15), 4))
+		return scores
+
+	def _idioms(self, v, prev, _next):
+		"""
+		Applies the idiom and booster bigram checks done for sentiment words
+		with three preceding tokens, where `prev[k]` holds the ids of the
+		tokens `k` before each token.
+		"""
+		next_ = [ prev[0], _next(1), _next(2) ]
+
+		def _match(phrase, window):
+			ids = self._phrase_ids(phrase)
+			if ids is None or len(ids) != len(window):
+				return None
+			matched = window[0] == ids[0]
+			for w, i in zip(window[1:], ids[1:]):
+				matched &= w == i
+			return matched
+
+		# in decreasing priority, the first matching sequence wins
+		sequences = [
+			(prev[1], prev[0]),
+			(prev[2], prev[1], prev[0]),
+			(prev[2], prev[1]),
+			(prev[3], prev[2], prev[1]),
+			(prev[3], prev[2]),
+		]
+		idiom_v = v
+		for window in reversed(sequences):
+			for phrase, value in self.idioms.items():
+				matched = _match(phrase, window)
+				if matched is not None:
+					idiom_v = np.where(matched, value, idiom_v)
+
+		# sequences following the token override the preceding ones
+		for window in ((next_[0], next_[1]), (next_[0], next_[1], next_[2])):
+			for phrase, value in self.idioms.items():
+				matched = _match(phrase, window)
+				if matched is not None:
+					idiom_v = np.where(matched & (window[-1] != 0), value, idiom_v)
+
+		boosted = np.zeros(len(v), dtype=bool)
+		for window in ((prev[3], prev[2]), (prev[2], prev[1])):
+			for phrase in self.boosters:
+				matched = _match(phrase, window)
+				if matched is not None:
+					boosted |= matched
+		return np.where(boosted, idiom_v + self.b_decr, idiom_v)
@@ -0,0 +1,191 @@
+"""
+A persistent, content-addressed cache of VADER compound scores, shared
+by every script that scores reviews with NLTK's `SentimentIntensityAnalyzer`.
+
+Scores are keyed by a digest of the exact text that was scored, so
+reruns with different reduction parameters reuse the scores of every
+text already seen, whichever script scored it first.
+
+The cache is stored in `data/vader.cache` as a header followed by
+fixed-size records, each a 16 byte BLAKE2b digest of the UTF-8 text and
+its compound score as a little-endian double. New scores are appended
+to the file, as are the records of the scores used again, and the whole
+file is loaded into a hash index on open, ordered by the last record of
+each score, i.e. from least to most recently used across runs. Once the
+cache grows past `max_entries`, or its file past twice as many records,
+the least recently used entries are evicted by rewriting the file.
+Records are appended every `flush_records` lookups, so an interrupted
+run loses no more than that.
+"""
+import os
+import struct
+import hashlib
+from pathlib import Path
+
+
+# The path of the cache, shared by all datasets.
+cache_path = Path("data/vader.cache")
+
+# The maximum number of scores kept in the cache, where each score takes
+# 24 bytes on disk, 2^22 = ~100MB.
+max_entries = 2 ** 22
+
+# The number of new or used again scores kept in memory before they are
+# appended to the file.
+flush_records = 2 ** 16
+
+_magic = b"AMZVDR01"
+
+_record = struct.Struct("<16sd")
+
+
+def digest(text):
+	return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class ScoreCache:
+	"""
+	The scores of a cache file, loaded into a dictionary ordered from least
+	to most recently used. Hits and misses are counted for `report`.
+
+	Worker processes forked after the cache is opened can `lookup` scores
+	in their copy of it, leaving the parent process to `record` each
+	lookup, since only the parent writes the cache file.
+	"""
+
+	def __init__(self, path=None, capacity=None):
+		self.path = Path(path) if path is not None else cache_path
+		self.capacity = capacity if capacity is not None else max_entries
+		self.scores = {}
+		# the scores to append, ordered from least to most recently used
+		self.appended = {}
+		# the number of records in the file
+		self.records = 0
+		self.hits = 0
+		self.misses = 0
+		self._load()
+
+	def _load(self):
+		if not self.path.exists():
+			return
+		with open(self.path, mode="rb") as cache_h:
+			data = cache_h.read()
+		if data[:len(_magic)] != _magic:
+			print(f"Discarding VADER score cache {self.path} of an unknown format")
+			self.path.unlink()
+			return
+		end = len(data) - (len(data) - len(_magic)) % _record.size
+		scores = self.scores
+		for key, compound in _record.iter_unpack(memoryview(data)[len(_magic):end]):
+			# the last record of a score is its most recent use
+			scores.pop(key, None)
+			scores[key] = compound
+		self.records = (end - len(_magic)) // _record.size
+		if end != len(data):
+			# drop a record partially written by an interrupted run
+			os.truncate(self.path, end)
+
+	def __len__(self):
+		return len(self.scores)
+
+	def lookup(self, text):
+		"""
+		Returns the cached compound score of `text`, or `None` if it is not
+		cached. Lookups are not counted, see `record`.
+		"""
+		return self.scores.get(digest(text))
+
+	def record(self, text, compound, hit):
+		"""
+		Counts a `lookup` of `text`, which was a `hit` or a miss after which
+		`text` was scored as `compound`, and caches the score of a miss.
+		"""
+		key = digest(text)
+		if hit:
+			self.hits += 1
+			compound = self.scores.pop(key, compound)
+		else:
+			self.misses += 1
+			self.scores.pop(key, None)
+		# move to the most recently used end, in memory and in the file
+		self.scores[key] = compound
+		self.appended.pop(key, None)
+		self.appended[key] = None
+		if len(self.appended) >= flush_records:
+			self.flush()
+
+	def score(self, text, polarity_scores):
+		"""
+		Returns the compound score of `text`, calling `polarity_scores(text)`
+		on a miss, and whether it was a hit. The lookup is not counted.
+		"""
+		compound = self.lookup(text)
+		if compound is not None:
+			return compound, True
+		return polarity_scores(text)["compound"], False
+
+	def score_batch(self, texts, compound_batch):
+		"""
+		Returns the compound score of each of the `texts` and whether it was a
+		hit, calling `compound_batch` once with the list of texts missed. The
+		lookups are not counted.
+		"""
+		scores = [ self.lookup(text) for text in texts ]
+		missed = [ text for text, compound in zip(texts, scores) if compound is None ]
+		computed = iter(compound_batch(missed) if missed else ())
+		return [ (next(computed), False) if compound is None else (compound, True) for compound in scores ]
+
+	def compound(self, text, polarity_scores):
+		"""
+		Returns the compound score of `text`, calling `polarity_scores(text)`
+		on a miss, and counts the lookup.
+		"""
+		compound, hit = self.score(text, polarity_scores)
+		self.record(text, compound, hit)
+		return compound
+
+	def flush(self):
+		"""
+		Writes the scores cached or used again since the last flush, evicting
+		the least recently used entries if the cache holds more than its
+		capacity, or rewriting the file if it holds more than twice as many
+		records.
+		"""
+		if len(self.scores) > self.capacity or self.records + len(self.appended) > 2 * self.capacity:
+			self._compact()
+		elif self.appended:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			new = not self.path.exists()
+			with open(self.path, mode="ab") as cache_h:
+				if new:
+					cache_h.write(_magic)
+				cache_h.writelines(_record.pack(key, self.scores[key]) for key in self.appended)
+			self.records += len(self.appended)
+		self.appended = {}
+
+	def _compact(self):
+		keys = list(self.scores)
+		for key in keys[:len(keys) - self.capacity]:
+			del self.scores[key]
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		tmp_f = self.path.with_name(self.path.name + ".tmp")
+		with open(tmp_f, mode="wb") as cache_h:
+			cache_h.write(_magic)
+			cache_h.writelines(_record.pack(key, compound) for key, compound in self.scores.items())
+		os.replace(tmp_f, self.path)
+		self.records = len(self.scores)
+
+	def report(self):
+		lookups = self.hits + self.misses
+		print("VADER score cache: %d hits, %d misses (%.2f%% hit rate), %d entries" % (
+			self.hits, self.misses, 100 * self.hits / lookups if lookups else 0, len(self)))
+
+	def close(self):
+		self.flush()
+		self.report()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
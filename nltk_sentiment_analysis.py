@@ -1,21 +1,14 @@
 import pandas as pd
-import nltk
 
-from nltk.corpus import wordnet as wn
-from nltk.corpus import sentiwordnet as swn
-from nltk.corpus import stopwords
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from nltk import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem.porter import PorterStemmer
-import string
-from nltk.stem import WordNetLemmatizer
+from pathlib import Path
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.svm import LinearSVC
-from sklearn.metrics import accuracy_score
-from sklearn.model_selection import train_test_split
+import amz_columnar
+import amz_models
+import amz_norm
+import amz_vader_cache
+
+# sklearn and NLTK's tagger are only imported by the steps that use them,
+# so that a missing dataset fails before they are loaded.
 
 
 '''
@@ -23,10 +16,14 @@ Loading test and train data for electronics reviews.
 Filter data by removing ratings which are neutral (3 stars) and choose ratings between length 1250 and 1500. 
 '''
 
+def load_data(csv_f):
+    rows = [ row for row in amz_columnar.read_rows(csv_f) if row[0] ]
+    return pd.DataFrame(rows, columns=['review', 'rating'])
+
 print('Loading data...')
 
-train_elec = pd.read_csv('data/amz-electronics/raw/csv-train', names=['review', 'rating', 'product']).dropna()
-test_elec = pd.read_csv('data/amz-electronics/raw/csv-test', names=['review', 'rating', 'product']).dropna()
+train_elec = load_data(Path('data/amz-electronics/raw/csv-train'))
+test_elec = load_data(Path('data/amz-electronics/raw/csv-test'))
 
 test_elec['review length'] = test_elec['review'].apply(len)
 test_elec = test_elec[(test_elec['review length'] > 1250) & (test_elec['review length'] < 1500)]
@@ -44,9 +41,13 @@ I used Vader Sentiment Analyzer for determining sentiment for each review.
 '''
 
 def sentiment_analysis (data):
-    sid = SentimentIntensityAnalyzer()
-    s = data['review'].apply(lambda x: sid.polarity_scores(x.lower())['compound'])
-    return s
+    scorer = amz_models.vader_scorer()
+    texts = [ x.lower() for x in data['review'] ]
+    with amz_vader_cache.ScoreCache() as cache:
+        scores = cache.score_batch(texts, scorer.compound)
+        for text, (compound, hit) in zip(texts, scores):
+            cache.record(text, compound, hit)
+    return pd.Series([ compound for compound, hit in scores ], index=data.index)
 
 train_elec['vader sentiment'] = sentiment_analysis(train_elec)
 test_elec['vader sentiment'] = sentiment_analysis(test_elec)
@@ -54,6 +55,7 @@ test_elec['vader sentiment'] = sentiment_analysis(test_elec)
 train_elec['binary sentiment'] = train_elec['vader sentiment'] >= 0
 test_elec['binary sentiment'] = test_elec['vader sentiment'] >= 0
 
+from sklearn.metrics import accuracy_score
 
 # train data sentiment accuracy
 print("Sentiment Accuracy for train data: ", accuracy_score(train_elec['rating'] > 3, train_elec['binary sentiment'])) 
@@ -67,12 +69,8 @@ Normalization. I apply lemmatizer to the text, which offers better stemming than
 This also removes any puncutation marks. The stopwords are handleled later by the CountVectorizer. 
 '''
 
-lemmatizer = WordNetLemmatizer()
-
 def normalization(text):
-    text = text.lower().translate(str.maketrans('', '', string.punctuation))
-    lemmatized = ' '.join([lemmatizer.lemmatize(word) for word in text.split(' ')])
-    return lemmatized
+    return amz_norm.lemmatize(amz_norm.strip_punct(text.lower()))
 
 train_elec['review clean'] = train_elec['review'].apply(normalization)
 test_elec['review clean'] = test_elec['review'].apply(normalization)
@@ -83,6 +81,10 @@ print('Finished normalization. Starting vectorizing bigrams and unigrams')
 Vectorizing all possible unigrams and bigrams through CountVectorizer
 '''
 
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.svm import LinearSVC
+
 ngram_vectorizer = CountVectorizer(binary=True, ngram_range=(1, 2), stop_words=['in','of','at','a','the'])
 ngram_vectorizer.fit(train_elec['review clean'])
 X = ngram_vectorizer.transform(train_elec['review clean'])
@@ -110,6 +112,9 @@ print("Manually picking bigrams...")
 Custom bigrams detection as mentioned in the Thumbs Up and Down paper. 
 '''
 
+import nltk
+from nltk import word_tokenize
+
 def bigrams (f, s, t):
     if f[:2] == 'NN' and s[:2] == 'JJ' and t[:2] != 'NN':
         return True